@@ -3,14 +3,34 @@ from __future__ import annotations
 import os
 import shutil
 import sqlite3
+import tempfile
 import openpyxl
 import tkinter as tk
 from tkinter import messagebox
 import datetime as dt
 from pathlib import Path
 import re
+import unicodedata
 from copy import copy
 import json
+import csv
+import sys
+import argparse
+import hashlib
+import stat
+import time
+import socket
+import threading
+import functools
+import contextlib
+import uuid
+import queue
+import zipfile
+import zlib
+import itertools
+import bisect
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Dict, Optional, Iterator
 
@@ -27,6 +47,275 @@ SHEET_HEADER_ROWS       = 1    # 1 行目は常に見出し
 ARTICLE_ROWS_PER_SHEET  = SHEET_TOTAL_ROWS - SHEET_HEADER_ROWS  # = 36
 MIN_NIGHT_ROWS   = 5   # ヘッダー2行＋最低3行の本文を書きたい
 
+# ------------------------------------------------------------------
+# 排他制御 : 複数の端末から同じフォルダを使うとき用
+# ------------------------------------------------------------------
+
+LOCK_TIMEOUT    = 300    # ロック待ちの上限（秒）。この間は順番待ちする
+LOCK_STALE      = 120    # この秒数だけ更新の無いロック・順番札は放置されたとみなす
+LOCK_POLL       = 0.5    # ロック待ちの確認間隔（秒）
+DB_BUSY_TIMEOUT = 30     # SQLite の busy timeout（秒）
+DB_RETRIES      = 5      # "database is locked" のときの再試行回数
+
+
+class LockTimeout(Exception):
+    """ロック待ちが LOCK_TIMEOUT を超えたときに送出する。"""
+
+
+_held_locks: Dict[tuple, "FileLock"] = {}   # (パス, スレッド ID) → 持っているロック（再入用）
+_held_guard = threading.Lock()
+
+
+class FileLock:
+    """
+    '<対象ファイル>.lock' を排他作成する方式のファイルロック。
+    ・待つ側は '<対象ファイル>.lock.queue/' に順番札を置き、先頭の札の端末から取得する
+    ・持っている間は別スレッドでロックファイルを定期的に更新（ハートビート）する
+    ・LOCK_STALE 秒更新の無いロック・札は、落ちた端末の残骸として取り除く
+    ・同じスレッド内では再入可能（転記の途中で同じファイルを再度ロックしても待たない）
+      別のスレッドは別の持ち主として順番待ちする（スレッドプールで持ち分を共有しない）
+    """
+
+    def __init__(self, path: str | Path, *, timeout: float = LOCK_TIMEOUT,
+                 stale_after: float = LOCK_STALE):
+        self.path = Path(path).resolve()
+        self.lock_path = Path(f"{self.path}.lock")
+        self.queue_dir = Path(f"{self.path}.lock.queue")
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.token = uuid.uuid4().hex
+        self._depth = 0
+        self._key: tuple | None = None
+        self._owner: "FileLock | None" = None
+        self._stop = threading.Event()
+        self._beat: threading.Thread | None = None
+
+    # ---------- 取得 / 解放 ----------
+    def acquire(self) -> None:
+        key = (str(self.path), threading.get_ident())
+        with _held_guard:
+            held = _held_locks.get(key)
+            if held is not None:
+                held._depth += 1
+                self._owner = held
+                return
+
+        ticket = self._enqueue()
+        deadline = time.monotonic() + self.timeout
+        try:
+            while True:
+                ticket.touch()
+                if self._first_in_queue(ticket) and self._try_create():
+                    break
+                if time.monotonic() > deadline:
+                    raise LockTimeout(f"{self.path.name} は {self._holder()} が使用中です。")
+                time.sleep(LOCK_POLL)
+        finally:
+            ticket.unlink(missing_ok=True)
+            try:
+                self.queue_dir.rmdir()      # 誰も待っていなければ片付ける
+            except OSError:
+                pass
+
+        with _held_guard:
+            self._depth = 1
+            self._key = key
+            _held_locks[key] = self
+        self._stop.clear()
+        self._beat = threading.Thread(target=self._heartbeat, daemon=True)
+        self._beat.start()
+
+    def release(self) -> None:
+        # 深さの増減と表からの削除は同じガードの中で行う（取得側と食い違わないように）
+        with _held_guard:
+            if self._owner is not None:
+                self._owner._depth -= 1
+                self._owner = None
+                return
+            self._depth -= 1
+            if self._depth > 0:
+                return
+            _held_locks.pop(self._key, None)
+        self._stop.set()
+        if self._beat:
+            self._beat.join()
+        if _read_stamp(self.lock_path)[:1] == [self.token]:
+            self.lock_path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    # ---------- 内部 ----------
+    def _stamp(self) -> str:
+        # 1 行目: token / 2 行目: PC 名 / 3 行目: プロセス ID / 4 行目: 取得時刻
+        return "\n".join((self.token, socket.gethostname(), str(os.getpid()),
+                          dt.datetime.now().isoformat(timespec="seconds"))) + "\n"
+
+    def _enqueue(self) -> Path:
+        # 順番札を置く。フォルダは他の端末が片付けることがあるので作り直して再試行
+        ticket = self.queue_dir / f"{time.time_ns():020d}-{self.token}.ticket"
+        while True:
+            self.queue_dir.mkdir(parents=True, exist_ok=True)
+            try:
+                ticket.write_text(self._stamp(), encoding="utf-8")
+                return ticket
+            except FileNotFoundError:
+                continue
+
+    def _try_create(self) -> bool:
+        try:
+            fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if self._is_stale(self.lock_path):
+                self._break(self.lock_path)
+            return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(self._stamp())
+        return True
+
+    def _first_in_queue(self, ticket: Path) -> bool:
+        for other in sorted(self.queue_dir.glob("*.ticket")):
+            if other == ticket:
+                return True
+            if self._is_stale(other):
+                other.unlink(missing_ok=True)
+                continue
+            return False
+        return True
+
+    def _is_stale(self, path: Path) -> bool:
+        try:
+            age = time.time() - path.stat().st_mtime
+        except FileNotFoundError:
+            return False
+        if age > self.stale_after:
+            return True
+        # 同じ PC で持ち主のプロセスが既に居なければ待つ必要はない
+        stamp = _read_stamp(path)
+        if len(stamp) < 3 or not stamp[2].isdigit():
+            return False
+        return stamp[1] == socket.gethostname() and not _pid_alive(int(stamp[2]))
+
+    def _break(self, path: Path) -> None:
+        # 別名へ退避してから消す（同時に壊しに来た端末と新しいロックを消し合わない）
+        grave = path.with_name(f"{path.name}.{self.token}.stale")
+        try:
+            os.replace(path, grave)
+        except FileNotFoundError:
+            return
+        if self._is_stale(grave):
+            grave.unlink(missing_ok=True)
+        else:
+            # 退避の直前に作り直された新しいロックだった → 戻す
+            try:
+                os.link(grave, path)
+            except FileExistsError:
+                pass
+            grave.unlink(missing_ok=True)
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(self.stale_after / 4):
+            try:
+                os.utime(self.lock_path)
+            except FileNotFoundError:
+                return
+
+    def _holder(self) -> str:
+        stamp = _read_stamp(self.lock_path)
+        return stamp[1] if len(stamp) > 1 else "別の端末"
+
+
+def _read_stamp(path: Path) -> List[str]:
+    """
+    ロックファイル・順番札の中身を行のリストで返す。読めなければ空リスト。
+    """
+    try:
+        return path.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return []
+
+
+def _pid_alive(pid: int) -> bool:
+    """
+    同じ PC 上でプロセスが生きているか。判定できない OS では生きているとみなす。
+    """
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@contextlib.contextmanager
+def lock_files(paths):
+    """
+    複数ファイルをパス順にロックする（端末同士が逆順に待ち合って止まらないように）。
+    """
+    with contextlib.ExitStack() as stack:
+        for p in sorted({str(Path(p).resolve()) for p in paths}):
+            stack.enter_context(FileLock(p))
+        yield
+
+
+def connect_db(db_path: str | Path, *, readonly: bool = False) -> sqlite3.Connection:
+    """
+    busy timeout 付きで DB を開く。他の端末が書き込み中なら待ってから続ける。
+    SQL 関数 normalize_key() / content_digest() / cold_text() も登録する。
+    readonly=True なら読み取り専用で開く（閲覧・出力用。スキーマの変更も書き込みもしない）。
+    このときファイルが無ければ作らずに FileNotFoundError を出す。
+    """
+    if readonly:
+        path = Path(db_path).resolve()
+        if not path.is_file():
+            raise FileNotFoundError(f"DB が見つかりません: {db_path}")
+        conn = sqlite3.connect(f"{path.as_uri()}?mode=ro", uri=True, timeout=DB_BUSY_TIMEOUT)
+    else:
+        conn = sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT)
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT * 1000}")
+    # 照合キーを SQL からも作れるように（name_key 列の埋め直しなどで使う）
+    conn.create_function("normalize_key", 1, normalize_key, deterministic=True)
+    # 圧縮済みの本文を diary_entries_text ビューから読めるように（Part R 参照）
+    conn.create_function("content_digest", 1, content_digest, deterministic=True)
+    conn.create_function("cold_text", 3, _cold_reader(conn), deterministic=True)
+    return conn
+
+
+def is_locked_error(e: BaseException) -> bool:
+    """
+    "database is locked" / "database is busy"（待てば通る失敗）かどうか。
+    """
+    msg = str(e).lower()
+    return isinstance(e, sqlite3.OperationalError) and ("locked" in msg or "busy" in msg)
+
+
+def retry_on_locked(func):
+    """
+    "database is locked" / "database is busy" で失敗した書き込み関数を、間隔を空けて再実行する。
+    関数は最初からやり直しても結果が同じになるように書くこと。
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(DB_RETRIES):
+            try:
+                return func(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if not is_locked_error(e) or attempt == DB_RETRIES - 1:
+                    raise
+                # 接続を受け取る関数なら途中まで進んだトランザクションを捨ててからやり直す
+                if args and isinstance(args[0], sqlite3.Connection):
+                    args[0].rollback()
+                time.sleep(0.2 * 2 ** attempt)
+    return wrapper
+
+
 # ------------------------------------------------------------------
 # Part A : personal_pointer テーブルと基本ユーティリティ
 # ------------------------------------------------------------------
@@ -36,7 +325,7 @@ def init_personal_tables(db_path: str):
     personal_pointer テーブル（個人ファイルの書き込み位置管理）を作成する。
     residents テーブルは既に作成済みなのでここでは作らない。
     """
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     cur  = conn.cursor()
 
     # name = 入所者氏名
@@ -51,46 +340,244 @@ def init_personal_tables(db_path: str):
             next_row  INTEGER NOT NULL
         )
     ''')
+
+    # 転記ジャーナル: 1 回の転記 (run) と、その中の 1 エントリ分の計画 (plan)
+    # state = 'planned' → 'done'。'done' になっていない部分だけを再実行する。
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS transfer_runs (
+            run_id      INTEGER PRIMARY KEY AUTOINCREMENT,
+            date        TEXT NOT NULL,
+            template    TEXT NOT NULL,
+            diary_file  TEXT,
+            diary_sheet TEXT,
+            state       TEXT NOT NULL,
+            created_at  TEXT NOT NULL
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS transfer_journal (
+            run_id  INTEGER NOT NULL,
+            seq     INTEGER NOT NULL,
+            file    TEXT NOT NULL,
+            name    TEXT NOT NULL,
+            plan    TEXT NOT NULL,
+            state   TEXT NOT NULL,
+            PRIMARY KEY (run_id, seq)
+        )
+    ''')
+
+    # 転記台帳: 個人ファイルへ書き終えたエントリと書き込み先
+    # entry_key = 日付・氏名・勤務・本文のハッシュ（entry_key() 参照）
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS transfer_ledger (
+            entry_key   TEXT PRIMARY KEY,
+            date        TEXT NOT NULL,
+            name        TEXT NOT NULL,
+            shift       TEXT NOT NULL,
+            file        TEXT NOT NULL,
+            sheet       TEXT NOT NULL,
+            start_row   INTEGER NOT NULL,
+            end_row     INTEGER NOT NULL,
+            run_id      INTEGER NOT NULL
+        )
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ledger_date ON transfer_ledger(date)
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ledger_name ON transfer_ledger(name, file, sheet)
+    ''')
+
+    # 日裏シートの指紋: 前回抽出時の A/B 列の正規化値のハッシュと抽出結果
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS sheet_fingerprints (
+            diary_file   TEXT NOT NULL,
+            sheet        TEXT NOT NULL,
+            date         TEXT NOT NULL,
+            fingerprint  TEXT NOT NULL,
+            entries      TEXT NOT NULL,
+            updated_at   TEXT NOT NULL,
+            PRIMARY KEY (diary_file, sheet)
+        )
+    ''')
+
+    # アーカイブ索引: 退避したシートの行き先と元の場所（Part J 参照）
+    # state = 'copied'（退避先へ複製済み）→ 'done'（元ブックから削除済み）
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS archive_index (
+            archive_file  TEXT NOT NULL,
+            sheet         TEXT NOT NULL,
+            resident      TEXT NOT NULL,
+            resident_key  TEXT NOT NULL,
+            wareki        INTEGER NOT NULL,
+            src_file      TEXT NOT NULL,
+            src_sheet     TEXT NOT NULL,
+            state         TEXT NOT NULL,
+            archived_at   TEXT NOT NULL,
+            PRIMARY KEY (archive_file, sheet)
+        )
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_archive_resident ON archive_index(resident_key, wareki)
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_archive_src ON archive_index(src_file, state)
+    ''')
+
+    # シート目録: 個人ファイルのシートごとの入所者・A2 の令和年・次に書く行（Part P 参照）
+    # sheet_catalog_files の mtime_ns / size がファイルと違えば読み直す
+    # 令和年を B1 から読んでいた頃の目録（b1_wareki 列）は値が誤っているので捨てて作り直す
+    if "b1_wareki" in {r[1] for r in cur.execute("PRAGMA table_info(sheet_catalog)")}:
+        cur.execute("DROP TABLE sheet_catalog")
+        cur.execute("DROP TABLE IF EXISTS sheet_catalog_files")
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS sheet_catalog (
+            file        TEXT NOT NULL,
+            sheet       TEXT NOT NULL,
+            resident    TEXT,
+            wareki      INTEGER,
+            next_row    INTEGER NOT NULL,
+            PRIMARY KEY (file, sheet)
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS sheet_catalog_files (
+            file        TEXT PRIMARY KEY,
+            mtime_ns    INTEGER NOT NULL,
+            size        INTEGER NOT NULL,
+            scanned_at  TEXT NOT NULL
+        )
+    ''')
+
+    # personal_pointer の変更も端末間同期の変更ログに記録する（Part S 参照）
+    init_change_log(conn)
     conn.commit()
     conn.close()
 
 # ----------------------------------------------------------------------------
-#  ユーティリティ (純粋関数)
+#  テキスト正規化 (純粋関数)
+#  変換表・正規表現はモジュール読み込み時に 1 回だけ作る
 # ----------------------------------------------------------------------------
 
-def normalize_text(val: str | None) -> str:
+# 氏名の照合キーから外す敬称（末尾のみ）
+HONORIFICS = ("さん", "さま", "様", "殿", "氏", "くん", "君", "ちゃん")
+
+# NFKC の後に当てる施設独自の置換（ダッシュ・長音の揺れなど）
+_KEY_TABLE = str.maketrans({
+    "‐": "-", "‑": "-", "‒": "-", "–": "-", "—": "-", "―": "-", "−": "-",
+    "ｰ": "ー", "〜": "~", "～": "~",
+})
+_SPACES_RE = re.compile(r"\s+")
+_HONORIFIC_RE = re.compile(r"(?:%s)+$" % "|".join(map(re.escape, HONORIFICS)))
+
+
+def normalize_text(val) -> str:
     """
     Noneの場合は空文字にし、前後の空白を除去して返す。
-    Excelセル値の安定化用。
+    Excelセル値の安定化用（数値なども文字列にする）。表示用の値は変えない。
+    """
+    if val is None:
+        return ""
+    return str(val).strip()
+
+
+def normalize_key(text) -> str:
+    """
+    照合・重複判定用のキーを作る。
+    NFKC（全角英数・半角カナの統一）→ 施設独自の置換 → 空白をすべて除去 → 末尾の敬称を除去。
+    例: '宮本　武蔵 様' / '宮本 武蔵' → '宮本武蔵'
+    """
+    if not text:
+        return ""
+    key = unicodedata.normalize("NFKC", str(text)).translate(_KEY_TABLE)
+    key = _SPACES_RE.sub("", key)
+    stripped = _HONORIFIC_RE.sub("", key)
+    return (stripped or key).casefold()
+
+
+def normalize_rows(rows) -> List[tuple[int, str, str]]:
+    """
+    (行番号, A列の値, B列の値) の並びをまとめて normalize_text する。
     """
-    return val.strip() if val else ""
+    norm = normalize_text
+    return [(r, norm(a), norm(b)) for r, a, b in rows]
 
 
 def iter_rows(sheet, start: int = 2) -> Iterator[tuple[int, str, str]]:
     """
     指定行からA列（名前）・B列（本文）の値を順に返すイテレータ。
+    A/B 列だけを行単位でまとめて読むので、1 セルずつ取得するより速い。
     """
-    row = start
-    while row <= sheet.max_row:
-        name = sheet.cell(row, 1).value
-        content = sheet.cell(row, 2).value
+    values = sheet.iter_rows(min_row=start, max_col=2, values_only=True)
+    for row, cells in enumerate(values, start=start):
+        name = cells[0] if cells else None
+        content = cells[1] if len(cells) > 1 else None
         yield row, normalize_text(name), normalize_text(content)
-        row += 1
+
+
+def normalize_sheet(sheet, start: int = 2) -> List[tuple[int, str, str]]:
+    """
+    シート 1 枚分の A/B 列を一括で読み、正規化済みのリストで返す。
+    """
+    return list(iter_rows(sheet, start))
 # ----------------------------------------------------------------------------
 #  1) データ取得  -------------------------------------------------------------
 # ----------------------------------------------------------------------------
 
-def extract_entries(sheet, *, row_start: int = 2) -> List[Dict]:
+def ura_series(wb, base_sheet: str) -> List:
     """
-    シート1枚から [{name, content, shift}] のリストを抽出する。
+    「15日裏」「15日裏(2)」「15日裏(3)」… を番号順に並べた Worksheet のリストを返す。
+    タブの並び（追加シートは左へ挿入される）ではなく、書いた順＝番号順に並べる。
+    """
+    base = base_sheet.split("(")[0]
+    if base not in wb.sheetnames:
+        return []
+    pattern = re.compile(rf"^{re.escape(base)}\((\d+)\)$")
+    numbered = sorted((int(m.group(1)), title) for title in wb.sheetnames
+                      if (m := pattern.match(title)))
+    return [wb[base]] + [wb[title] for _, title in numbered]
+
+
+def iter_content_rows(sheet, row_start: int = 2, skip_names=()):
+    """
+    シート1枚の (row_idx, name, content) のうち空でない行だけを返す。
+    空行が MAX_EMPTY_ROWS 続いたらそのシートは打ち切る。
+    skip_names: 読み飛ばす A 列の値（Footer など）
+    """
+    empty_cnt = 0
+    for row_idx, name, content in iter_rows(sheet, row_start):
+        if name in skip_names:
+            continue
+        if not name and not content:
+            empty_cnt += 1
+            if empty_cnt >= MAX_EMPTY_ROWS:
+                break
+            continue
+        empty_cnt = 0
+        yield row_idx, name, content
+
+
+def iter_series_rows(sheets, row_start: int = 2, skip_names=()):
+    """
+    裏シートの続き（ura_series の結果）を1本の行ストリームとして読む。
+    (sheet_title, row_idx, name, content) を順に返す。
+    """
+    for sheet in sheets:
+        for row_idx, name, content in iter_content_rows(sheet, row_start, skip_names):
+            yield sheet.title, row_idx, name, content
+
+
+def extract_rows(rows) -> List[Dict]:
+    """
+    (name, content) の並びから [{name, content, shift}] のリストを抽出する。
     DB書き込みやヘッダー貼付は行わない（純粋関数）。
     "以上"や"巡回"/"夜間浴"で日勤→夜勤の切替えを自動判定。
+    勤務帯と記入中の利用者はページをまたいでも引き継ぐ。
     """
     entries: List[Dict] = []
     current_name: Optional[str] = None
     current_content: List[str] = []
     current_shift = "日勤"
-    empty_cnt = 0
 
     def flush():
         nonlocal current_name, current_content
@@ -102,15 +589,7 @@ def extract_entries(sheet, *, row_start: int = 2) -> List[Dict]:
             })
         current_name, current_content = None, []
 
-    for _, name, content in iter_rows(sheet, row_start):
-        # 空行カウントで早期終了
-        if not name and not content:
-            empty_cnt += 1
-            if empty_cnt >= MAX_EMPTY_ROWS:
-                break
-            continue
-        empty_cnt = 0
-
+    for name, content in rows:
         # "以上" 行で夜勤へ切替え
         if name == "以上":
             flush()
@@ -137,6 +616,23 @@ def extract_entries(sheet, *, row_start: int = 2) -> List[Dict]:
     return entries
 
 
+def extract_entries(sheet, *, row_start: int = 2) -> List[Dict]:
+    """
+    シート1枚から [{name, content, shift}] のリストを抽出する。
+    """
+    return extract_rows((name, content)
+                        for _, name, content in iter_content_rows(sheet, row_start))
+
+
+def extract_series_entries(sheets, *, row_start: int = 2, skip_names=()) -> List[Dict]:
+    """
+    「○日裏」「○日裏(2)」… を1回の走査でまとめて抽出する。
+    前のページの最後の利用者の続きが次のページの先頭に書かれていても1件にまとまる。
+    """
+    return extract_rows((name, content) for _, _, name, content
+                        in iter_series_rows(sheets, row_start, skip_names))
+
+
 # ----------------------------------------------------------------------------
 #  2) author 付与 (純粋関数)
 # ----------------------------------------------------------------------------
@@ -157,31 +653,41 @@ def add_authors(entries: List[Dict], *, author_day: str, author_night: str) -> L
 #  3) DB 書き込み (副作用あり)
 # ----------------------------------------------------------------------------
 
+@retry_on_locked
 def save_entries_to_db(entries: List[Dict], db_path: str | Path, *, date: dt.date):
     """
     entriesの内容を日誌DB（diary_entriesテーブル）に保存する。
     既存重複は無視（INSERT OR IGNORE）。
     """
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
+    insert_diary_rows(conn, entries, date)
+    conn.commit()
+    conn.close()
+
+
+def insert_diary_rows(conn: sqlite3.Connection, entries: List[Dict], date: dt.date) -> None:
+    """
+    save_entries_to_db の本体（コミットは呼び出し側）。DBWriter からも使う。
+    """
     cur = conn.cursor()
     date_str = date.strftime("%Y-%m-%d")
 
     rows = [(
         e["name"],
+        normalize_key(e["name"]),
         date_str,
         e["shift"],
         e["content"],
+        content_digest(e["content"]),
         e["author"],
     ) for e in entries]
 
     cur.executemany(
         """INSERT OR IGNORE INTO diary_entries
-           (resident_name, date, shift, content, author)
-           VALUES (?, ?, ?, ?, ?)""",
+           (resident_name, name_key, date, shift, content, content_hash, author)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
         rows,
     )
-    conn.commit()
-    conn.close()
 
 
 # ----------------------------------------------------------------------------
@@ -203,16 +709,19 @@ def apply_night_header(sheet, row: int, template_sheet):
                 dst._style = src._style
 
 
-def setup_page_breaks(sheet, rows_per_page: int = ARTICLE_ROWS_PER_PAGE):
+def setup_page_breaks(sheet, rows_per_page: int = ARTICLE_ROWS_PER_PAGE, *,
+                      last_row: int | None = None):
     """
     指定行数ごとにExcelシートへ改ページを自動挿入する。
+    last_row: 最終行（書き込み専用シートは max_row を持たないので渡す）
     """
-    from openpyxl.worksheet.pagebreak import Break
+    from openpyxl.worksheet.pagebreak import Break, RowBreak
 
-    sheet.page_breaks = []  # 既存クリア
+    sheet.row_breaks = RowBreak()  # 既存クリア
+    last_row = last_row or sheet.max_row
     idx = rows_per_page + 1
-    while idx < sheet.max_row:
-        sheet.page_breaks.append(Break(id=idx))
+    while idx < last_row:
+        sheet.row_breaks.append(Break(id=idx))
         idx += rows_per_page
 
 
@@ -338,6 +847,23 @@ def get_pointer(conn: sqlite3.Connection, name: str):
     return row  # None or (file, sheet, next_row)
 
 
+def load_pointers(conn: sqlite3.Connection, names) -> Dict[str, tuple]:
+    """
+    複数人の pointer を 1 回の問い合わせでまとめて取得する。
+    戻り値: {name: (file, sheet, next_row)}  pointer の無い人は含まない
+    """
+    names = list(dict.fromkeys(names))
+    found: Dict[str, tuple] = {}
+    for i in range(0, len(names), 500):          # SQLite の変数の上限対策
+        chunk = names[i:i + 500]
+        for name, *ptr in conn.execute(
+            f"SELECT name, file, sheet, next_row FROM personal_pointer "
+            f"WHERE name IN ({','.join('?' * len(chunk))})", chunk
+        ):
+            found[name] = tuple(ptr)
+    return found
+
+
 def set_pointer(conn: sqlite3.Connection, name: str, file: str, sheet: str, next_row: int):
     """
     pointer情報をINSERTまたはUPDATEする。
@@ -365,21 +891,38 @@ def wareki_year(year: int) -> int:
 
 def add_footer(file_path: str, base_sheet: str):
     """
-    “○日裏”シリーズの最後尾シートにFooterを貼り付ける。
+    月次日誌を開いて paste_footer し、貼り付けたときだけ保存する。
+    戻り値: 保存したときは save_workbook_measured の記録、何もしなければ None
+    """
+    wb = openpyxl.load_workbook(file_path)
+    if not paste_footer(wb, base_sheet):
+        wb.close()
+        return None
+    metrics = save_workbook_measured(wb, file_path)
+    wb.close()
+    return metrics
+
+
+def paste_footer(wb, base_sheet: str) -> bool:
+    """
+    “○日裏”シリーズの最後尾シートにFooterを貼り付ける（保存はしない）。
     ・行37が空ならその行に貼り付け
     ・埋まっていれば新しい裏シートを作成し2行目に貼り付け
     行高は33ptに設定
+    既に貼り付け済みなら何もしない（転記ジャーナルの再実行で二重にならないように）。
+    戻り値: 貼り付けたら True
     """
-    wb = openpyxl.load_workbook(file_path)
     tpl_footer = wb["Footer"]
 
-    # 末尾シート名を特定
-    base, *tail = base_sheet.split("(")         # '15日裏'
-    idx = 1
-    while f"{base}({idx})" in wb.sheetnames:
-        idx += 1
-    last_name = base if idx == 1 else f"{base}({idx-1})"
-    ws = wb[last_name]
+    # 末尾シートを特定（(2) が有って (1) が無いときも番号順の最後を取る）
+    base = base_sheet.split("(")[0]             # '15日裏'
+    series = ura_series(wb, base)
+    ws = series[-1]
+    last_no = int(ws.title[len(base) + 1:-1]) if ws.title != base else 1
+
+    marker = tpl_footer.cell(1, 1).value
+    if marker and marker in (ws.cell(37, 1).value, ws.cell(2, 1).value):
+        return False
 
     def paste(ws_target, dest_row):
         for c in range(1, 3):                   # A,B 列
@@ -399,47 +942,67 @@ def add_footer(file_path: str, base_sheet: str):
         paste(ws, 37)
     else:
         # 新しい裏シートを作成
-        new_name = f"{base}({idx})"
+        new_name = f"{base}({max(last_no + 1, 2)})"
         if "B_temp" in wb.sheetnames:
             ws_new = wb.copy_worksheet(wb["B_temp"])
             ws_new.title = new_name
         else:
             ws_new = wb.create_sheet(new_name)
         paste(ws_new, 2)        # 2 行目に貼り付け
-
-    wb.save(file_path)
-    wb.close()
+    return True
 
 PREF_FILE = Path().resolve() / "prefs.json"
 
+PREF_DEFAULTS = {
+    "author_day": "",
+    "author_night": "",
+    "last_date": "",
+    "personal_layout": "floor",   # 個人ファイルの分け方（PERSONAL_LAYOUTS 参照）
+    # ブックの肥大化の警告ライン（Part K 参照）。上限の 8 割で警告する。0 なら見ない
+    "limit_size_mb": 10,
+    "limit_sheets": 250,
+    "limit_max_rows": 1000,
+    "limit_styles": 2000,
+    "limit_save_seconds": 5,
+    "backup_dir": "",             # 差分バックアップの保存先（空なら ./バックアップ。Part Q 参照）
+    "cold_after_days": 180,       # これより古い月の本文を圧縮する（Part R 参照）。0 なら圧縮しない
+    "sync_dir": "",               # 端末間で変更を受け渡す共有フォルダ（Part S 参照）
+    "sync_origin": "",            # この端末の ID（空ならコンピューター名）
+}
+
 def load_prefs():
     """
     担当者名や前回日付などの設定をprefs.jsonから読み込む。
-    読み込み失敗時は空のデフォルト値を返す。
+    読み込み失敗時は空のデフォルト値を返す。足りない項目はデフォルトで補う。
     """
+    prefs = dict(PREF_DEFAULTS)
     if PREF_FILE.exists():
         try:
             with open(PREF_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
+                prefs.update(json.load(f))
         except json.JSONDecodeError:
             pass
-    return {"author_day": "", "author_night": "", "last_date": ""}
+    return prefs
 
 def save_prefs(author_day, author_night, last_date=""):
     """
     担当者名や前回日付などの設定をprefs.jsonに保存する。
+    それ以外の設定項目（personal_layout など）はそのまま残す。
+    """
+    update_prefs(
+        author_day=author_day,
+        author_night=author_night,
+        last_date=last_date,
+    )
+
+def update_prefs(**values):
     """
+    prefs.json の指定項目だけを書き換えて保存する。
+    """
+    prefs = load_prefs()
+    prefs.update(values)
     with open(PREF_FILE, "w", encoding="utf-8") as f:
-        json.dump(
-            {
-                "author_day":  author_day,
-                "author_night": author_night,
-                "last_date":   last_date,
-            },
-            f,
-            ensure_ascii=False,
-            indent=2,
-        )
+        json.dump(prefs, f, ensure_ascii=False, indent=2)
 
 
 # ------------------------------------------------------------------
@@ -448,20 +1011,36 @@ def save_prefs(author_day, author_night, last_date=""):
 
 ROW_LIMIT = 31                     # 1 シート 31 行
 PERSONAL_TEMPLATE_SHEET = "personal"
+WAREKI_CELL = "A2"                 # 個人ファイルのシートで令和年を書くセル
+RETRACTED_TEXT = "（日誌の修正により取り消し）"   # 取り消したエントリの本文欄（retract_entries）
 PF_2F   = "2階個人ファイル.xlsx"
 PF_3F   = "3階個人ファイル.xlsx"
 PF_RET  = "退所者個人ファイル.xlsx"
 
+# 個人ファイルの分け方
+#   floor         : 階ごとに 1 ファイル（PF_2F / PF_3F / PF_RET）
+#   resident      : 個人ファイル/2階/宮本武蔵.xlsx
+#   year          : 個人ファイル/2階/2階個人ファイル_R7.xlsx
+#   resident_year : 個人ファイル/2階/宮本武蔵_R7.xlsx
+PERSONAL_LAYOUTS = ("floor", "resident", "year", "resident_year")
+PERSONAL_DIR = "個人ファイル"
+FLOOR_FILES = {"2階": PF_2F, "3階": PF_3F, "退所者": PF_RET}
+NON_PERSONAL_SHEETS = ("Header_Night", "Footer", "B_temp", "F_temp",
+                       PERSONAL_TEMPLATE_SHEET, "Sheet1")
+
 WEEKDAY_STR = "月火水木金土日"
 
 
 def ensure_personal_file(base_dir: Path, file_name: str, template_src: Path) -> Path:
     """
     個人ファイル（2階/3階/退職者）がなければテンプレートから複製して作成。
+    複製元は personal シートだけの雛形（personal_skeleton 参照）。
+    file_name は base_dir からの相対パス（分割レイアウトではサブフォルダ付き）。
     """
     dest = base_dir / file_name
     if not dest.exists():
-        shutil.copy(template_src, dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(personal_skeleton(template_src, base_dir), dest)
     return dest
 
 
@@ -480,7 +1059,7 @@ def ensure_personal_sheet(wb, base_name: str, wareki: int):
             sheet.title = base_name
         else:
             sheet = wb.create_sheet(base_name)
-        sheet["A2"] = f"令和{wareki}年"
+        sheet[WAREKI_CELL] = f"令和{wareki}年"
         sheet["C2"] = f"　入所者氏名　{base_name}"
         new_created = True
         remove_sheet1(wb)
@@ -489,216 +1068,3870 @@ def ensure_personal_sheet(wb, base_name: str, wareki: int):
     if new_created:
         next_row = 4                      # 新規なら 4 行目から
     else:
-        # 4 行目以降を上から見て、完全に空白の最初の行を探す
-        max_row = sheet.max_row
-        next_row = None
-        for r in range(4, max_row + 1):
-            if all(sheet.cell(r, c).value in (None, "") for c in range(1, 5)):
-                next_row = r
-                break
-        if next_row is None:              # どこにも空きが無ければ末尾の次行
-            next_row = max_row + 1
+        next_row = first_free_row(sheet)
 
     return sheet, next_row
 
 
+def first_free_row(sheet) -> int:
+    """
+    4 行目以降を上から見て、A〜D 列が完全に空白の最初の行番号を返す。
+    どこにも空きが無ければ末尾の次行。
+    """
+    max_row = sheet.max_row
+    for r in range(4, max_row + 1):
+        if all(sheet.cell(r, c).value in (None, "") for c in range(1, 5)):
+            return r
+    return max_row + 1
+
+
+
+def floor_of(room: str | None) -> str:
+    """
+    居室番号から階（'2階' / '3階' / '退所者'）を返す。
+    """
+    room = str(room) if room else ""
+    if room == "退所":
+        return "退所者"
+    if room.startswith("2"):
+        return "2階"
+    if room.startswith("3"):
+        return "3階"
+    return "退所者"  # 不明は退職者へ
+
+
+def safe_file_stem(name: str) -> str:
+    """
+    ファイル名に使えない文字を '_' に置き換える。
+    """
+    return re.sub(r'[\\/:*?"<>|]', "_", name).strip() or "_"
+
+
+def personal_file_for(room: str | None, name: str = "", year: int | None = None,
+                      layout: str = "floor") -> str:
+    """
+    書き込み先の個人ファイル（base_dir からの相対パス）を決める。
+    layout は PERSONAL_LAYOUTS のいずれか。year は西暦（year 系のレイアウトで使用）。
+    """
+    floor = floor_of(room)
+    if layout == "floor":
+        return FLOOR_FILES[floor]
+    if layout not in PERSONAL_LAYOUTS:
+        raise ValueError(f"未対応の個人ファイルレイアウト: {layout}")
+
+    year = year or dt.date.today().year
+    if layout == "resident":
+        stem = safe_file_stem(name)
+    elif layout == "year":
+        stem = f"{Path(FLOOR_FILES[floor]).stem}_R{wareki_year(year)}"
+    else:
+        stem = f"{safe_file_stem(name)}_R{wareki_year(year)}"
+    return f"{PERSONAL_DIR}/{floor}/{stem}.xlsx"
+
+
+def load_rooms(conn: sqlite3.Connection) -> Dict[str, str]:
+    """
+    residents テーブルから {照合キー: 居室番号} を作る（空白・敬称だけ違う氏名でも引ける）。
+    テーブルが無い DB（ポインタ専用など）では空の dict を返す。
+    """
+    try:
+        rows = conn.execute("SELECT name, room FROM residents ORDER BY id").fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    return {normalize_key(name): str(room) for name, room in rows}
+
+
+def sheet_wareki(value, default: int) -> int:
+    """
+    セル値に含まれる『令和N年』の N を返す。見つからなければ default。
+    """
+    m = re.search(r"令和(\d+)年", str(value))
+    return int(m.group(1)) if m else default
+
+
+def personal_sheet_wareki(ws, default: int | None) -> int | None:
+    """
+    個人ファイルのシートの令和年（WAREKI_CELL の『令和N年』）。書いていなければ default。
+    移行・アーカイブ・シート目録はすべてここから読む。read_only のシートにも使える。
+    """
+    return sheet_wareki(ws[WAREKI_CELL].value, default)
+
+
+def plan_entry(ent: Dict, date: dt.date, pf_name: str, ptr, view) -> Dict:
+    """
+    1 エントリ分の書き込み先（シート・行）と書き込み内容を計画して返す。
+    view はシート目録（CatalogView）。ブックは読まず、シート作成・セル書き込みを ops のリストとして表す。
+    ops:
+      ["sheet", シート名, 左隣にするシート名 or None, 令和年, 入所者氏名]
+      ["cell",  シート名, 行, 列, 値]
+    """
+    name   = ent["name"]
+    author = ent["author"]
+    wareki = wareki_year(date.year)
+    md_str = f"{date.month}/{date.day}"
+    wday   = WEEKDAY_STR[date.weekday()]
+    ops: List[list] = []
+
+    def next_title() -> str:
+        idx = 2
+        while (increment_sheet_name(name, idx) in view.sheetnames
+               or increment_sheet_name(name, idx) in view.archived):
+            idx += 1
+        return increment_sheet_name(name, idx)
+
+    # --- どのシート・行に書くか ---
+    if ptr and ptr[0] == pf_name and ptr[1] in view.sheetnames:
+        sheet, next_row = ptr[1], ptr[2]
+    elif name in view.sheetnames:
+        sheet, next_row = name, view.first_free_row(name)
+    else:
+        sheet = name if name not in view.archived else next_title()
+        ops.append(["sheet", sheet, None, wareki, name])
+        view.sheetnames.append(sheet)
+        next_row = 4                              # 新規なら 4 行目から
+
+    def new_sheet(left_of: str):
+        title = next_title()
+        ops.append(["sheet", title, left_of, wareki, name])
+        view.sheetnames.append(title)
+        return title, 4
+
+    # --- シートの行数上限を超える場合は新シート作成 ---
+    if next_row > (ROW_LIMIT + 3):
+        sheet, next_row = new_sheet(sheet)
+
+    # --- 年度が変わった場合は区切りを挿入（シートの令和年 WAREKI_CELL も書き換える） ---
+    if view.wareki(sheet, wareki) != wareki:
+        ops.append(["cell", sheet, next_row, 4, f"ここから令和{wareki}年"])
+        next_row += 1
+        ops.append(["cell", sheet, 2, 1, f"令和{wareki}年"])
+
+    # --- 本文を複数行に分割 ---
+    lines = [ln for ln in ent["content"].split("\n") if ln]  # 空行は捨てる
+
+    # --- 残り行が足りない場合は新シート作成 ---
+    if next_row + len(lines) - 1 > (ROW_LIMIT + 3):
+        sheet, next_row = new_sheet(sheet)
+
+    # --- 行ごとに日付・曜日・本文・記録者 ---
+    start_row = next_row
+    for i, line in enumerate(lines):
+        if i == 0:
+            ops.append(["cell", sheet, next_row, 1, md_str])
+            ops.append(["cell", sheet, next_row, 2, wday])
+        ops.append(["cell", sheet, next_row, 3, line])
+        if i == len(lines) - 1:
+            ops.append(["cell", sheet, next_row, 4, author])
+        next_row += 1
+
+    return {
+        "key": entry_key(date, ent),
+        "date": date.strftime("%Y-%m-%d"),
+        "name": name,
+        "shift": ent["shift"],
+        "file": pf_name,
+        "sheet": sheet,
+        "start_row": start_row,
+        "next_row": next_row,
+        "ops": ops,
+    }
+
+
+def apply_plan(wb, plan: Dict) -> None:
+    """
+    plan_entry の ops をブックに反映する。
+    既にあるシートは作り直さず、セルは同じ値で上書きするだけなので何度実行しても結果は同じ。
+    """
+    for op in plan["ops"]:
+        if op[0] == "sheet":
+            _, title, left_of, wareki, name = op
+            if title in wb.sheetnames:
+                continue
+            if left_of is None:
+                new_ws, _ = ensure_personal_sheet(wb, title, wareki)
+                new_ws["C2"] = f"　入所者氏名　{name}"
+            else:
+                new_ws = copy_left_of(wb, wb[left_of], PERSONAL_TEMPLATE_SHEET, title)
+                new_ws[WAREKI_CELL] = f"令和{wareki}年"
+                new_ws["C2"] = f"　入所者氏名　{name}"
+        else:
+            _, sheet, row, col, value = op
+            wb[sheet].cell(row, col, value)
+
 
 def transfer_to_personal_files(entries: list, date: dt.datetime,
-                               db_path: str, base_dir: Path, template_src: Path):
+                               db_path: str, base_dir: Path, template_src: Path,
+                               *, footer: tuple[str, str] | None = None,
+                               layout: str | None = None,
+                               writer: "DBWriter | None" = None, diary_stage=None) -> int:
     """
     日誌エントリ（entries）を各入所者の個人ファイル（Excel）に転記する。
     必要に応じて新規シート作成や年切り替え、行数超過時の分割も自動で行う。
-    entries: [{name, content, room, shift, author}]
+    entries: [{name, content, shift, author}]  room が無ければ residents から引く
     date: 転記日付
     db_path: ポインタ管理用DBパス
     base_dir: 個人ファイル保存先ディレクトリ
     template_src: テンプレートExcelファイルパス
+    footer: (月次日誌パス, ○日裏) を渡すと、転記後に Footer も貼り付ける
+    layout: 個人ファイルの分け方（省略時は prefs.json の personal_layout）
+    writer / diary_stage: パイプライン転記用（run_transfer_journal 参照）。
+      writer を渡すと DB 書き込みは writer に積み、個人ファイルの保存と並行して進める。
+    先に全エントリの配置をシート目録から計画し（plan_transfer）、ジャーナルに書いてから
+    ファイルごとに反映する（apply_transfer_plan）。
+    書き込む個人ファイルは、読み込む前にすべてロックする（他の端末の転記は順番待ち）。
+    戻り値: ジャーナルの run_id
     """
     init_personal_tables(db_path)  # ポインタテーブルがなければ作成
+    layout = layout or load_prefs().get("personal_layout", "floor")
 
-    yyyy = date.year
-    wareki = wareki_year(date.year)
-
-    # 個人ファイルのワークブックキャッシュ
-    cache = {}
+    # --- 書き込み先を先に決めてまとめてロック ---
+    conn = connect_db(db_path)
+    targets = transfer_targets(conn, entries, date, layout)
+    conn.close()
 
-    conn = sqlite3.connect(db_path)
+    with lock_files(base_dir / t for t in set(targets)):
+        # ロックしたまま計画するので、計画と反映の間に他の端末が書くことはない
+        plan = plan_transfer([(date, entries)], db_path, base_dir, template_src,
+                             layout=layout)
+        run_id = apply_transfer_plan(plan, db_path, base_dir, footer=footer,
+                                     writer=writer, diary_stage=diary_stage)
+    return run_id
 
-    for ent in entries:
-        name   = ent["name"]
-        room   = ent["room"]
-        author = ent["author"]
-        shift  = ent["shift"]
-        md_str = f"{date.month}/{date.day}"
-        wday   = WEEKDAY_STR[date.weekday()]
-        content = ent["content"]
-
-        # --- どの個人ファイルに書くか判定 ---
-        if room == "退所":
-            pf_name = PF_RET
-        elif room.startswith("2"):
-            pf_name = PF_2F
-        elif room.startswith("3"):
-            pf_name = PF_3F
-        else:
-            pf_name = PF_RET  # 不明は退職者へ
 
-        # --- 個人ファイル（Excel）を用意 ---
-        if pf_name not in cache:
-            cache[pf_name] = openpyxl.load_workbook(
-                ensure_personal_file(base_dir, pf_name, template_src)
-            )
-        wb = cache[pf_name]
+# ------------------------------------------------------------------
+# Part C : 転記ジャーナル（途中で落ちても続きから再開）
+# ------------------------------------------------------------------
 
-        # --- どのシート・行に書くかポインタ取得 ---
-        ptr = get_pointer(conn, name)
-        if ptr and ptr[0] == pf_name and ptr[1] in wb.sheetnames:
-            sheet = wb[ptr[1]]
-            next_row = ptr[2]
-        else:
-            sheet, next_row = ensure_personal_sheet(wb, name, wareki)
+def save_workbook_atomic(wb, path: str | Path) -> None:
+    """
+    ブックを同じフォルダの一時ファイルに保存し、fsync 後に rename で差し替える。
+    保存中に落ちても、元のファイルか新しいファイルのどちらかが必ず残る。
+    """
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(prefix=f"~{path.stem}.", suffix=".tmp", dir=path.parent)
+    os.close(fd)
+    try:
+        wb.save(tmp)
+        with open(tmp, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    # rename 自体も確定させる（Windows ではフォルダを開けないので省略）
+    if os.name == "posix":
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
 
-        # --- シートの行数上限を超える場合は新シート作成 ---
-        if next_row > (ROW_LIMIT + 3):
-            idx = 2
-            while increment_sheet_name(name, idx) in wb.sheetnames:
-                idx += 1
-            new_title = increment_sheet_name(name, idx)
-
-            new_ws = copy_left_of(wb, sheet, PERSONAL_TEMPLATE_SHEET, new_title)
-            new_ws["A2"] = f"令和{wareki}年"
-            new_ws["C2"] = f"　入所者氏名　{name}"
-
-            sheet   = new_ws
-            next_row = 4
-
-        # --- 年度が変わった場合は区切りを挿入 ---
-        current_wareki = re.search(r"令和(\d+)年", str(sheet["B1"].value))
-        current_wareki = int(current_wareki.group(1)) if current_wareki else wareki
-        if current_wareki != wareki:
-            sheet.cell(row=next_row, column=4, value=f"ここから令和{wareki}年")
-            next_row += 1
-            sheet["A2"] = f"令和{wareki}年"
-
-        # --- 本文を複数行に分割して書き込む ---
-        lines = [ln for ln in content.split("\n") if ln]  # 空行は捨てる
-        rows_needed = len(lines)
-
-        # --- 残り行が足りない場合は新シート作成 ---
-        if next_row + rows_needed - 1 > (ROW_LIMIT + 3):
-            idx = 2
-            while increment_sheet_name(name, idx) in wb.sheetnames:
-                idx += 1
-            new_title = increment_sheet_name(name, idx)
 
-            new_ws = copy_left_of(wb, sheet, PERSONAL_TEMPLATE_SHEET, new_title)
-            new_ws["A2"] = f"令和{wareki}年"
-            new_ws["C2"] = f"　入所者氏名　{name}"
+@retry_on_locked
+def write_transfer_journal(conn: sqlite3.Connection, date: dt.date, plans: List[Dict],
+                           template_src: Path,
+                           footer: tuple[str, str] | None = None) -> int:
+    """
+    転記計画をジャーナルに書き込んでコミットする（先行書き込み）。
+    戻り値: run_id
+    """
+    diary_file, diary_sheet = footer if footer else (None, None)
+    cur = conn.execute(
+        """INSERT INTO transfer_runs
+           (date, template, diary_file, diary_sheet, state, created_at)
+           VALUES (?, ?, ?, ?, 'planned', ?)""",
+        (date.strftime("%Y-%m-%d"), str(template_src), diary_file, diary_sheet,
+         dt.datetime.now().isoformat(timespec="seconds")),
+    )
+    run_id = cur.lastrowid
+    conn.executemany(
+        """INSERT INTO transfer_journal (run_id, seq, file, name, plan, state)
+           VALUES (?, ?, ?, ?, ?, 'planned')""",
+        [(run_id, seq, p["file"], p["name"], json.dumps(p, ensure_ascii=False))
+         for seq, p in enumerate(plans)],
+    )
+    conn.commit()
+    return run_id
 
-            sheet   = new_ws
-            next_row = 4
 
-        # --- 行ごとに日付・曜日・本文・記録者を書き込む ---
-        for i, line in enumerate(lines):
-            if i == 0:
-                # 最初の行だけ日付と曜日を書く
-                sheet.cell(next_row, 1, md_str)
-                sheet.cell(next_row, 2, wday)
-            # 本文（列3）を書き込む
-            sheet.cell(next_row, 3, line)
-            if i == len(lines) - 1:
-                # 最終行だけ記録者を書く
-                sheet.cell(next_row, 4, author)
-            next_row += 1
-
-        # --- ポインタ情報をDBに保存 ---
-        set_pointer(conn, name, pf_name, sheet.title, next_row)
+def run_transfer_journal(db_path: str | Path, run_id: int, base_dir: Path, *,
+                         writer: "DBWriter | None" = None, diary_stage=None):
+    """
+    ジャーナルの未完了部分だけを実行する。
+    ファイルごとに ops を反映 → 原子的に保存 → ポインタと完了印を同じトランザクションで確定。
+    最後に Footer を貼り付けて run を完了にする。
+    対象ファイルをロックしてから未完了分を読み直すので、他の端末が実行中の run を
+    二重に実行することはない。
+    writer を渡すと、ポインタ・台帳・完了印と run の完了は writer に積み、writer.close() で
+    まとめてコミットする（途中で落ちてもジャーナルから再実行できる）。
+    diary_stage: 月次日誌側のステージ（finish_diary_book の Future）。Footer はそちらで貼る。
+    """
+    conn = connect_db(db_path)
+    run = conn.execute(
+        "SELECT template, diary_file, diary_sheet FROM transfer_runs WHERE run_id = ?",
+        (run_id,),
+    ).fetchone()
+    if run is None:
+        conn.close()
+        return
+    template_src, diary_file, diary_sheet = run
+    files = [r[0] for r in conn.execute(
+        "SELECT DISTINCT file FROM transfer_journal WHERE run_id = ? AND state = 'planned'",
+        (run_id,),
+    )]
+    lock_paths = [base_dir / f for f in files] + ([diary_file] if diary_file else [])
+
+    with lock_files(lock_paths):
+        state = conn.execute(
+            "SELECT state FROM transfer_runs WHERE run_id = ?", (run_id,)
+        ).fetchone()[0]
+        if state == "done":
+            conn.close()
+            return
 
-    conn.commit()
+        pending: Dict[str, List[Dict]] = {}
+        metrics: List[Dict] = []
+        for file, plan in conn.execute(
+            """SELECT file, plan FROM transfer_journal
+               WHERE run_id = ? AND state = 'planned' ORDER BY seq""",
+            (run_id,),
+        ):
+            pending.setdefault(file, []).append(json.loads(plan))
+
+        def write_file(pf_name: str, plans: List[Dict]) -> tuple[Dict, tuple]:
+            wb = openpyxl.load_workbook(
+                ensure_personal_file(base_dir, pf_name, Path(template_src))
+            )
+            for plan in plans:
+                apply_plan(wb, plan)
+            measured = save_workbook_measured(wb, base_dir / pf_name, pf_name)
+            # 保存した内容でシート目録も作り直す（次の計画はブックを開かずに済む）
+            return measured, (file_stamp(base_dir / pf_name), catalog_workbook(wb))
+
+        # 個人ファイルは 1 つずつ保存する（openpyxl は GIL を離さないので、スレッドを
+        # 増やしても速くならない）。DB への書き込みは writer スレッドが並行して進める。
+        for pf_name, plans in pending.items():
+            measured, catalog = write_file(pf_name, plans)
+            metrics.append(measured)
+            # --- ファイルが確定してからポインタと台帳を進める ---
+            if writer is None:
+                commit_file_progress(conn, run_id, pf_name, plans, catalog)
+            else:
+                writer.submit(record_file_progress, run_id, pf_name, plans, catalog)
+
+        # --- 夜勤フッター（add_footer は貼付済みなら何もしない） ---
+        if diary_stage is not None:
+            metrics.append(diary_stage.result())
+        elif diary_file:
+            footer_metrics = add_footer(diary_file, diary_sheet)
+            if footer_metrics:
+                metrics.append(footer_metrics)
+
+        if writer is None:
+            finish_run(conn, run_id)
+            # --- 保存時間・大きさを記録（肥大化の監視用） ---
+            if metrics:
+                record_workbook_metrics(conn, run_id, metrics)
+                conn.commit()
+        else:
+            writer.submit(record_workbook_metrics, run_id, metrics)
+            writer.submit(record_run_done, run_id)          # コミットは writer.close()
     conn.close()
 
-    # --- すべての個人ファイルを保存 ---
-    for path_name, wb in cache.items():
-        wb.save(base_dir / path_name)
 
-        # --- ROW_LIMIT 超過チェック ---
-        if next_row > (ROW_LIMIT + 3):
-            idx = 2
-            while increment_sheet_name(name, idx) in wb.sheetnames:
-                idx += 1
-            new_title = increment_sheet_name(name, idx)
-
-            new_ws = copy_left_of(wb, sheet, PERSONAL_TEMPLATE_SHEET, new_title)
-            new_ws["A2"] = f"令和{wareki}年"
-            new_ws["C2"] = f"　入所者氏名　{name}"
-
-            sheet   = new_ws
-            next_row = 4
-
-        # 年が変わった場合（シートの B1 年と比較）
-        current_wareki = re.search(r"令和(\d+)年", str(sheet["B1"].value))
-        current_wareki = int(current_wareki.group(1)) if current_wareki else wareki
-        if current_wareki != wareki:
-            sheet.cell(row=next_row, column=4, value=f"ここから令和{wareki}年")
-            next_row += 1
-            sheet["A2"] = f"令和{wareki}年"
-
-        #-----この記事を書き込む処理（複数行対応）-----
-        # content を改行で分割 → ['１行目', '２行目', ...]
-        lines = [ln for ln in content.split("\n") if ln]  # 空行は捨てる
-        rows_needed = len(lines)
-
-        # --- 残り行が足りないとき ---
-        if next_row + rows_needed - 1 > (ROW_LIMIT + 3):
-            idx = 2
-            while increment_sheet_name(name, idx) in wb.sheetnames:
-                idx += 1
-            new_title = increment_sheet_name(name, idx)
+@retry_on_locked
+def commit_file_progress(conn: sqlite3.Connection, run_id: int, pf_name: str,
+                         plans: List[Dict], catalog: tuple | None = None) -> None:
+    """
+    保存を終えた個人ファイル 1 つ分のポインタ・台帳・完了印を 1 トランザクションで確定する。
+    catalog: (file_stamp, catalog_workbook の結果)。渡せばシート目録も一緒に更新する。
+    """
+    record_file_progress(conn, run_id, pf_name, plans, catalog)
+    conn.commit()
 
-            new_ws = copy_left_of(wb, sheet, PERSONAL_TEMPLATE_SHEET, new_title)
-            new_ws["A2"] = f"令和{wareki}年"
-            new_ws["C2"] = f"　入所者氏名　{name}"
 
-            sheet   = new_ws
-            next_row = 4
+def record_file_progress(conn: sqlite3.Connection, run_id: int, pf_name: str,
+                         plans: List[Dict], catalog: tuple | None = None) -> None:
+    """
+    commit_file_progress の本体（コミットは呼び出し側）。
+    """
+    conn.executemany(
+        """INSERT INTO personal_pointer (name, file, sheet, next_row)
+           VALUES (?, ?, ?, ?)
+           ON CONFLICT(name)
+           DO UPDATE SET file=excluded.file, sheet=excluded.sheet, next_row=excluded.next_row""",
+        [(p["name"], pf_name, p["sheet"], p["next_row"]) for p in plans],
+    )
+    record_ledger(conn, run_id, plans)
+    conn.execute(
+        "UPDATE transfer_journal SET state = 'done' WHERE run_id = ? AND file = ?",
+        (run_id, pf_name),
+    )
+    if catalog is not None:
+        store_sheet_catalog(conn, pf_name, *catalog)
 
-        #------行リストを順番に書き込む------
-        for i, line in enumerate(lines):
-            if i == 0:
-                # 最初の行だけ日付と曜日を書く
-                sheet.cell(next_row, 1, md_str)
-                sheet.cell(next_row, 2, wday)
-            # 本文（列3）を書き込む
-            sheet.cell(next_row, 3, line)
-            if i == len(lines) - 1:
-                # 最終行だけ記録者を書く
-                sheet.cell(next_row, 4, author)
-            next_row += 1
 
+@retry_on_locked
+def finish_run(conn: sqlite3.Connection, run_id: int) -> None:
+    """
+    run を完了にしてコミットする。
+    """
+    record_run_done(conn, run_id)
+    conn.commit()
 
-        # pointer 更新
-        set_pointer(conn, name, pf_name, sheet.title, next_row)
 
-    conn.commit()
-    conn.close()
+def record_run_done(conn: sqlite3.Connection, run_id: int) -> None:
+    """
+    finish_run の本体（コミットは呼び出し側）。
+    """
+    conn.execute("UPDATE transfer_runs SET state = 'done' WHERE run_id = ?", (run_id,))
 
-    # ブック保存
-    for path_name, wb in cache.items():
-        wb.save(base_dir / path_name)
 
+# ------------------------------------------------------------------
+# Part D : 転記台帳（再実行で二重に書かない）
+# ------------------------------------------------------------------
 
-def normalize_text(text: str) -> str:
+def entry_key(date: dt.date | str, ent: Dict) -> str:
     """
-    全角→半角変換や空白除去など、テキストを正規化して返す。
+    エントリを一意に表すキー（日付・氏名・勤務・本文の SHA-1）。
+    diary_entries の一意制約と同じ項目から作る。
     """
-    if not text:
-        return ""
-    text = text.translate(str.maketrans({
-        '　': ' ',
-        '０': '0', '１': '1', '２': '2', '３': '3', '４': '4',
-        '５': '5', '６': '6', '７': '7', '８': '8', '９': '9'
-    }))
-    return text.strip()
+    date_str = date if isinstance(date, str) else date.strftime("%Y-%m-%d")
+    raw = "\x1f".join((date_str, ent["name"], ent["shift"], ent["content"]))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def filter_untransferred(conn: sqlite3.Connection, entries: List[Dict],
+                         date: dt.date) -> List[Dict]:
+    """
+    転記台帳・未完了ジャーナルに無いエントリだけを返す。
+    同じリスト内の重複も 1 件にまとめる。
+    """
+    date_str = date.strftime("%Y-%m-%d")
+    done = {r[0] for r in conn.execute(
+        "SELECT entry_key FROM transfer_ledger WHERE date = ?", (date_str,)
+    )}
+    for (plan,) in conn.execute(
+        "SELECT plan FROM transfer_journal WHERE state = 'planned'"
+    ):
+        done.add(json.loads(plan).get("key"))
+
+    result = []
+    for ent in entries:
+        key = entry_key(date_str, ent)
+        if key in done:
+            continue
+        done.add(key)
+        result.append(ent)
+    return result
+
+
+def record_ledger(conn: sqlite3.Connection, run_id: int, plans: List[Dict]) -> None:
+    """
+    書き終えた計画を転記台帳に記録する（コミットは呼び出し側）。
+    """
+    conn.executemany(
+        """INSERT OR REPLACE INTO transfer_ledger
+           (entry_key, date, name, shift, file, sheet, start_row, end_row, run_id)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        [(p["key"], p["date"], p["name"], p["shift"], p["file"], p["sheet"],
+          p["start_row"], p["next_row"] - 1, run_id) for p in plans],
+    )
+
+
+def untransferred_entries(db_path: str | Path, date_from: dt.date,
+                          date_to: dt.date | None = None) -> Dict[str, List[Dict]]:
+    """
+    diary_entries のうち、まだ個人ファイルへ転記されていないものを日付ごとに返す。
+    前回の転記以降に増えた分だけを流し直すときに使う。
+    氏名は transfer_day と同じく名簿の氏名にそろえてから返す（表記ゆれのある古い行・
+    同期で来た行も、名簿どおりの個人ファイル・シートに転記されるように）。
+    台帳は名簿の氏名でも元の氏名でも探す。
+    戻り値: {"YYYY-MM-DD": [{name, content, shift, author}]}
+    """
+    init_personal_tables(db_path)
+    date_to = date_to or date_from
+    conn = connect_db(db_path)
+    done = {r[0] for r in conn.execute(
+        "SELECT entry_key FROM transfer_ledger WHERE date BETWEEN ? AND ?",
+        (date_from.strftime("%Y-%m-%d"), date_to.strftime("%Y-%m-%d")),
+    )}
+    rows = conn.execute(
+        """SELECT date, resident_name, shift, content, author FROM diary_entries_text
+           WHERE date BETWEEN ? AND ? ORDER BY date, id""",
+        (date_from.strftime("%Y-%m-%d"), date_to.strftime("%Y-%m-%d")),
+    ).fetchall()
+    conn.close()
+
+    index = resident_index(db_path)
+    result: Dict[str, List[Dict]] = {}
+    for date_str, name, shift, content, author in rows:
+        ent = {"name": index.lookup(name) or name, "content": content, "shift": shift,
+               "author": author}
+        if (entry_key(date_str, ent) not in done
+                and entry_key(date_str, dict(ent, name=name)) not in done):
+            result.setdefault(date_str, []).append(ent)
+    return result
+
+
+# ------------------------------------------------------------------
+# Part E : 日裏シートの指紋（変更が無ければ抽出しない）
+# ------------------------------------------------------------------
+
+def sheet_fingerprint(sheets, *, row_start: int = 2, skip_names=()) -> str:
+    """
+    A/B 列の正規化済みの値から、シート内容の指紋（SHA-1）を作る。
+    sheets にはシート1枚か、ura_series で並べた裏シートの続きを渡す。
+    空行は数えず、extract_entries と同じく空行が続いたら打ち切る。
+    skip_names: 指紋に含めない A 列の値（転記後に貼られる Footer など）
+    """
+    if not isinstance(sheets, (list, tuple)):
+        sheets = [sheets]
+    h = hashlib.sha1()
+    for _, _, name, content in iter_series_rows(sheets, row_start, skip_names):
+        h.update(f"{name}\x1f{content}\x1e".encode("utf-8"))
+    return h.hexdigest()
+
+
+def load_sheet_fingerprint(conn: sqlite3.Connection, diary_file: str, sheet_name: str):
+    """
+    前回保存した (fingerprint, entries) を返す。無ければ None。
+    """
+    row = conn.execute(
+        "SELECT fingerprint, entries FROM sheet_fingerprints WHERE diary_file = ? AND sheet = ?",
+        (diary_file, sheet_name),
+    ).fetchone()
+    return (row[0], json.loads(row[1])) if row else None
+
+
+def save_sheet_fingerprint(conn: sqlite3.Connection, diary_file: str, sheet_name: str,
+                           date: dt.date, fingerprint: str, entries: List[Dict]) -> None:
+    """
+    シートの指紋と抽出結果を保存する（コミットは呼び出し側）。
+    """
+    conn.execute(
+        """INSERT OR REPLACE INTO sheet_fingerprints
+           (diary_file, sheet, date, fingerprint, entries, updated_at)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        (diary_file, sheet_name, date.strftime("%Y-%m-%d"), fingerprint,
+         json.dumps(entries, ensure_ascii=False),
+         dt.datetime.now().isoformat(timespec="seconds")),
+    )
+
+
+def diff_entries(previous: List[Dict], current: List[Dict],
+                 date: dt.date) -> tuple[List[Dict], List[Dict]]:
+    """
+    前回の抽出結果と今回の抽出結果を比べる。
+    戻り値: (added, removed)
+      added   前回に無い（追加・修正後の）エントリ。current の順
+      removed 今回は 1 件も無い（削除・修正前の）エントリ。previous の順
+    修正されたエントリは、修正前が removed、修正後が added に入る。
+    同じ内容のエントリは DB・台帳では 1 件なので、今回 1 件でも残っていれば removed に入れない。
+    """
+    seen: Dict[str, int] = {}
+    for ent in previous:
+        key = entry_key(date, ent)
+        seen[key] = seen.get(key, 0) + 1
+
+    added, current_keys = [], set()
+    for ent in current:
+        key = entry_key(date, ent)
+        current_keys.add(key)
+        if seen.get(key):
+            seen[key] -= 1
+        else:
+            added.append(ent)
+
+    removed, dropped = [], set()
+    for ent in previous:
+        key = entry_key(date, ent)
+        if key not in current_keys and key not in dropped:
+            dropped.add(key)
+            removed.append(ent)
+    return added, removed
+
+
+def retract_entries(db_path: str | Path, base_dir: Path, date: dt.date, removed: List[Dict],
+                    *, writer: "DBWriter | None" = None) -> tuple[int, List[str]]:
+    """
+    日裏から消えた（削除・修正前の）エントリを取り消す。
+    転記台帳に記録した個人ファイルの行を、本文欄 RETRACTED_TEXT（2 行目以降は「〃」）に
+    書き換えて記録者欄を空にし、台帳と diary_entries の行を消す。修正後のエントリは
+    新しく転記される（台帳から消すので、元の内容に戻したときも転記し直される）。
+    行を空にしないのは、空き行を次に書く行とみなす規則（シート目録）に拾われないため。
+    アーカイブ済みのシートは、退避先ブックの読み取り専用属性を一時的に外して書き換える。
+    ファイル・シートが見つからない行は書き換えず、台帳の行も残して呼び出し側に知らせる。
+    ファイルを保存してから DB を確定するので、間で落ちても次の転記で同じ行を書き直す。
+    writer を渡すと DB の書き込みは writer に積む。
+    戻り値: (個人ファイルで取り消したエントリの数, 見つからなかった「ファイル シート」の一覧)
+    """
+    if not removed:
+        return 0, []
+    date_str = date.strftime("%Y-%m-%d")
+    index = resident_index(db_path)
+
+    # 台帳は名簿の氏名で記録しているので、抽出した氏名と名簿の氏名の両方で探す
+    keys, stale = set(), set()
+    for ent in removed:
+        for name in {ent["name"], index.lookup(ent["name"]) or ent["name"]}:
+            keys.add(entry_key(date_str, dict(ent, name=name)))
+            stale.add((normalize_key(name), date_str, ent["shift"], content_digest(ent["content"])))
+
+    conn = connect_db(db_path)
+    rows = conn.execute(
+        f"""SELECT entry_key, file, sheet, start_row, end_row FROM transfer_ledger
+            WHERE entry_key IN ({','.join('?' * len(keys))})""", list(keys),
+    ).fetchall()
+    conn.close()
+
+    by_file: Dict[str, List[tuple]] = {}
+    for key, file, sheet, start_row, end_row in rows:
+        by_file.setdefault(file, []).append((key, sheet, start_row, end_row))
+
+    done_keys, missed, catalogs = [], [], []
+    with lock_files(base_dir / f for f in by_file):
+        for file, spans in by_file.items():
+            path = base_dir / file
+            if not path.exists():
+                missed.extend(f"{file} {sheet}" for _, sheet, _, _ in spans)
+                continue
+            archived = file.startswith(ARCHIVE_DIR + "/")
+            with archive_writable(path) if archived else contextlib.nullcontext():
+                wb = openpyxl.load_workbook(path)
+                for key, sheet, start_row, end_row in spans:
+                    if sheet not in wb.sheetnames:
+                        missed.append(f"{file} {sheet}")
+                        continue
+                    ws = wb[sheet]
+                    for row in range(start_row, end_row + 1):
+                        ws.cell(row, 3).value = RETRACTED_TEXT if row == start_row else "〃"
+                        ws.cell(row, 4).value = None
+                    done_keys.append(key)
+                save_workbook_atomic(wb, path)
+            if not archived:            # アーカイブはシート目録に載せない
+                catalogs.append((file, file_stamp(path), catalog_workbook(wb)))
+            wb.close()
+
+    jobs = [(record_retraction, done_keys, sorted(stale))]
+    jobs += [(store_sheet_catalog, *catalog) for catalog in catalogs]
+    if writer is not None:
+        for fn, *args in jobs:
+            writer.submit(fn, *args)
+    else:
+        conn = connect_db(db_path)
+        for fn, *args in jobs:
+            fn(conn, *args)
+        conn.commit()
+        conn.close()
+    return len(done_keys), missed
+
+
+def record_retraction(conn: sqlite3.Connection, ledger_keys: List[str],
+                      stale: List[tuple]) -> None:
+    """
+    取り消したエントリを転記台帳と diary_entries から消す（コミットは呼び出し側）。
+    stale: [(照合キー, 日付, 勤務, 本文のハッシュ)]
+    """
+    conn.executemany("DELETE FROM transfer_ledger WHERE entry_key = ?",
+                     [(k,) for k in ledger_keys])
+    conn.executemany(
+        """DELETE FROM diary_entries
+           WHERE name_key = ? AND date = ? AND shift = ? AND content_hash = ?""",
+        stale,
+    )
+
+
+def resume_transfers(db_path: str | Path, base_dir: Path) -> List[int]:
+    """
+    前回途中で止まった転記を古い順に最後まで実行する。
+    戻り値: 再開した run_id のリスト
+    """
+    init_personal_tables(db_path)
+    conn = connect_db(db_path)
+    run_ids = [r[0] for r in conn.execute(
+        "SELECT run_id FROM transfer_runs WHERE state != 'done' ORDER BY run_id"
+    )]
+    conn.close()
+
+    for run_id in run_ids:
+        run_transfer_journal(db_path, run_id, base_dir)
+    return run_ids
+
+
+# ------------------------------------------------------------------
+# Part F : 個人ファイルの分割レイアウトと移行ツール
+# ------------------------------------------------------------------
+
+def copy_sheet_to_workbook(src_ws, dst_wb, title: str, *, index: int | None = None):
+    """
+    別ブックのシートを値・書式・列幅・行高・結合セル・印刷設定ごと複製する。
+    openpyxl の copy_worksheet は同じブック内でしか使えないため。
+    戻り値: 新しい Worksheet
+    """
+    dst_ws = dst_wb.create_sheet(title, index)
+
+    for row in src_ws.iter_rows():
+        for src in row:
+            if src.value is None and not src.has_style:
+                continue
+            dst = dst_ws.cell(src.row, src.column)
+            dst.value = src.value
+            if src.has_style:
+                dst.font          = copy(src.font)
+                dst.border        = copy(src.border)
+                dst.fill          = copy(src.fill)
+                dst.number_format = src.number_format
+                dst.alignment     = copy(src.alignment)
+                dst.protection    = copy(src.protection)
+
+    for key, dim in src_ws.column_dimensions.items():
+        dst_ws.column_dimensions[key].width = dim.width
+        dst_ws.column_dimensions[key].hidden = dim.hidden
+    for key, dim in src_ws.row_dimensions.items():
+        dst_ws.row_dimensions[key].height = dim.height
+    for rng in src_ws.merged_cells.ranges:
+        dst_ws.merge_cells(str(rng))
+
+    dst_ws.page_setup.orientation = src_ws.page_setup.orientation
+    dst_ws.page_setup.paperSize   = src_ws.page_setup.paperSize
+    dst_ws.page_setup.fitToWidth  = src_ws.page_setup.fitToWidth
+    dst_ws.page_setup.fitToHeight = src_ws.page_setup.fitToHeight
+    dst_ws.page_margins = copy(src_ws.page_margins)
+    dst_ws.print_options = copy(src_ws.print_options)
+    dst_ws.sheet_properties.pageSetUpPr = copy(src_ws.sheet_properties.pageSetUpPr)
+    dst_ws.sheet_format = copy(src_ws.sheet_format)
+    if src_ws.print_area:
+        dst_ws.print_area = src_ws.print_area
+    return dst_ws
+
+
+def resident_of_sheet(sheet_name: str) -> str:
+    """
+    '宮本武蔵(3)' → '宮本武蔵'。続きシートの番号を外して入所者名を返す。
+    """
+    m = re.match(r"^(.*)\((\d+)\)$", sheet_name)
+    return m.group(1) if m else sheet_name
+
+
+def migrate_personal_layout(base_dir: Path, db_path: str | Path, layout: str,
+                            template_src: Path) -> Dict[str, List[str]]:
+    """
+    階ごとの個人ファイル（PF_2F / PF_3F / PF_RET）を、指定レイアウトのファイルに分割する。
+    ・シートは A2 の『令和N年』の年のファイルへ丸ごと移す（シート途中の年替わりは分けない）
+    ・personal_pointer と transfer_ledger のファイル名も、すべての年の DB で書き換える
+    ・元のファイルは 個人ファイル/移行前/ に退避する（削除はしない）
+    元のファイルごとに「複製 → DB の書き換えをコミット → 元のファイルを退避」の順で進める。
+    途中で落ちても元のファイルが残っているので、もう一度実行すれば続きから仕上がる
+    （複製済みのシートは飛ばし、書き換え済みの行はもう元のファイル名を指していない）。
+    戻り値: {新ファイル: [シート名, ...]}
+    """
+    if layout == "floor" or layout not in PERSONAL_LAYOUTS:
+        raise ValueError(f"分割先のレイアウトを指定してください: {layout}")
+
+    # 途中の転記が残っていると行位置がずれるので先に仕上げる
+    resume_transfers(db_path, base_dir)
+
+    moved: Dict[str, List[str]] = {}
+    this_year = dt.date.today().year
+    init_personal_tables(db_path)
+    databases = list(dict.fromkeys([Path(db_path).resolve(),
+                                    *(p.resolve() for p in yearly_databases(base_dir))]))
+
+    for floor, mono_name in FLOOR_FILES.items():
+        mono_path = base_dir / mono_name
+        if not mono_path.exists():
+            continue
+        # 例外で抜けてもロックを残さないよう with で持つ
+        with FileLock(mono_path):
+            src_wb = openpyxl.load_workbook(mono_path)
+
+            # --- シートを分割先ごとに振り分け（元の並び順を保つ） ---
+            groups: Dict[str, list] = {}
+            for ws in src_wb.worksheets:
+                if ws.title in NON_PERSONAL_SHEETS:
+                    continue
+                wareki = personal_sheet_wareki(ws, wareki_year(this_year))
+                room = "退所" if floor == "退所者" else floor[0]
+                target = personal_file_for(room, resident_of_sheet(ws.title),
+                                           wareki + 2018, layout)
+                groups.setdefault(target, []).append(ws)
+
+            renames = []          # (旧ファイル, シート, 新ファイル)
+            for target, sheets in groups.items():
+                with FileLock(base_dir / target):
+                    dst_path = ensure_personal_file(base_dir, target, template_src)
+                    dst_wb = openpyxl.load_workbook(dst_path)
+                    for ws in sheets:
+                        if ws.title not in dst_wb.sheetnames:
+                            copy_sheet_to_workbook(ws, dst_wb, ws.title)
+                        renames.append((mono_name, ws.title, target))
+                        moved.setdefault(target, []).append(ws.title)
+                    remove_sheet1(dst_wb)
+                    save_workbook_atomic(dst_wb, dst_path)
+                    dst_wb.close()
+            src_wb.close()
+
+            # --- ポインタと台帳を新しいファイルへ付け替え（退避より先に確定する） ---
+            for path in databases:
+                repoint_personal_sheets(path, renames)
+
+            # --- 元ファイルを退避 ---
+            backup_dir = base_dir / PERSONAL_DIR / "移行前"
+            backup_dir.mkdir(parents=True, exist_ok=True)
+            os.replace(mono_path, backup_dir / mono_name)
+
+    update_prefs(personal_layout=layout)
+    return moved
+
+
+def repoint_personal_sheets(db_path: str | Path, renames: List[tuple]) -> None:
+    """
+    personal_pointer と transfer_ledger の (旧ファイル, シート) を新しいファイルへ付け替えて
+    コミットする。renames: [(旧ファイル, シート, 新ファイル)]
+    表がまだ無い DB では、ある表だけを書き換える。
+    """
+    conn = connect_db(db_path)
+    try:
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table in ("personal_pointer", "transfer_ledger"):
+            if table in tables:
+                conn.executemany(
+                    f"UPDATE {table} SET file = ? WHERE file = ? AND sheet = ?",
+                    [(new_file, old_file, sheet) for old_file, sheet, new_file in renames],
+                )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# ------------------------------------------------------------------
+# Part G : 集計テーブル（入所者別・勤務別・記録者別の件数）
+# ------------------------------------------------------------------
+
+def init_stats_tables(conn: sqlite3.Connection) -> None:
+    """
+    集計テーブル・トリガー・カバリングインデックスを作成する。
+    集計は diary_entries のトリガーで更新するので、save_entries_to_db と同じ
+    トランザクションで確定する（実際に挿入された行だけが数えられる）。
+    入所者は照合キー（name_key。無い行は氏名）でまとめる。空白・敬称だけ違う氏名の記事も
+    同じ入所者として数える。resident_name は表示用（最後に数えた記事の氏名）。
+    テーブルを新しく作ったとき・氏名でまとめていた頃のテーブルだったときは、
+    既存の diary_entries から作り直す。
+    """
+    columns = {r[1] for r in conn.execute("PRAGMA table_info(stats_monthly)")}
+    if columns and "name_key" not in columns:
+        for trigger in ("insert", "delete", "update"):
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_stats_{trigger}")
+        conn.execute("DROP TABLE stats_monthly")
+        conn.execute("DROP TABLE IF EXISTS stats_last_entry")
+    created = "name_key" not in columns
+
+    # ym = 'YYYY-MM'。shift / author が NULL の行は '' で数える
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_monthly (
+            ym            TEXT NOT NULL,
+            name_key      TEXT NOT NULL,
+            shift         TEXT NOT NULL,
+            author        TEXT NOT NULL,
+            resident_name TEXT NOT NULL,
+            entries       INTEGER NOT NULL,
+            PRIMARY KEY (ym, name_key, shift, author)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_last_entry (
+            name_key      TEXT PRIMARY KEY,
+            resident_name TEXT NOT NULL,
+            last_date     TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+    # 日付範囲の集計用（テーブル本体を読まずに済む）
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_entries_date_cover
+        ON diary_entries(date, shift, author, resident_name)
+    ''')
+    # 入所者ごとの最新記事用
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_entries_resident_date
+        ON diary_entries(resident_name, date)
+    ''')
+
+    def count_in(row: str) -> str:
+        # row（NEW / OLD）の記事 1 件分を stats_monthly に足す
+        return f'''
+            INSERT INTO stats_monthly (ym, name_key, shift, author, resident_name, entries)
+            VALUES (substr({row}.date, 1, 7), COALESCE({row}.name_key, {row}.resident_name),
+                    COALESCE({row}.shift, ''), COALESCE({row}.author, ''), {row}.resident_name, 1)
+            ON CONFLICT (ym, name_key, shift, author)
+            DO UPDATE SET entries = entries + 1, resident_name = excluded.resident_name;'''
+
+    def count_out(row: str) -> str:
+        # row の記事 1 件分を stats_monthly から引く
+        return f'''
+            UPDATE stats_monthly SET entries = entries - 1
+            WHERE ym = substr({row}.date, 1, 7)
+              AND name_key = COALESCE({row}.name_key, {row}.resident_name)
+              AND shift = COALESCE({row}.shift, '') AND author = COALESCE({row}.author, '');
+            DELETE FROM stats_monthly WHERE entries <= 0;'''
+
+    def refresh_last(keys: str) -> str:
+        # keys の入所者の最新記事日を diary_entries から引き直す
+        return f'''
+            DELETE FROM stats_last_entry WHERE name_key IN ({keys});
+            INSERT INTO stats_last_entry (name_key, resident_name, last_date)
+            SELECT COALESCE(name_key, resident_name), MAX(resident_name), MAX(date)
+            FROM diary_entries
+            WHERE name_key IN ({keys}) OR (name_key IS NULL AND resident_name IN ({keys}))
+            GROUP BY 1;'''
+
+    old_key = "COALESCE(OLD.name_key, OLD.resident_name)"
+    new_key = "COALESCE(NEW.name_key, NEW.resident_name)"
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_insert
+        AFTER INSERT ON diary_entries
+        BEGIN
+            {count_in("NEW")}
+
+            INSERT INTO stats_last_entry (name_key, resident_name, last_date)
+            VALUES ({new_key}, NEW.resident_name, NEW.date)
+            ON CONFLICT (name_key)
+            DO UPDATE SET last_date = MAX(last_date, excluded.last_date);
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_delete
+        AFTER DELETE ON diary_entries
+        BEGIN
+            {count_out("OLD")}
+            {refresh_last(old_key)}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_update
+        AFTER UPDATE OF resident_name, name_key, date, shift, author ON diary_entries
+        BEGIN
+            {count_out("OLD")}
+            {count_in("NEW")}
+            {refresh_last(f"{old_key}, {new_key}")}
+        END
+    ''')
+
+    if created:
+        rebuild_stats(conn)
+
+
+def rebuild_stats(conn: sqlite3.Connection) -> None:
+    """
+    集計テーブルを diary_entries から作り直す（コミットは呼び出し側）。
+    """
+    conn.execute("DELETE FROM stats_monthly")
+    conn.execute("DELETE FROM stats_last_entry")
+    conn.execute('''
+        INSERT INTO stats_monthly (ym, name_key, shift, author, resident_name, entries)
+        SELECT substr(date, 1, 7), COALESCE(name_key, resident_name),
+               COALESCE(shift, ''), COALESCE(author, ''), MAX(resident_name), COUNT(*)
+        FROM diary_entries
+        GROUP BY 1, 2, 3, 4
+    ''')
+    conn.execute('''
+        INSERT INTO stats_last_entry (name_key, resident_name, last_date)
+        SELECT COALESCE(name_key, resident_name), MAX(resident_name), MAX(date)
+        FROM diary_entries GROUP BY 1
+    ''')
+
+
+def monthly_stats(db_path: str | Path, ym: str) -> Dict[str, list]:
+    """
+    'YYYY-MM' の件数を集計テーブルから返す。
+    戻り値: {"resident": [(氏名, 日勤, 夜勤, 計)], "shift": [(勤務, 件数)],
+             "author": [(記録者, 件数)]}
+    入所者は照合キーでまとめ、名簿にあれば名簿の氏名で表示する。
+    """
+    conn = connect_db(db_path)
+    resident = conn.execute('''
+        SELECT COALESCE((SELECT name FROM residents r WHERE r.name_key = s.name_key
+                         ORDER BY r.id DESC LIMIT 1), MAX(s.resident_name)) AS name,
+               SUM(CASE WHEN shift = '日勤' THEN entries ELSE 0 END),
+               SUM(CASE WHEN shift = '夜勤' THEN entries ELSE 0 END),
+               SUM(entries)
+        FROM stats_monthly s WHERE ym = ?
+        GROUP BY s.name_key ORDER BY name
+    ''', (ym,)).fetchall()
+    shift = conn.execute('''
+        SELECT shift, SUM(entries) FROM stats_monthly WHERE ym = ?
+        GROUP BY shift ORDER BY shift
+    ''', (ym,)).fetchall()
+    author = conn.execute('''
+        SELECT author, SUM(entries) FROM stats_monthly WHERE ym = ?
+        GROUP BY author ORDER BY SUM(entries) DESC, author
+    ''', (ym,)).fetchall()
+    conn.close()
+    return {"resident": resident, "shift": shift, "author": author}
+
+
+def inactive_residents(db_path: str | Path, days: int,
+                       today: dt.date | None = None) -> List[tuple]:
+    """
+    在籍中（退所以外）で、days 日以上記事が無い入所者を返す。
+    戻り値: [(氏名, 居室, 最終記事日 or None)]  最終記事日の古い順
+    """
+    today = today or dt.date.today()
+    cutoff = (today - dt.timedelta(days=days)).strftime("%Y-%m-%d")
+    conn = connect_db(db_path)
+    rows = conn.execute('''
+        SELECT r.name, r.room, l.last_date
+        FROM residents r
+        LEFT JOIN stats_last_entry l ON l.name_key = r.name_key
+        WHERE r.room != '退所' AND (l.last_date IS NULL OR l.last_date <= ?)
+        ORDER BY l.last_date IS NOT NULL, l.last_date, r.room
+    ''', (cutoff,)).fetchall()
+    conn.close()
+    return rows
+
+
+def night_workload(db_path: str | Path, ym: str) -> List[tuple]:
+    """
+    'YYYY-MM' の夜勤の負担を記録者ごとに返す。
+    戻り値: [(記録者, 夜勤日数, 記事数, 対象入所者数)]
+    """
+    conn = connect_db(db_path)
+    rows = conn.execute('''
+        SELECT COALESCE(author, ''), COUNT(DISTINCT date), COUNT(*),
+               COUNT(DISTINCT resident_name)
+        FROM diary_entries
+        WHERE date >= ? AND date < ? AND shift = '夜勤'
+        GROUP BY 1 ORDER BY 3 DESC
+    ''', (f"{ym}-01", f"{ym}-32")).fetchall()
+    conn.close()
+    return rows
+
+
+def format_stats_report(db_path: str | Path, ym: str, days: int = 7,
+                        today: dt.date | None = None) -> str:
+    """
+    統計画面・コマンドライン共通の月次レポート文字列を作る。
+    """
+    stats = monthly_stats(db_path, ym)
+    lines = [f"■ {ym} 入所者別（日勤 / 夜勤 / 計）"]
+    lines += [f"  {n}\t{d} / {nt} / {t}" for n, d, nt, t in stats["resident"]]
+    lines.append("■ 勤務別")
+    lines += [f"  {s or '(不明)'}\t{c}" for s, c in stats["shift"]]
+    lines.append("■ 記録者別")
+    lines += [f"  {a or '(不明)'}\t{c}" for a, c in stats["author"]]
+    lines.append("■ 夜勤負担（夜勤日数 / 記事数 / 入所者数）")
+    lines += [f"  {a or '(不明)'}\t{n} / {c} / {r}"
+              for a, n, c, r in night_workload(db_path, ym)]
+    lines.append(f"■ {days} 日以上記事の無い入所者")
+    lines += [f"  {rm}\t{n}\t{last or '記事なし'}"
+              for n, rm, last in inactive_residents(db_path, days, today)]
+    return "\n".join(lines)
+
+
+def stats_report_ui(db_path: str | Path):
+    """
+    月次統計を表示するウィンドウ。
+    """
+    win = tk.Toplevel()
+    win.title("記録統計")
+
+    tk.Label(win, text="年月 (YYYY-MM)").grid(row=0, column=0)
+    ym_entry = tk.Entry(win, width=10)
+    ym_entry.insert(0, dt.date.today().strftime("%Y-%m"))
+    ym_entry.grid(row=0, column=1, sticky="w")
+
+    tk.Label(win, text="記事なし日数").grid(row=1, column=0)
+    days_entry = tk.Entry(win, width=10)
+    days_entry.insert(0, "7")
+    days_entry.grid(row=1, column=1, sticky="w")
+
+    text = tk.Text(win, width=60, height=30)
+    text.grid(row=3, column=0, columnspan=2)
+
+    def show():
+        ym = ym_entry.get().strip()
+        if not re.fullmatch(r"\d{4}-\d{2}", ym) or not days_entry.get().strip().isdigit():
+            messagebox.showerror("エラー", "年月と日数を正しく入力してください。")
+            return
+        text.delete("1.0", tk.END)
+        text.insert(tk.END, format_stats_report(db_path, ym, int(days_entry.get())))
+
+    tk.Button(win, text="表示", command=show).grid(row=2, column=0, columnspan=2, pady=5)
+    show()
+
+
+# ------------------------------------------------------------------
+# Part H : diary_entries のストリーミング出力（CSV / JSONL）
+# ------------------------------------------------------------------
+
+EXPORT_COLUMNS = ("id", "date", "shift", "resident_name", "room", "author", "content")
+
+# floor_of() と同じ振り分けを SQL で表したもの
+FLOOR_SQL = {
+    "2階":   "r.room LIKE '2%'",
+    "3階":   "r.room LIKE '3%'",
+    "退所者": "(r.room IS NULL OR NOT (r.room LIKE '2%' OR r.room LIKE '3%'))",
+}
+
+
+def init_export_tables(conn: sqlite3.Connection) -> None:
+    """
+    差分出力用のカーソル（出力名ごとの最終 id）テーブルを作成する。
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS export_cursors (
+            name        TEXT PRIMARY KEY,
+            last_id     INTEGER NOT NULL,
+            updated_at  TEXT NOT NULL
+        )
+    ''')
+
+
+def entry_source(conn: sqlite3.Connection) -> str:
+    """
+    記事を読む表の名前。圧縮済みの本文も読める diary_entries_text ビューを使い、
+    ビューを作る前の DB（読み取り専用で開いて移行していないもの）では diary_entries を読む。
+    """
+    found = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = 'diary_entries_text'"
+    ).fetchone()
+    return "diary_entries_text" if found else "diary_entries"
+
+
+def iter_export_rows(conn: sqlite3.Connection, *, date_from: dt.date | None = None,
+                     date_to: dt.date | None = None, floor: str | None = None,
+                     resident: str | None = None, after_id: int = 0,
+                     chunk_size: int = 1000) -> Iterator[tuple]:
+    """
+    diary_entries と residents を結合した行を id 順に chunk_size 件ずつ読み出して返す。
+    全件をメモリに載せないので、件数が増えても使用メモリは一定。
+    """
+    where = ["e.id > ?"]
+    params: list = [after_id]
+    if date_from:
+        where.append("e.date >= ?")
+        params.append(date_from.strftime("%Y-%m-%d"))
+    if date_to:
+        where.append("e.date <= ?")
+        params.append(date_to.strftime("%Y-%m-%d"))
+    if resident:
+        where.append("e.resident_name = ?")
+        params.append(resident)
+    if floor:
+        where.append(FLOOR_SQL[floor])
+
+    # 同名の入所者が複数行あるときは最後に登録した行の居室を使う
+    cur = conn.execute(f'''
+        SELECT e.id, e.date, e.shift, e.resident_name, r.room, e.author, e.content
+        FROM {entry_source(conn)} e
+        LEFT JOIN residents r
+          ON r.id = (SELECT MAX(id) FROM residents WHERE name = e.resident_name)
+        WHERE {" AND ".join(where)}
+        ORDER BY e.id
+    ''', params)
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield from rows
+
+
+def export_entries(db_path: str | Path, out, *, fmt: str = "csv",
+                   date_from: dt.date | None = None, date_to: dt.date | None = None,
+                   floor: str | None = None, resident: str | None = None,
+                   since_last: str | None = None, chunk_size: int = 1000) -> int:
+    """
+    diary_entries を CSV または JSONL で out（テキストストリーム）へ書き出す。
+    since_last に出力名を渡すと、その名前で前回出力した行より後に追加された分だけを出し、
+    書き終えたらカーソルを進める。
+    DB は読み取り専用で開く（無ければ FileNotFoundError。空の DB を作ったりスキーマを
+    変えたりしない）。書き込むのは since_last のカーソルだけ。
+    戻り値: 出力した行数
+    """
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError(f"未対応の出力形式: {fmt}")
+    if floor and floor not in FLOOR_SQL:
+        raise ValueError(f"階は {', '.join(FLOOR_SQL)} のいずれか: {floor}")
+
+    conn = connect_db(db_path, readonly=True)
+    after_id = 0
+    if since_last:
+        try:
+            row = conn.execute(
+                "SELECT last_id FROM export_cursors WHERE name = ?", (since_last,)
+            ).fetchone()
+        except sqlite3.OperationalError:     # まだ一度も差分出力していない DB
+            row = None
+        after_id = row[0] if row else 0
+
+    writer = csv.writer(out) if fmt == "csv" else None
+    if writer:
+        writer.writerow(EXPORT_COLUMNS)
+
+    count, last_id = 0, after_id
+    for row in iter_export_rows(conn, date_from=date_from, date_to=date_to,
+                                floor=floor, resident=resident,
+                                after_id=after_id, chunk_size=chunk_size):
+        if writer:
+            writer.writerow(row)
+        else:
+            out.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n")
+        count += 1
+        last_id = row[0]
+
+    conn.close()
+
+    if since_last:
+        conn = connect_db(db_path)
+        init_export_tables(conn)
+        conn.execute(
+            """INSERT OR REPLACE INTO export_cursors (name, last_id, updated_at)
+               VALUES (?, ?, ?)""",
+            (since_last, last_id, dt.datetime.now().isoformat(timespec="seconds")),
+        )
+        conn.commit()
+        conn.close()
+    return count
+
+
+# ------------------------------------------------------------------
+# Part I : 入所者名の照合（表記ゆれ・旧字体・誤字）
+# ------------------------------------------------------------------
+
+RESOLVE_ACCEPT = 0.75   # これ以上の一致度なら自動で名簿の氏名に置き換える
+RESOLVE_REVIEW = 0.40   # これ以上なら候補付きで確認に回す（未満は名簿に無い氏名）
+
+# 旧字体・異体字 → 名簿で使う字体
+_VARIANT_TABLE = str.maketrans({
+    "髙": "高", "﨑": "崎", "嵜": "崎", "邊": "辺", "邉": "辺", "齋": "斎", "齊": "斉",
+    "澤": "沢", "濱": "浜", "濵": "浜", "廣": "広", "國": "国", "櫻": "桜", "榮": "栄",
+    "德": "徳", "惠": "恵", "曻": "昇", "瀨": "瀬", "冨": "富", "塚": "塚", "槇": "槙",
+    "眞": "真", "實": "実", "淸": "清", "條": "条", "傳": "伝", "藏": "蔵", "彌": "弥",
+    "龍": "竜", "靜": "静", "壽": "寿", "增": "増", "學": "学", "廸": "迪",
+})
+
+
+def resolver_key(name) -> str:
+    """
+    照合用キー: normalize_key に旧字体・異体字の統一を加えたもの。
+    """
+    return normalize_key(name).translate(_VARIANT_TABLE)
+
+
+def _bigrams(key: str) -> set:
+    # 先頭・末尾の印を付けて、1〜2 文字の氏名でも比べられるようにする
+    padded = f"^{key}$"
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+class ResidentResolver:
+    """
+    residents から作る氏名の照合器。
+    照合キーの完全一致表と、文字 bigram の転置索引を先に作っておき、
+    1 件の照合は候補の bigram を数えるだけで済ませる。
+    """
+
+    def __init__(self, rows, aliases=()):
+        # rows: [(氏名, 居室)]  後の行ほど優先（在籍中を後に並べておく）
+        self.exact: Dict[str, str] = {}
+        self.names: List[str] = []
+        self.grams: List[set] = []
+        self.index: Dict[str, set] = {}
+        for name, _room in rows:
+            self.add(name)
+        for alias_key, name in aliases:
+            self.exact[alias_key] = name
+
+    @classmethod
+    def from_db(cls, conn: sqlite3.Connection) -> "ResidentResolver":
+        try:
+            rows = conn.execute(
+                "SELECT name, room FROM residents ORDER BY room != '退所', id"
+            ).fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        init_resolver_tables(conn)
+        aliases = conn.execute("SELECT alias_key, name FROM resident_aliases").fetchall()
+        return cls(rows, aliases)
+
+    def add(self, name: str) -> None:
+        key = resolver_key(name)
+        if not key:
+            return
+        self.exact[key] = name
+        if name in self.names:
+            return
+        idx = len(self.names)
+        self.names.append(name)
+        grams = _bigrams(key)
+        self.grams.append(grams)
+        for g in grams:
+            self.index.setdefault(g, set()).add(idx)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def resolve(self, typed: str) -> Dict:
+        """
+        戻り値: {"typed", "name", "score", "status"}
+          status = exact（キー一致）/ fuzzy（自動置換）/ review（要確認）/ unknown（名簿に無い）
+          name   = 名簿の氏名（review は候補、unknown は入力のまま）
+        """
+        key = resolver_key(typed)
+        if key in self.exact:
+            return {"typed": typed, "name": self.exact[key], "score": 1.0, "status": "exact"}
+
+        grams = _bigrams(key)
+        shared: Dict[int, int] = {}
+        for g in grams:
+            for idx in self.index.get(g, ()):
+                shared[idx] = shared.get(idx, 0) + 1
+
+        # Dice 係数で順位付け
+        scored = sorted(
+            ((2 * n / (len(grams) + len(self.grams[idx])), idx) for idx, n in shared.items()),
+            reverse=True,
+        )
+        if not scored or scored[0][0] < RESOLVE_REVIEW:
+            return {"typed": typed, "name": typed, "score": scored[0][0] if scored else 0.0,
+                    "status": "unknown"}
+
+        best, idx = scored[0]
+        runner_up = scored[1][0] if len(scored) > 1 else 0.0
+        status = "fuzzy" if best >= RESOLVE_ACCEPT and best - runner_up >= 0.1 else "review"
+        return {"typed": typed, "name": self.names[idx], "score": round(best, 3),
+                "status": status}
+
+
+def init_resolver_tables(conn: sqlite3.Connection) -> None:
+    """
+    確認済みの表記ゆれ（別名）と、確認に回した氏名の記録テーブルを作成する。
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS resident_aliases (
+            alias_key  TEXT PRIMARY KEY,
+            name       TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS name_reviews (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            date        TEXT NOT NULL,
+            typed       TEXT NOT NULL,
+            candidate   TEXT,
+            score       REAL NOT NULL,
+            status      TEXT NOT NULL,
+            decision    TEXT,
+            created_at  TEXT NOT NULL
+        )
+    ''')
+
+
+def resolve_entry_names(entries: List[Dict], resolver: ResidentResolver):
+    """
+    各エントリの氏名を照合する。
+    戻り値: (氏名を置き換えた新リスト, 確認が必要な照合結果のリスト)
+    自動で置き換えるのは exact / fuzzy だけ。review / unknown は入力のまま残す。
+    """
+    if not len(resolver):
+        return [e.copy() for e in entries], []   # 名簿が空なら照合しない
+
+    cache: Dict[str, Dict] = {}
+    result, review = [], []
+    for e in entries:
+        typed = e["name"]
+        if typed not in cache:
+            cache[typed] = resolver.resolve(typed)
+            if cache[typed]["status"] in ("review", "unknown"):
+                review.append(cache[typed])
+        e2 = e.copy()
+        if cache[typed]["status"] in ("exact", "fuzzy"):
+            e2["name"] = cache[typed]["name"]
+        result.append(e2)
+    return result, review
+
+
+def record_name_review(conn: sqlite3.Connection, date: dt.date, review: List[Dict],
+                       decision: str) -> None:
+    """
+    確認に回した氏名と判断（accepted / rejected）を記録する。
+    accepted の review は別名として覚え、次回からは確認なしで置き換える。
+    """
+    init_resolver_tables(conn)
+    now = dt.datetime.now().isoformat(timespec="seconds")
+    conn.executemany(
+        """INSERT INTO name_reviews
+           (date, typed, candidate, score, status, decision, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        [(date.strftime("%Y-%m-%d"), m["typed"],
+          m["name"] if m["status"] == "review" else None,
+          m["score"], m["status"], decision, now) for m in review],
+    )
+    if decision == "accepted":
+        conn.executemany(
+            "INSERT OR REPLACE INTO resident_aliases (alias_key, name) VALUES (?, ?)",
+            [(resolver_key(m["typed"]), m["name"]) for m in review if m["status"] == "review"],
+        )
+    conn.commit()
+
+
+def confirm_name_review(review: List[Dict]) -> bool:
+    """
+    名簿と一致しない氏名を一覧で見せ、転記を続けるか確認する。
+    「はい」なら候補の氏名に置き換えて続行、「いいえ」なら転記を中止する。
+    """
+    lines = []
+    for m in review:
+        if m["status"] == "review":
+            lines.append(f"・{m['typed']} → {m['name']}（一致度 {m['score']:.2f}）")
+        else:
+            lines.append(f"・{m['typed']}（名簿にありません）")
+    return messagebox.askyesno(
+        "氏名の確認",
+        "次の氏名が名簿と一致しません。\n\n" + "\n".join(lines) +
+        "\n\n候補のある氏名は候補に置き換えて転記しますか？\n"
+        "（「いいえ」で転記を中止します。日誌を直してからやり直してください）",
+    )
+
+
+# ------------------------------------------------------------------
+# Part J : 退所者・過年度シートのアーカイブ（読み取り専用ブックへ退避）
+# ------------------------------------------------------------------
+
+ARCHIVE_DIR = f"{PERSONAL_DIR}/アーカイブ"
+RETIRED_ARCHIVE_DAYS = 365          # 退所後この日数記事が無ければアーカイブする
+
+
+def archive_file_for(wareki: int) -> str:
+    """
+    令和N年のシートの退避先（base_dir からの相対パス）。例: 個人ファイル/アーカイブ/R6.xlsx
+    """
+    return f"{ARCHIVE_DIR}/R{wareki}.xlsx"
+
+
+def hot_personal_files(base_dir: Path) -> List[str]:
+    """
+    転記で開く個人ファイル（アーカイブ・移行前は除く）を base_dir からの相対パスで返す。
+    """
+    files = [name for name in FLOOR_FILES.values() if (base_dir / name).exists()]
+    for floor in FLOOR_FILES:
+        for p in sorted((base_dir / PERSONAL_DIR / floor).glob("*.xlsx")):
+            if not p.name.startswith("~"):          # Excel の所有者ファイル・保存途中の一時ファイル
+                files.append(p.relative_to(base_dir).as_posix())
+    return files
+
+
+def archived_sheets(conn: sqlite3.Connection, src_file: str) -> set:
+    """
+    src_file から退避済みのシート名。同じ名前の続きシートを作り直さないために使う。
+    """
+    return {r[0] for r in conn.execute(
+        "SELECT src_sheet FROM archive_index WHERE src_file = ?", (src_file,)
+    )}
+
+
+def retired_residents(conn: sqlite3.Connection, days: int) -> set:
+    """
+    退所済みで、days 日以上記事の無い入所者の照合キー（normalize_key）の集合。
+    """
+    cutoff = (dt.date.today() - dt.timedelta(days=days)).isoformat()
+    rows = conn.execute('''
+        SELECT r.name FROM residents r
+        LEFT JOIN stats_last_entry s ON s.name_key = r.name_key
+        WHERE r.room = '退所' AND (s.last_date IS NULL OR s.last_date < ?)
+    ''', (cutoff,)).fetchall()
+    return {normalize_key(name) for (name,) in rows}
+
+
+@contextlib.contextmanager
+def archive_writable(path: Path):
+    """
+    退避先ブックの読み取り専用属性を外している間だけ書き込めるようにし、抜けるときに戻す。
+    （Windows では読み取り専用のファイルへ os.replace できないため）
+    """
+    if path.exists():
+        os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+    try:
+        yield
+    finally:
+        if path.exists():
+            os.chmod(path, stat.S_IREAD)
+
+
+def _copy_to_archive(path: Path, sheets: List) -> List[str]:
+    """
+    sheets を退避先ブックの末尾に複製し、読み取り専用（シート保護・ブック構成保護・
+    ファイル属性）で保存する。退避先で名前が重なるときは番号を付け直す。
+    戻り値: 退避先でのシート名（sheets と同じ順）
+    """
+    from openpyxl.workbook.protection import WorkbookProtection
+
+    with archive_writable(path):
+        if path.exists():
+            dst_wb = openpyxl.load_workbook(path)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            dst_wb = openpyxl.Workbook()
+            dst_wb.remove(dst_wb.active)
+
+        titles = []
+        for ws in sheets:
+            resident, title, idx = resident_of_sheet(ws.title), ws.title, 2
+            while title in dst_wb.sheetnames:
+                title = increment_sheet_name(resident, idx)
+                idx += 1
+            copy_sheet_to_workbook(ws, dst_wb, title).protection.sheet = True
+            titles.append(title)
+
+        dst_wb.security = WorkbookProtection(lockStructure=True)
+        save_workbook_atomic(dst_wb, path)
+        dst_wb.close()
+    return titles
+
+
+def archive_personal_sheets(base_dir: Path, db_path: str | Path, *,
+                            retired_days: int = RETIRED_ARCHIVE_DAYS,
+                            closed_before: int | None = None) -> Dict[str, List[str]]:
+    """
+    個人ファイルから次のシートを 個人ファイル/アーカイブ/R{n}.xlsx へ移す。
+      ・退所して retired_days 日以上記事の無い入所者のシート（書き込み中のシートも含む）
+      ・A2 の『令和N年』が closed_before より前で、書き込み中でないシート
+        （closed_before は令和年。省略時は今年 = 前年までを締める）
+    退避先は A2 の年ごと。移した場所は archive_index に記録し、personal_pointer と
+    transfer_ledger も付け替える。
+    手順は 退避先へ複製 → DB 記録（state='copied'）→ 元ブックから削除 → state='done'。
+    途中で落ちても、次回 'copied' のシートを元ブックから消すところから続ける。
+    戻り値: {退避先ファイル: [シート名, ...]}
+    """
+    create_database_if_not_exists(str(db_path))
+    init_personal_tables(db_path)
+    # 途中の転記が残っていると行位置がずれるので先に仕上げる
+    resume_transfers(db_path, base_dir)
+
+    closed_before = closed_before or wareki_year(dt.date.today().year)
+    conn = connect_db(db_path)
+    retired = retired_residents(conn, retired_days)
+    active = set(conn.execute("SELECT file, sheet FROM personal_pointer").fetchall())
+    conn.close()
+
+    moved: Dict[str, List[str]] = {}
+    for src in hot_personal_files(base_dir):
+        src_path = base_dir / src
+        with FileLock(src_path):
+            wb = openpyxl.load_workbook(src_path)
+            conn = connect_db(db_path)
+            pending = [r[0] for r in conn.execute(
+                "SELECT src_sheet FROM archive_index WHERE src_file = ? AND state = 'copied'",
+                (src,),
+            )]
+
+            # --- 退避するシートを年ごとに振り分け（元の並び順を保つ） ---
+            groups: Dict[str, list] = {}
+            for ws in wb.worksheets:
+                if ws.title in NON_PERSONAL_SHEETS or ws.title in pending:
+                    continue
+                resident = resident_of_sheet(ws.title)
+                wareki = personal_sheet_wareki(ws, closed_before)
+                if normalize_key(resident) not in retired and (
+                        wareki >= closed_before or (src, ws.title) in active):
+                    continue
+                groups.setdefault(archive_file_for(wareki), []).append((ws, resident, wareki))
+
+            # --- 退避先へ複製し、場所を記録 ---
+            now = dt.datetime.now().isoformat(timespec="seconds")
+            for target, items in groups.items():
+                with FileLock(base_dir / target):
+                    titles = _copy_to_archive(base_dir / target, [ws for ws, _, _ in items])
+                with conn:
+                    for (ws, resident, wareki), title in zip(items, titles):
+                        conn.execute('''
+                            INSERT OR REPLACE INTO archive_index
+                                (archive_file, sheet, resident, resident_key, wareki,
+                                 src_file, src_sheet, state, archived_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, 'copied', ?)
+                        ''', (target, title, resident, normalize_key(resident), wareki,
+                              src, ws.title, now))
+                        for table in ("personal_pointer", "transfer_ledger"):
+                            conn.execute(
+                                f"UPDATE {table} SET file = ?, sheet = ? WHERE file = ? AND sheet = ?",
+                                (target, title, src, ws.title),
+                            )
+                        pending.append(ws.title)
+                        moved.setdefault(target, []).append(title)
+
+            # --- 元ブックから削除して小さくする ---
+            if pending:
+                for title in pending:
+                    if title in wb.sheetnames:
+                        wb.remove(wb[title])
+                left = [t for t in wb.sheetnames if t not in NON_PERSONAL_SHEETS]
+                if not left:
+                    # 空になったファイルは消す（テンプレート用シートは非表示で保存できない。
+                    # 次に必要になれば ensure_personal_file が作り直す）
+                    os.remove(src_path)
+                else:
+                    save_workbook_atomic(wb, src_path)
+                with conn:
+                    conn.execute(
+                        "UPDATE archive_index SET state = 'done' WHERE src_file = ? AND state = 'copied'",
+                        (src,),
+                    )
+            wb.close()
+            conn.close()
+    return moved
+
+
+def resident_history(db_path: str | Path, name: str) -> List[tuple]:
+    """
+    入所者の記録があるシートの所在を、アーカイブ分も含めて 1 回の問い合わせで返す。
+    氏名は照合キーで比べる（空白・敬称だけ違う書き方でも同じ入所者のシートが出る）。
+    戻り値: [(ファイル, シート, アーカイブなら True), ...]  アーカイブ（古い年）→ 現役の順
+    """
+    init_personal_tables(db_path)
+    conn = connect_db(db_path)
+    rows = conn.execute('''
+        SELECT file, sheet, MIN(hot) = 0 FROM (
+            SELECT archive_file AS file, sheet, wareki, 0 AS hot
+              FROM archive_index WHERE resident_key = ?1
+            UNION ALL
+            SELECT file, sheet, NULL, 1 FROM transfer_ledger WHERE normalize_key(name) = ?1
+            UNION ALL
+            SELECT file, sheet, NULL, 1 FROM personal_pointer WHERE normalize_key(name) = ?1
+        )
+        GROUP BY file, sheet
+        ORDER BY MIN(hot), MIN(wareki), file, sheet
+    ''', (normalize_key(name),)).fetchall()
+    conn.close()
+    return [(file, sheet, bool(archived)) for file, sheet, archived in rows]
+
+
+# ------------------------------------------------------------------
+# Part K : ブックの肥大化監視（保存時間の予測と警告）
+# ------------------------------------------------------------------
+
+# (列名, 表示名, 単位, prefs の上限キー)
+GROWTH_METRICS = (
+    ("size_mb",  "サイズ",     "MB",   "limit_size_mb"),
+    ("sheets",   "シート数",   "枚",   "limit_sheets"),
+    ("max_rows", "最大行数",   "行",   "limit_max_rows"),
+    ("styles",   "スタイル数", "個",   "limit_styles"),
+)
+GROWTH_WARN_RATIO = 0.8        # 上限の 8 割で警告する
+GROWTH_MODEL_SAMPLES = 500     # 保存時間のモデルに使う直近の記録数
+GROWTH_MODEL_MIN = 8           # これより記録が少なければ実測値をそのまま使う
+GROWTH_ADVICE = ("過年度・退所者のシートを移す（python WorkDiary.py archive）か、"
+                 "個人ファイルを分割する（python WorkDiary.py migrate-layout）ことを検討してください。"
+                 "スタイル数が多いときは python WorkDiary.py slim-personal で不要な書式を落とせます。")
+
+
+def init_growth_tables(conn: sqlite3.Connection) -> None:
+    """
+    保存ごとのブックの大きさと保存時間の記録テーブルを作成する。
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS workbook_metrics (
+            id            INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id        INTEGER,
+            file          TEXT NOT NULL,
+            saved_at      TEXT NOT NULL,
+            size_bytes    INTEGER NOT NULL,
+            sheets        INTEGER NOT NULL,
+            max_rows      INTEGER NOT NULL,
+            styles        INTEGER NOT NULL,
+            save_seconds  REAL NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_metrics_file ON workbook_metrics(file, id)
+    ''')
+
+
+def save_workbook_measured(wb, path: str | Path, file: str | None = None) -> Dict:
+    """
+    save_workbook_atomic で保存し、保存時間とブックの大きさを返す。
+    file: 記録に使う名前（省略時はファイル名）
+    """
+    started = time.perf_counter()
+    save_workbook_atomic(wb, path)
+    seconds = time.perf_counter() - started
+    return {
+        "file": file or Path(path).name,
+        "size_bytes": os.path.getsize(path),
+        "sheets": len(wb.worksheets),
+        "max_rows": max((ws.max_row for ws in wb.worksheets), default=0),
+        "styles": len(wb._cell_styles),
+        "save_seconds": round(seconds, 4),
+    }
+
+
+def record_workbook_metrics(conn: sqlite3.Connection, run_id: int | None,
+                            metrics: List[Dict]) -> None:
+    """
+    save_workbook_measured の結果を workbook_metrics に追記する（コミットは呼び出し側）。
+    """
+    init_growth_tables(conn)
+    now = dt.datetime.now().isoformat(timespec="seconds")
+    conn.executemany('''
+        INSERT INTO workbook_metrics
+            (run_id, file, saved_at, size_bytes, sheets, max_rows, styles, save_seconds)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(run_id, m["file"], now, m["size_bytes"], m["sheets"], m["max_rows"],
+           m["styles"], m["save_seconds"]) for m in metrics])
+
+
+def _growth_features(m: Dict) -> List[float]:
+    # 桁をそろえておく（正規方程式の解が安定する）
+    return [1.0, m["sheets"] / 100, m["max_rows"] / 1000, m["styles"] / 1000,
+            m["size_bytes"] / 2 ** 20]
+
+
+def fit_save_model(samples: List[Dict]) -> Optional[List[float]]:
+    """
+    保存時間 ≈ b0 + b1*シート数 + b2*最大行数 + b3*スタイル数 + b4*サイズ を
+    最小二乗（わずかにリッジ正則化）で当てはめて係数を返す。
+    記録が少ない・値が偏っていて解けないときは None。
+    """
+    if len(samples) < GROWTH_MODEL_MIN:
+        return None
+    xs = [_growth_features(m) for m in samples]
+    k = len(xs[0])
+    a = [[sum(x[i] * x[j] for x in xs) + (1e-3 if i == j and i else 0.0)
+          for j in range(k)] for i in range(k)]
+    b = [sum(x[i] * m["save_seconds"] for x, m in zip(xs, samples)) for i in range(k)]
+
+    # ガウスの消去法（部分ピボット）
+    for col in range(k):
+        pivot = max(range(col, k), key=lambda r: abs(a[r][col]))
+        if abs(a[pivot][col]) < 1e-12:
+            return None
+        a[col], a[pivot] = a[pivot], a[col]
+        b[col], b[pivot] = b[pivot], b[col]
+        for r in range(col + 1, k):
+            f = a[r][col] / a[col][col]
+            for c in range(col, k):
+                a[r][c] -= f * a[col][c]
+            b[r] -= f * b[col]
+    coef = [0.0] * k
+    for r in reversed(range(k)):
+        coef[r] = (b[r] - sum(a[r][c] * coef[c] for c in range(r + 1, k))) / a[r][r]
+    return coef
+
+
+def predict_save_seconds(coef: Optional[List[float]], m: Dict) -> float:
+    """
+    fit_save_model の係数で保存時間を予測する。モデルが無ければ実測値。
+    """
+    if coef is None:
+        return m["save_seconds"]
+    return max(0.0, sum(c * x for c, x in zip(coef, _growth_features(m))))
+
+
+def growth_report(db_path: str | Path, *, run_id: int | None = None,
+                  prefs: Dict | None = None) -> tuple[List[Dict], List[str]]:
+    """
+    ファイルごとの最新の記録と予測保存時間、上限に近いファイルへの警告文を返す。
+    run_id を渡すとその転記で保存したファイルだけを見る。上限は prefs.json の limit_*。
+    戻り値: ([{file, size_mb, sheets, max_rows, styles, save_seconds, predicted}], [警告文])
+    """
+    prefs = prefs or load_prefs()
+    conn = connect_db(db_path)
+    init_growth_tables(conn)
+    cols = ("file", "size_bytes", "sheets", "max_rows", "styles", "save_seconds")
+    samples = [dict(zip(cols, r)) for r in conn.execute(f'''
+        SELECT {", ".join(cols)} FROM workbook_metrics ORDER BY id DESC LIMIT ?
+    ''', (GROWTH_MODEL_SAMPLES,))]
+    where = "WHERE run_id = ?" if run_id is not None else ""
+    latest = [dict(zip(cols, r)) for r in conn.execute(f'''
+        SELECT {", ".join(cols)} FROM workbook_metrics
+        WHERE id IN (SELECT MAX(id) FROM workbook_metrics {where} GROUP BY file)
+        ORDER BY file
+    ''', (run_id,) if run_id is not None else ())]
+    conn.close()
+
+    coef = fit_save_model(samples)
+    rows, warnings = [], []
+    for m in latest:
+        m["size_mb"] = m["size_bytes"] / 2 ** 20
+        m["predicted"] = predict_save_seconds(coef, m)
+        rows.append(m)
+
+        notes = []
+        for key, label, unit, pref_key in GROWTH_METRICS:
+            limit = prefs.get(pref_key)
+            if limit and m[key] >= GROWTH_WARN_RATIO * limit:
+                notes.append(f"{label} {m[key]:,.1f}{unit}（上限 {limit:,}{unit}）"
+                             if key == "size_mb" else
+                             f"{label} {m[key]:,}{unit}（上限 {limit:,}{unit}）")
+        limit = prefs.get("limit_save_seconds")
+        if limit and m["predicted"] >= GROWTH_WARN_RATIO * limit:
+            notes.append(f"保存時間（予測） {m['predicted']:.1f}秒（上限 {limit}秒）")
+        if notes:
+            warnings.append(f"{m['file']}: " + "、".join(notes))
+    return rows, warnings
+
+
+def format_growth_report(db_path: str | Path) -> str:
+    """
+    growth_report をテキストの表にする（CLI 用）。
+    """
+    rows, warnings = growth_report(db_path)
+    lines = ["ファイル\tサイズ(MB)\tシート\t最大行\tスタイル\t保存(秒)\t予測(秒)"]
+    for m in rows:
+        lines.append(f"{m['file']}\t{m['size_mb']:.2f}\t{m['sheets']}\t{m['max_rows']}\t"
+                     f"{m['styles']}\t{m['save_seconds']:.2f}\t{m['predicted']:.2f}")
+    if warnings:
+        lines += ["", "【上限に近いファイル】"] + warnings + [GROWTH_ADVICE]
+    return "\n".join(lines)
+
+
+# ------------------------------------------------------------------
+# Part L : 入所者ごとの記録の振り返り（個人ファイルを開かずに DB から読む）
+# ------------------------------------------------------------------
+
+TIMELINE_PAGE = 50              # 1 回に読む件数
+TIMELINE_PRELOAD = 0.9          # 一覧のこの位置までスクロールしたら続きを読む
+
+
+def timeline_page(db_path: str | Path, name: str, *, before: tuple | None = None,
+                  limit: int = TIMELINE_PAGE) -> List[tuple]:
+    """
+    入所者の記事を新しい順に limit 件返す。
+    before=(date, id) を渡すとそれより古いものだけ（キーセット方式なので何ページ目でも速い）。
+    氏名は照合キーで引くので、idx_entries_name_key(name_key, date) を逆順にたどるだけで済む。
+    DB は読み取り専用で開く（他の階の書き込みを待たせない・待たない）。
+    戻り値: [(date, id, shift, author, content), ...]
+    """
+    conn = connect_db(db_path, readonly=True)
+    source = entry_source(conn)
+    if before is None:
+        rows = conn.execute(f'''
+            SELECT date, id, shift, author, content FROM {source}
+            WHERE name_key = ?
+            ORDER BY date DESC, id DESC LIMIT ?
+        ''', (normalize_key(name), limit)).fetchall()
+    else:
+        rows = conn.execute(f'''
+            SELECT date, id, shift, author, content FROM {source}
+            WHERE name_key = ? AND (date, id) < (?, ?)
+            ORDER BY date DESC, id DESC LIMIT ?
+        ''', (normalize_key(name), before[0], before[1], limit)).fetchall()
+    conn.close()
+    return rows
+
+
+def has_name_key(db_path: str | Path) -> bool:
+    """
+    diary_entries に照合キー列 name_key がある DB か（起動時の移行が済んでいるか）。
+    """
+    conn = connect_db(db_path, readonly=True)
+    try:
+        return "name_key" in {r[1] for r in conn.execute("PRAGMA table_info(diary_entries)")}
+    finally:
+        conn.close()
+
+
+class ResidentTimeline:
+    """
+    年ごとの DB（diary_YYYY.db）を新しい年から順にまたいで、記事を 1 ページずつ読み進める。
+    DB は読み取り専用で開くだけで、スキーマは変えない（移行は起動時の migrate_databases）。
+    name_key の無い、まだ移行していない年は飛ばす。
+    """
+
+    def __init__(self, base_dir: Path, name: str):
+        self.name = name
+        self.dbs = yearly_databases(base_dir)
+        self.before = None
+        self.checked = set()
+
+    @property
+    def done(self) -> bool:
+        return not self.dbs
+
+    def next_page(self, limit: int = TIMELINE_PAGE) -> List[tuple]:
+        rows: List[tuple] = []
+        while self.dbs and len(rows) < limit:
+            db_path = self.dbs[0]
+            if db_path not in self.checked:
+                self.checked.add(db_path)
+                if not has_name_key(db_path):
+                    self.dbs.pop(0)
+                    self.before = None
+                    continue
+            want = limit - len(rows)
+            page = timeline_page(db_path, self.name, before=self.before, limit=want)
+            rows.extend(page)
+            if len(page) < want:              # この年は読み切った → 前の年へ
+                self.dbs.pop(0)
+                self.before = None
+            else:
+                self.before = page[-1][:2]
+        return rows
+
+
+def timeline_ui(base_dir: Path, db_path: str | Path):
+    """
+    入所者を選ぶと記事を新しい順に表示するウィンドウ。
+    最初は 1 ページ分だけ読み、下までスクロールしたら続きを読む。
+    """
+    from tkinter import ttk
+
+    win = tk.Toplevel()
+    win.title("記録の振り返り")
+
+    try:
+        conn = connect_db(db_path, readonly=True)
+    except FileNotFoundError:                    # その年の DB がまだ無い
+        names = []
+    else:
+        names = [r[0] for r in conn.execute(
+            "SELECT name FROM residents ORDER BY room = '退所', room, name"
+        )]
+        conn.close()
+
+    tk.Label(win, text="入所者").grid(row=0, column=0, sticky="e")
+    name_box = ttk.Combobox(win, values=names, width=20)
+    name_box.grid(row=0, column=1, sticky="w", pady=5)
+
+    cols = (("date", "日付", 90), ("shift", "勤務", 50), ("author", "記録者", 80),
+            ("content", "内容", 420))
+    tree = ttk.Treeview(win, columns=[c[0] for c in cols], show="headings", height=20)
+    for key, label, width in cols:
+        tree.heading(key, text=label)
+        tree.column(key, width=width, stretch=(key == "content"))
+    bar = ttk.Scrollbar(win, orient="vertical", command=tree.yview)
+    tree.grid(row=1, column=0, columnspan=2, sticky="nsew")
+    bar.grid(row=1, column=2, sticky="ns")
+
+    detail = tk.Text(win, width=80, height=6, wrap="char")
+    detail.grid(row=2, column=0, columnspan=3, pady=5)
+    status = tk.Label(win, text="")
+    status.grid(row=3, column=0, columnspan=3, sticky="w")
+
+    state = {"timeline": None, "loading": False}
+    contents: Dict[str, str] = {}
+
+    def load_more():
+        timeline = state["timeline"]
+        if timeline is None or timeline.done or state["loading"]:
+            return
+        state["loading"] = True
+        for date, _, shift, author, content in timeline.next_page():
+            iid = tree.insert("", tk.END, values=(date, shift, author or "",
+                                                  (content or "").replace("\n", " / ")))
+            contents[iid] = content or ""
+        status.config(text=f"{len(contents)} 件" + ("" if timeline.done else "（続きあり）"))
+        state["loading"] = False
+
+    def on_scroll(first, last):
+        bar.set(first, last)
+        # 下端近くまで来たら（1 ページが画面に収まるときも）続きを読む
+        if float(last) >= TIMELINE_PRELOAD:
+            win.after_idle(load_more)
+
+    def show(event=None):
+        name = name_box.get().strip()
+        if not name:
+            return
+        tree.delete(*tree.get_children())
+        contents.clear()
+        detail.delete("1.0", tk.END)
+        state["timeline"] = ResidentTimeline(base_dir, name)
+        load_more()
+        if not contents:
+            status.config(text=f"{name} さんの記事はありません。")
+
+    def select(event=None):
+        picked = tree.selection()
+        if picked:
+            detail.delete("1.0", tk.END)
+            detail.insert(tk.END, contents.get(picked[0], ""))
+
+    tree.configure(yscrollcommand=on_scroll)
+    tree.bind("<<TreeviewSelect>>", select)
+    name_box.bind("<<ComboboxSelected>>", show)
+    name_box.bind("<Return>", show)
+    tk.Button(win, text="表示", command=show).grid(row=0, column=1, padx=(180, 0), sticky="w")
+
+
+# ------------------------------------------------------------------
+# Part M : 申し送り表（DB から 1 回の問い合わせで作る。日誌・個人ファイルは開かない）
+# ------------------------------------------------------------------
+
+HANDOVER_DIR = "申し送り"
+HANDOVER_HOURS = (24, 48, 72)
+HANDOVER_ROWS_PER_PAGE = 45          # 横向き A4 で見出しを除いた行数
+HANDOVER_COLUMNS = (("居室", 7), ("氏名", 16), ("日付", 11), ("勤務", 6),
+                    ("内容", 70), ("記録者", 12))
+
+
+def handover_rows(conn: sqlite3.Connection, date_from: dt.date, date_to: dt.date,
+                  floor: str | None = None) -> List[tuple]:
+    """
+    期間内の記事を居室（ROOM_SEQ の順、それ以外の居室は後ろ）→ 氏名 → 日付 → 日勤/夜勤 の順で返す。
+    diary_entries の日付範囲は idx_entries_date_cover、居室は idx_residents_name_key で引く。
+    戻り値: [(room, resident_name, date, shift, author, content), ...]
+    """
+    seq = ",".join("(?, ?)" for _ in ROOM_SEQ)
+    params: list = [v for i, room in enumerate(ROOM_SEQ) for v in (room, i)]
+    params += [date_from.strftime("%Y-%m-%d"), date_to.strftime("%Y-%m-%d")]
+    where = f"AND {FLOOR_SQL[floor]}" if floor else ""
+    return conn.execute(f'''
+        WITH seq(room, pos) AS (VALUES {seq})
+        SELECT r.room, e.resident_name, e.date, e.shift, e.author, e.content
+        FROM diary_entries_text e
+        LEFT JOIN residents r
+          ON r.id = (SELECT MAX(id) FROM residents WHERE name_key = e.name_key)
+        LEFT JOIN seq ON seq.room = r.room
+        WHERE e.date BETWEEN ? AND ? {where}
+        ORDER BY COALESCE(seq.pos, {len(ROOM_SEQ)}), r.room, e.resident_name, e.date,
+                 CASE e.shift WHEN '日勤' THEN 0 ELSE 1 END, e.id
+    ''', params).fetchall()
+
+
+def write_handover_report(base_dir: Path, *, hours: int = 24, floor: str | None = None,
+                          now: dt.datetime | None = None) -> Path:
+    """
+    直近 hours 時間分の申し送り表を 申し送り/申し送り_{階}_{日時}.xlsx に書き出す。
+    記事は日付単位なので、(now - hours) の日から now の日までを対象にする。
+    年をまたぐときだけ前年の DB も引く（通常は diary_{年}.db への問い合わせ 1 回）。
+    DB は読み取り専用で開く（スキーマの移行は起動時に済ませてある）。
+    ブックは書き込み専用モードで 1 回だけ書く（行を溜めずに流し込む）。
+    戻り値: 作成したファイルのパス
+    """
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, Side
+    from openpyxl.utils import get_column_letter
+
+    now = now or dt.datetime.now()
+    date_from = (now - dt.timedelta(hours=hours)).date()
+    date_to = now.date()
+    rows = []
+    for year in range(date_from.year, date_to.year + 1):
+        try:
+            conn = connect_db(base_dir / f"diary_{year}.db", readonly=True)
+        except FileNotFoundError:                # その年の DB がまだ無い
+            continue
+        try:
+            rows += handover_rows(conn, date_from, date_to, floor)
+        finally:
+            conn.close()
+    if date_from.year != date_to.year:
+        # 年ごとの結果をつなげたので、居室順に並べ直す（sort は安定なので年内の順序は保たれる）
+        pos = {room: i for i, room in enumerate(ROOM_SEQ)}
+        rows.sort(key=lambda r: (pos.get(r[0], len(ROOM_SEQ)), r[0] or "", r[1]))
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("申し送り")
+    for i, (_, width) in enumerate(HANDOVER_COLUMNS, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+    ws.page_setup.orientation = "landscape"
+    ws.page_setup.paperSize = 9                 # A4
+    ws.print_title_rows = "1:2"
+
+    bold = Font(bold=True)
+    top = Border(top=Side(style="thin"))
+    wrap = Alignment(wrap_text=True, vertical="top")
+
+    def cells(values, *, font=None, border=None):
+        out = []
+        for v in values:
+            c = WriteOnlyCell(ws, value=v)
+            if font:
+                c.font = font
+            if border:
+                c.border = border
+            c.alignment = wrap
+            out.append(c)
+        return out
+
+    title = (f"申し送り　{floor or '全体'}　{date_from:%Y/%m/%d}〜{date_to:%Y/%m/%d}"
+             f"（{now:%Y/%m/%d %H:%M} 作成・{len(rows)} 件）")
+    ws.append(cells([title], font=bold))
+    ws.append(cells([c for c, _ in HANDOVER_COLUMNS], font=bold))
+    last_row = 2
+
+    prev = None
+    for room, name, date, shift, author, content in rows:
+        first = (room, name) != prev
+        prev = (room, name)
+        lines = [ln for ln in (content or "").split("\n") if ln] or [""]
+        for i, line in enumerate(lines):
+            head = i == 0
+            ws.append(cells([
+                room if first and head else None,
+                name if first and head else None,
+                date[5:].replace("-", "/") if head else None,
+                shift if head else None,
+                line,
+                author if i == len(lines) - 1 else None,
+            ], border=top if first and head else None))
+            last_row += 1
+
+    setup_page_breaks(ws, HANDOVER_ROWS_PER_PAGE, last_row=last_row)
+
+    out_dir = base_dir / HANDOVER_DIR
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path = out_dir / f"申し送り_{floor or '全体'}_{now:%Y%m%d_%H%M}.xlsx"
+    save_workbook_atomic(wb, path)
+    return path
+
+
+def handover_ui(base_dir: Path):
+    """
+    階と時間幅を選んで申し送り表を作り、Excel で開くウィンドウ。
+    """
+    win = tk.Toplevel()
+    win.title("申し送り作成")
+
+    floor_var = tk.StringVar(value="2階")
+    tk.Label(win, text="階").grid(row=0, column=0)
+    for i, floor in enumerate(("2階", "3階", "全体")):
+        tk.Radiobutton(win, text=floor, variable=floor_var, value=floor)\
+            .grid(row=0, column=i + 1)
+
+    hours_var = tk.IntVar(value=HANDOVER_HOURS[0])
+    tk.Label(win, text="期間").grid(row=1, column=0)
+    for i, hours in enumerate(HANDOVER_HOURS):
+        tk.Radiobutton(win, text=f"{hours}時間", variable=hours_var, value=hours)\
+            .grid(row=1, column=i + 1)
+
+    def make():
+        floor = floor_var.get()
+        path = write_handover_report(base_dir, hours=hours_var.get(),
+                                     floor=None if floor == "全体" else floor)
+        win.destroy()
+        os.startfile(path)
+
+    tk.Button(win, text="作成", command=make).grid(row=2, column=0, columnspan=4, pady=10)
+
+
+# ------------------------------------------------------------------
+# Part N : 個人ファイル用の最小テンプレート（personal シートだけ）と既存ファイルの軽量化
+# ------------------------------------------------------------------
+
+PERSONAL_SKELETON_DIR = f"{PERSONAL_DIR}/テンプレート"
+# 日誌用のシート。個人ファイルでは使わない
+DIARY_ONLY_SHEETS = ("Header_Night", "Footer", "B_temp", "F_temp")
+
+
+def _copy_slim(src_wb, titles: List[str]):
+    """
+    titles のシートだけを新しいブックへ複製する。
+    使っている書式だけが新しいブックに登録されるので、不要なスタイルが落ちる。
+    表示/非表示はそのまま。表示シートが 1 枚も無ければ空の Sheet1 を置く
+    （最初の入所者シートを作るときに remove_sheet1 が消す）。
+    """
+    dst_wb = openpyxl.Workbook()
+    dst_wb.remove(dst_wb.active)
+    for title in titles:
+        src_ws = src_wb[title]
+        copy_sheet_to_workbook(src_ws, dst_wb, title).sheet_state = src_ws.sheet_state
+
+    if not any(ws.sheet_state == "visible" for ws in dst_wb.worksheets):
+        dst_wb.create_sheet("Sheet1")
+    dst_wb.active = next(i for i, ws in enumerate(dst_wb.worksheets)
+                         if ws.sheet_state == "visible")
+
+    # 残したシートだけを参照する名前定義を引き継ぐ
+    for name, dn in src_wb.defined_names.items():
+        sheets = [sheet for sheet, _ in dn.destinations]
+        if "#REF!" not in str(dn.value) and sheets and all(s in titles for s in sheets):
+            dst_wb.defined_names[name] = copy(dn)
+    return dst_wb
+
+
+def personal_skeleton(template_src: Path, base_dir: Path) -> Path:
+    """
+    template_src の personal シートだけを持つ個人ファイルの雛形を返す。
+    雛形は 個人ファイル/テンプレート/personal_{テンプレートのハッシュ}.xlsx に保存して使い回し、
+    テンプレートが変わればハッシュが変わるので作り直す（古い雛形は消す）。
+    テンプレートに personal シートが無ければ template_src をそのまま返す。
+    """
+    digest = hashlib.sha1(Path(template_src).read_bytes()).hexdigest()[:12]
+    cache_dir = base_dir / PERSONAL_SKELETON_DIR
+    path = cache_dir / f"personal_{digest}.xlsx"
+    if path.exists():
+        return path
+
+    src_wb = openpyxl.load_workbook(template_src)
+    if PERSONAL_TEMPLATE_SHEET not in src_wb.sheetnames:
+        src_wb.close()
+        return Path(template_src)
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with FileLock(path):
+        if not path.exists():                 # 他の端末が先に作っていれば使う
+            save_workbook_atomic(_copy_slim(src_wb, [PERSONAL_TEMPLATE_SHEET]), path)
+            for old in cache_dir.glob("personal_*.xlsx"):
+                if old != path:
+                    old.unlink(missing_ok=True)
+    src_wb.close()
+    return path
+
+
+def slim_personal_file(path: Path) -> tuple[int, int]:
+    """
+    既存の個人ファイルから日誌用のシート・それを参照する名前定義・使っていない書式を取り除く。
+    入所者シートと personal シートは名前・並び順・表示状態を変えずに残す。
+    戻り値: (処理前のバイト数, 処理後のバイト数)
+    """
+    with FileLock(path):
+        before = os.path.getsize(path)
+        src_wb = openpyxl.load_workbook(path)
+        keep = [t for t in src_wb.sheetnames if t not in DIARY_ONLY_SHEETS]
+        others = [t for t in keep if t != "Sheet1"]
+        if any(src_wb[t].sheet_state == "visible" for t in others):
+            keep = others                     # 入所者シートがあれば Sheet1 は不要
+        save_workbook_atomic(_copy_slim(src_wb, keep), path)
+        src_wb.close()
+        return before, os.path.getsize(path)
+
+
+# ------------------------------------------------------------------
+# Part O : パイプライン転記（DB 書き込みは専用スレッド、Excel の保存は並行）
+# ------------------------------------------------------------------
+
+class DBWriter:
+    """
+    DB への書き込みを専用スレッドの 1 本の接続に集める。
+    submit した関数は fn(conn, *args) の形で、受け付けた順に 1 つずつ実行される。
+    コミットは 2 段階だけ:
+      1. write_transfer_journal（先行書き込み）。個人ファイルに触る前にジャーナルを
+         確定させる必要があるので、それまでに積んだ日誌行・シート目録もここで確定する。
+      2. close()（最終バリア）。ポインタ・台帳・完了印・run の完了・指紋をまとめて確定する。
+    "database is locked" などで失敗したら、最後のコミット以降の仕事を rollback して
+    最初から実行し直す（retry_on_locked の再試行は使わない。あちらの rollback は
+    先に積んだ書き込みまで捨ててしまうため）。積む関数はやり直しても結果が同じになること。
+    1 つでも失敗したら以降の仕事は実行せず、close() でロールバックして例外を出す。
+    """
+
+    def __init__(self, db_path: str | Path):
+        self.db_path = db_path
+        self.jobs: queue.Queue = queue.Queue()
+        self.error: BaseException | None = None
+        self.thread = threading.Thread(target=self._run, name="DBWriter", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        conn = connect_db(self.db_path)
+        done: List[tuple] = []          # 最後のコミット以降に実行した仕事（やり直し用）
+        try:
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    break
+                fn, args, future = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if self.error is not None:
+                    future.set_exception(self.error)
+                    continue
+                try:
+                    future.set_result(self._execute(conn, done, fn, args))
+                except BaseException as e:
+                    conn.rollback()
+                    self.error = e
+                    future.set_exception(e)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _execute(conn: sqlite3.Connection, done: List[tuple], fn, args):
+        """
+        仕事を 1 つ実行する。ロックで失敗したら rollback し、done の仕事から実行し直す。
+        """
+        fn = getattr(fn, "__wrapped__", fn)
+        replay: List[tuple] = []
+        for attempt in range(DB_RETRIES):
+            try:
+                for prev_fn, prev_args in replay:
+                    prev_fn(conn, *prev_args)
+                result = fn(conn, *args)
+                break
+            except sqlite3.OperationalError as e:
+                if not is_locked_error(e) or attempt == DB_RETRIES - 1:
+                    raise
+                conn.rollback()
+                time.sleep(0.2 * 2 ** attempt)
+                replay = list(done)
+        if conn.in_transaction:
+            done.append((fn, args))
+        else:                           # 仕事の中でコミットした（やり直す範囲はここから）
+            done.clear()
+        return result
+
+    def submit(self, fn, *args) -> Future:
+        future: Future = Future()
+        self.jobs.put((fn, args, future))
+        return future
+
+    def close(self, *, commit: bool = True) -> None:
+        """
+        積まれた仕事をすべて終えてから、commit=True ならまとめてコミットする（最終バリア）。
+        このコミットがロックで失敗したときも、最後のコミット以降の仕事からやり直す。
+        """
+        last = self.submit(lambda conn: conn.commit() if commit else conn.rollback())
+        self.jobs.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        last.result()
+
+
+def finish_diary_book(wb, sheets, path: Path, *, night_tpl=None,
+                      footer_sheet: str | None = None) -> Dict:
+    """
+    月次日誌側のステージ: 夜勤ヘッダー・改ページ・（あれば）Footer を貼って 1 回で保存する。
+    個人ファイルの転記と並行して動かす。戻り値: save_workbook_measured の記録
+    """
+    for sheet in sheets:
+        update_diary_sheet(sheet, template_sheet=night_tpl)
+    if footer_sheet:
+        paste_footer(wb, footer_sheet)
+    return save_workbook_measured(wb, path)
+
+
+# ------------------------------------------------------------------
+# Part P : 転記の事前計画（ブックを開かずにポインタ DB とシート目録から配置を決める）
+# ------------------------------------------------------------------
+
+class StalePlan(Exception):
+    """計画を作った後に個人ファイル・ポインタ・台帳が変わり、その計画のままでは反映できない"""
+
+
+def file_stamp(path: Path) -> tuple[int, int]:
+    """
+    ファイルの更新時刻（ナノ秒）と大きさ。シート目録が古くなっていないかの判定に使う。
+    """
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def catalog_workbook(wb) -> List[tuple]:
+    """
+    ブックの全シートの (シート名, 入所者, 令和年, 次に書く行) を返す。
+    令和年は personal_sheet_wareki、次に書く行は first_free_row と同じ規則
+    （4 行目以降で A〜D 列が空の最初の行）。read_only で開いたブックにも使える。
+    """
+    rows = []
+    for ws in wb.worksheets:
+        max_row = ws.max_row or 1
+        next_row = max_row + 1
+        for r, values in enumerate(ws.iter_rows(min_row=4, max_row=max_row, max_col=4,
+                                                values_only=True), start=4):
+            if all(v in (None, "") for v in values):
+                next_row = r
+                break
+        resident = None if ws.title in NON_PERSONAL_SHEETS else resident_of_sheet(ws.title)
+        rows.append((ws.title, resident, personal_sheet_wareki(ws, None), next_row))
+    return rows
+
+
+def store_sheet_catalog(conn: sqlite3.Connection, file: str, stamp, rows: List[tuple]) -> None:
+    """
+    個人ファイル 1 つ分のシート目録を置き換える（コミットは呼び出し側）。
+    """
+    conn.execute("DELETE FROM sheet_catalog WHERE file = ?", (file,))
+    conn.executemany(
+        """INSERT INTO sheet_catalog (file, sheet, resident, wareki, next_row)
+           VALUES (?, ?, ?, ?, ?)""",
+        [(file, *row) for row in rows],
+    )
+    conn.execute(
+        """INSERT INTO sheet_catalog_files (file, mtime_ns, size, scanned_at)
+           VALUES (?, ?, ?, ?)
+           ON CONFLICT(file) DO UPDATE SET mtime_ns=excluded.mtime_ns, size=excluded.size,
+                                           scanned_at=excluded.scanned_at""",
+        (file, stamp[0], stamp[1], dt.datetime.now().isoformat(timespec="seconds")),
+    )
+
+
+def read_sheet_catalog(conn: sqlite3.Connection, base_dir: Path, file: str,
+                       template_src: Path, scanned: Dict[str, tuple]) -> tuple:
+    """
+    個人ファイル 1 つ分のシート目録を返す。
+    目録の stamp がファイルと違うとき（まだ目録に無い・転記以外の操作で書き換わった）だけ
+    read_only で開いて読み直し、scanned（{目録のキー: (stamp, 目録)}）に足す。
+    まだ無いファイルは複製元の雛形（personal_skeleton）の目録を使う。
+    戻り値: (stamp, 目録)  stamp はファイルが無ければ None
+    """
+    path, key = base_dir / file, file
+    if not path.exists():
+        path = personal_skeleton(template_src, base_dir)
+        key = path.relative_to(base_dir).as_posix()
+    stamp = file_stamp(path)
+    if key in scanned and scanned[key][0] == stamp:
+        return (stamp if key == file else None), scanned[key][1]
+    known = conn.execute(
+        "SELECT mtime_ns, size FROM sheet_catalog_files WHERE file = ?", (key,)
+    ).fetchone()
+    if known == stamp:
+        rows = conn.execute(
+            "SELECT sheet, resident, wareki, next_row FROM sheet_catalog WHERE file = ?",
+            (key,),
+        ).fetchall()
+    else:
+        wb = openpyxl.load_workbook(path, read_only=True)
+        try:
+            rows = catalog_workbook(wb)
+        finally:
+            wb.close()
+        scanned[key] = (stamp, rows)
+    return (stamp if key == file else None), rows
+
+
+class CatalogView:
+    """
+    転記の配置計画用に、シート目録から個人ファイルのシート名・空き行・令和年を引く窓口。
+    計画中に作成予定となったシートも sheetnames に追加していく（目録自体は変えない）。
+    archived: アーカイブへ移したシート名。続きシートの番号を使い回さないように避ける。
+    """
+
+    def __init__(self, rows, archived=()):
+        self.rows = {sheet: (wareki, next_row) for sheet, _, wareki, next_row in rows}
+        self.sheetnames = list(self.rows)
+        self.archived = set(archived)
+
+    def first_free_row(self, sheet_name: str) -> int:
+        return self.rows[sheet_name][1]
+
+    def wareki(self, sheet_name: str, default: int) -> int:
+        # これから作るシートは作成時に default（転記日の令和年）を書くので区切りは要らない
+        wareki = self.rows[sheet_name][0] if sheet_name in self.rows else None
+        return default if wareki is None else wareki
+
+
+def transfer_targets(conn: sqlite3.Connection, entries: List[Dict], date: dt.date,
+                     layout: str) -> List[str]:
+    """
+    エントリごとの書き込み先の個人ファイル。room が無ければ residents から引く。
+    """
+    rooms = load_rooms(conn)
+    return [
+        personal_file_for(ent.get("room") or rooms.get(normalize_key(ent["name"])), ent["name"],
+                          date.year, layout)
+        for ent in entries
+    ]
+
+
+def plan_transfer(batches, db_path: str | Path, base_dir: Path, template_src: Path, *,
+                  layout: str | None = None) -> Dict:
+    """
+    転記の配置を、個人ファイルを開かずに計画する（ドライラン）。
+    batches: [(日付, entries)]  複数日分を渡すと、前の日の計画で進んだ位置から続けて計画する。
+    ポインタは personal_pointer、シートの有無・空き行・令和年はシート目録から引き、
+    配置の規則は plan_entry（ROW_LIMIT での続きシート、令和年の切り替え）をそのまま使う。
+    DB には書かない（読み直した目録は "scanned" に入れて返す。store_plan_catalog 参照）。
+    戻り値: {"date", "layout", "template", "plans", "pointers", "stamps", "scanned"}
+      pointers / stamps は計画の前提。apply_transfer_plan が反映の前に照合する。
+    """
+    init_personal_tables(db_path)
+    layout = layout or load_prefs().get("personal_layout", "floor")
+    conn = connect_db(db_path)
+    try:
+        # 転記台帳・未完了ジャーナルにあるエントリは計画しない
+        todo, seen = [], set()
+        for date, entries in batches:
+            fresh = [e for e in filter_untransferred(conn, entries, date)
+                     if entry_key(date, e) not in seen]
+            seen.update(entry_key(date, e) for e in fresh)
+            targets = transfer_targets(conn, fresh, date, layout)
+            todo.extend((date, ent, pf) for ent, pf in zip(fresh, targets))
+
+        names = list(dict.fromkeys(ent["name"] for _, ent, _ in todo))
+        pointers = load_pointers(conn, names)
+        before = {name: list(pointers[name]) if name in pointers else None for name in names}
+
+        views, stamps, scanned = {}, {}, {}
+        for pf in dict.fromkeys(pf for _, _, pf in todo):
+            stamp, rows = read_sheet_catalog(conn, base_dir, pf, template_src, scanned)
+            views[pf] = CatalogView(rows, archived_sheets(conn, pf))
+            stamps[pf] = list(stamp) if stamp else None
+
+        plans = []
+        for date, ent, pf in todo:
+            plan = plan_entry(ent, date, pf, pointers.get(ent["name"]), views[pf])
+            pointers[ent["name"]] = (pf, plan["sheet"], plan["next_row"])
+            plans.append(plan)
+    finally:
+        conn.close()
+
+    first = batches[0][0] if batches else dt.date.today()
+    return {
+        "date": first.strftime("%Y-%m-%d"),
+        "layout": layout,
+        "template": str(template_src),
+        "plans": plans,
+        "pointers": before,
+        "stamps": stamps,
+        "scanned": [(key, stamp, rows) for key, (stamp, rows) in scanned.items()],
+    }
+
+
+def store_plan_catalog(conn: sqlite3.Connection, plan: Dict) -> None:
+    """
+    plan_transfer で読み直したシート目録を保存する（コミットは呼び出し側）。
+    次の計画ではそのファイルを開かずに済む。
+    """
+    for key, stamp, rows in plan.get("scanned", ()):
+        store_sheet_catalog(conn, key, stamp, rows)
+
+
+def check_plan(conn: sqlite3.Connection, plan: Dict, base_dir: Path) -> None:
+    """
+    計画の前提（個人ファイルの stamp・ポインタ・転記台帳）が今も同じか確かめる。
+    変わっていれば StalePlan を出す（計画をやり直す）。
+    """
+    for pf, stamp in plan["stamps"].items():
+        path = base_dir / pf
+        now = list(file_stamp(path)) if path.exists() else None
+        if now != stamp:
+            raise StalePlan(f"{pf} は計画の後に変更されています。")
+
+    current = load_pointers(conn, plan["pointers"])
+    for name, ptr in plan["pointers"].items():
+        if (list(current[name]) if name in current else None) != ptr:
+            raise StalePlan(f"{name} の書き込み位置は計画の後に変わっています。")
+
+    keys = {p["key"] for p in plan["plans"]}
+    done = set()
+    for date_str in {p["date"] for p in plan["plans"]}:
+        done.update(r[0] for r in conn.execute(
+            "SELECT entry_key FROM transfer_ledger WHERE date = ?", (date_str,)
+        ))
+    for (journal_plan,) in conn.execute(
+        "SELECT plan FROM transfer_journal WHERE state = 'planned'"
+    ):
+        done.add(json.loads(journal_plan).get("key"))
+    if keys & done:
+        raise StalePlan("計画にある記事の一部は、既に転記済みか転記中です。")
+
+
+def apply_transfer_plan(plan: Dict, db_path: str | Path, base_dir: Path, *,
+                        footer: tuple[str, str] | None = None,
+                        writer: "DBWriter | None" = None, diary_stage=None) -> int:
+    """
+    plan_transfer の計画をそのまま反映する。
+    対象の個人ファイルをロックして前提を照合し（check_plan）、計画全体を 1 回でジャーナルに
+    書いてから run_transfer_journal で反映する。footer / writer / diary_stage は
+    transfer_to_personal_files と同じ。
+    戻り値: ジャーナルの run_id
+    """
+    date = dt.date.fromisoformat(plan["date"])
+    template_src = Path(plan["template"])
+    with lock_files(base_dir / pf for pf in plan["stamps"]):
+        conn = connect_db(db_path)
+        try:
+            check_plan(conn, plan, base_dir)
+        except StalePlan:
+            conn.close()
+            raise
+        if writer is None:
+            store_plan_catalog(conn, plan)
+            run_id = write_transfer_journal(conn, date, plan["plans"], template_src, footer)
+            conn.close()
+        else:
+            conn.close()
+            writer.submit(store_plan_catalog, plan)
+            # 先に積んだ日誌 DB への書き込みもここで一緒に確定する
+            run_id = writer.submit(write_transfer_journal, date, plan["plans"], template_src,
+                                   footer).result()
+
+        run_transfer_journal(db_path, run_id, base_dir, writer=writer, diary_stage=diary_stage)
+    return run_id
+
+
+def format_transfer_plan(plan: Dict) -> str:
+    """
+    計画を個人ファイルごとの一覧にする（新しく作るシート・令和年の切り替えに印を付ける）。
+    """
+    by_file: Dict[str, List[Dict]] = {}
+    for p in plan["plans"]:
+        by_file.setdefault(p["file"], []).append(p)
+
+    lines, new_sheets = [], 0
+    for pf, plans in by_file.items():
+        lines.append(pf + ("（新規作成）" if plan["stamps"].get(pf) is None else ""))
+        for p in plans:
+            marks = []
+            created = [op[1] for op in p["ops"] if op[0] == "sheet"]
+            if created:
+                new_sheets += len(created)
+                marks.append("新シート " + "・".join(created))
+            if any(op[0] == "cell" and str(op[4]).startswith("ここから令和") for op in p["ops"]):
+                marks.append("令和年の切り替え")
+            end_row = max(p["next_row"] - 1, p["start_row"])
+            rows = (f"{p['start_row']}行" if end_row == p["start_row"]
+                    else f"{p['start_row']}〜{end_row}行")
+            lines.append(f"  {p['date']} {p['shift']} {p['name']} → {p['sheet']} {rows}"
+                         + (f"  [{' / '.join(marks)}]" if marks else ""))
+    lines.append(f"{len(plan['plans'])} 件 / {len(by_file)} ファイル / 新シート {new_sheets} 枚")
+    return "\n".join(lines)
+
+
+# ------------------------------------------------------------------
+# Part Q : 差分バックアップ（xlsx の zip パーツと DB の塊を内容アドレスで保存）
+# ------------------------------------------------------------------
+
+BACKUP_DIR = "バックアップ"            # 保存先（prefs.json の backup_dir で別ドライブにできる）
+RESTORE_DIR = "復元"                   # restore の既定の書き出し先
+RESTORE_WORKERS = 4                    # 復元でファイルを同時に書き出す数
+BACKUP_CHUNK = 64 * 1024               # DB・その他のファイルを分ける大きさ（DB のページの倍数）
+BACKUP_KEEP = 30                       # 残すスナップショットの数
+BACKUP_SUFFIXES = (".xlsx", ".db", ".json")
+
+
+class BackupStore:
+    """
+    バックアップの保存先。
+      objects/ab/cdef…  : 中身の SHA-256 を名前にした zlib 圧縮の塊（同じ中身は 1 つだけ）
+      snapshots/ID.json : スナップショットごとの目録（ファイル → 塊のハッシュの並び）
+    塊も目録も一時ファイルに書いてから rename するので、途中で落ちても壊れた塊は残らない。
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.objects = self.root / "objects"
+        self.snapshot_dir = self.root / "snapshots"
+
+    def object_path(self, digest: str) -> Path:
+        return self.objects / digest[:2] / digest[2:]
+
+    def put(self, data: bytes) -> tuple[str, int]:
+        """
+        塊を保存する。戻り値: (ハッシュ, 新しく書いたバイト数)  既にあれば 0
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if path.exists():
+            return digest, 0
+        packed = zlib.compress(data, 6)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix="~obj.", dir=path.parent)
+        with os.fdopen(fd, "wb") as f:
+            f.write(packed)
+        os.replace(tmp, path)
+        return digest, len(packed)
+
+    def get(self, digest: str) -> bytes:
+        data = zlib.decompress(self.object_path(digest).read_bytes())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"バックアップの塊 {digest[:12]} が壊れています。")
+        return data
+
+    def snapshots(self) -> List[str]:
+        if not self.snapshot_dir.exists():
+            return []
+        return sorted(p.stem for p in self.snapshot_dir.glob("*.json"))
+
+    def load_manifest(self, snapshot_id: str) -> Dict:
+        with open(self.snapshot_dir / f"{snapshot_id}.json", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_manifest(self, manifest: Dict) -> None:
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        path = self.snapshot_dir / f"{manifest['id']}.json"
+        fd, tmp = tempfile.mkstemp(prefix="~snap.", dir=self.snapshot_dir)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+
+def backup_root(base_dir: Path) -> Path:
+    """
+    バックアップの保存先。prefs.json の backup_dir が空なら base_dir/バックアップ。
+    """
+    configured = load_prefs().get("backup_dir")
+    return Path(configured) if configured else base_dir / BACKUP_DIR
+
+
+def backup_targets(base_dir: Path, root: Path) -> List[Path]:
+    """
+    バックアップするファイル（日誌・個人ファイル・名簿・DB・設定）。
+    保存先・復元先・一時ファイル・ロックの順番札は除く。
+    """
+    skip = [root.resolve(), (base_dir / RESTORE_DIR).resolve()]
+    targets = []
+    for path in base_dir.rglob("*"):
+        if (path.suffix not in BACKUP_SUFFIXES or not path.is_file()
+                or path.name.startswith("~")
+                or any(p.name.endswith(".lock.queue") for p in path.parents)):
+            continue
+        resolved = path.resolve()
+        if any(resolved.is_relative_to(s) for s in skip):
+            continue
+        targets.append(path)
+    return sorted(targets)
+
+
+def _backup_chunks(store: BackupStore, f) -> tuple[List[str], int]:
+    """
+    ストリームを BACKUP_CHUNK ごとの塊にして保存する。戻り値: (ハッシュの並び, 書いたバイト数)
+    """
+    digests, written = [], 0
+    while True:
+        data = f.read(BACKUP_CHUNK)
+        if not data:
+            break
+        digest, n = store.put(data)
+        digests.append(digest)
+        written += n
+    return digests, written
+
+
+def _backup_xlsx(store: BackupStore, path: Path) -> tuple[Dict, int]:
+    """
+    xlsx を zip のパーツ（シート XML・styles・sharedStrings など）ごとに保存する。
+    変わっていないシートのパーツは前回の塊がそのまま使われる。
+    """
+    parts, written = [], 0
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            digest, n = store.put(zf.read(info))
+            parts.append([info.filename, digest, list(info.date_time), info.compress_type])
+            written += n
+    return {"kind": "xlsx", "parts": parts}, written
+
+
+def _backup_sqlite(store: BackupStore, path: Path) -> tuple[Dict, int]:
+    """
+    DB を SQLite の backup API で一貫した複製にしてから塊に分けて保存する。
+    変わったページを含む塊だけが新しく書かれる。
+    """
+    fd, tmp = tempfile.mkstemp(prefix="~backup.", suffix=".db")
+    os.close(fd)
+    try:
+        src = connect_db(path)
+        dst = sqlite3.connect(tmp)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+        with open(tmp, "rb") as f:
+            chunks, written = _backup_chunks(store, f)
+    finally:
+        os.remove(tmp)
+    return {"kind": "chunks", "chunks": chunks}, written
+
+
+def backup_snapshot(base_dir: Path) -> Dict:
+    """
+    base_dir のスナップショットを取る。
+    前回の目録と更新時刻・大きさが同じファイルは読まずに前回の分を使い、
+    変わったファイルも新しい塊（変わったパーツ・ページ）だけを書く。
+    xlsx は読む間ロックする（転記中なら待つ。待ちきれなければ前回の分を使う）。
+    戻り値: {"id", "files", "reused", "skipped", "objects_bytes"}
+    """
+    root = backup_root(base_dir)
+    store = BackupStore(root)
+    existing = store.snapshots()
+    previous = store.load_manifest(existing[-1])["files"] if existing else {}
+
+    snapshot_id = dt.datetime.now().strftime("%Y%m%d-%H%M%S")
+    while snapshot_id in existing:
+        snapshot_id += "_"
+    files: Dict[str, Dict] = {}
+    result = {"id": snapshot_id, "files": 0, "reused": 0, "skipped": [], "objects_bytes": 0}
+
+    for path in backup_targets(base_dir, root):
+        rel = path.relative_to(base_dir).as_posix()
+        old = previous.get(rel)
+        stamp = list(file_stamp(path))
+        if old and old["stamp"] == stamp:
+            files[rel] = old
+            result["reused"] += 1
+            continue
+        try:
+            if path.suffix == ".db":
+                entry, written = _backup_sqlite(store, path)
+            elif path.suffix == ".xlsx":
+                with FileLock(path):
+                    stamp = list(file_stamp(path))
+                    try:
+                        entry, written = _backup_xlsx(store, path)
+                    except zipfile.BadZipFile:
+                        with open(path, "rb") as f:
+                            chunks, written = _backup_chunks(store, f)
+                        entry = {"kind": "chunks", "chunks": chunks}
+            else:
+                with open(path, "rb") as f:
+                    chunks, written = _backup_chunks(store, f)
+                entry = {"kind": "chunks", "chunks": chunks}
+        except LockTimeout:
+            result["skipped"].append(rel)
+            if old:
+                files[rel] = old
+            continue
+        entry["stamp"] = stamp
+        files[rel] = entry
+        result["files"] += 1
+        result["objects_bytes"] += written
+
+    store.save_manifest({
+        "id": snapshot_id,
+        "created": dt.datetime.now().isoformat(timespec="seconds"),
+        "files": files,
+    })
+    return result
+
+
+def restore_snapshot(base_dir: Path, snapshot_id: str, dest: Path, *,
+                     files: List[str] | None = None) -> List[str]:
+    """
+    スナップショットを dest に書き出す（files を渡せばそのファイルだけ）。
+    xlsx はパーツから zip を組み直す。更新時刻もバックアップ時のものに戻す。
+    dest に base_dir を指定すれば上書きで戻せるが、DB は使用中でないときに限る。
+    戻り値: 書き出したファイル（base_dir からの相対パス）
+    """
+    store = BackupStore(backup_root(base_dir))
+    manifest = store.load_manifest(snapshot_id)
+    wanted = [(rel, entry) for rel, entry in manifest["files"].items()
+              if files is None or rel in files]
+
+    def restore_one(rel: str, entry: Dict) -> str:
+        out = Path(dest) / rel
+        out.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=f"~{out.stem}.", suffix=".tmp", dir=out.parent)
+        os.close(fd)
+        try:
+            if entry["kind"] == "xlsx":
+                with zipfile.ZipFile(tmp, "w") as zf:
+                    for name, digest, date_time, compress_type in entry["parts"]:
+                        info = zipfile.ZipInfo(name, tuple(date_time))
+                        info.compress_type = compress_type
+                        zf.writestr(info, store.get(digest))
+            else:
+                with open(tmp, "wb") as f:
+                    for digest in entry["chunks"]:
+                        f.write(store.get(digest))
+            os.utime(tmp, ns=(entry["stamp"][0], entry["stamp"][0]))
+            with FileLock(out) if out.suffix == ".xlsx" else contextlib.nullcontext():
+                os.replace(tmp, out)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return rel
+
+    with ThreadPoolExecutor(max_workers=RESTORE_WORKERS) as pool:
+        return list(pool.map(lambda item: restore_one(*item), wanted))
+
+
+def prune_backups(base_dir: Path, keep: int = BACKUP_KEEP) -> tuple[int, int]:
+    """
+    新しい keep 個を残して古いスナップショットを消し、どの目録からも使われない塊を消す。
+    バックアップの実行中には呼ばないこと（まだ目録に載っていない塊を消してしまう）。
+    戻り値: (消したスナップショット数, 消した塊の数)
+    """
+    store = BackupStore(backup_root(base_dir))
+    snapshots = store.snapshots()
+    old = snapshots[:-keep] if keep > 0 else snapshots
+    for snapshot_id in old:
+        (store.snapshot_dir / f"{snapshot_id}.json").unlink()
+
+    used = set()
+    for snapshot_id in store.snapshots():
+        for entry in store.load_manifest(snapshot_id)["files"].values():
+            if entry["kind"] == "xlsx":
+                used.update(part[1] for part in entry["parts"])
+            else:
+                used.update(entry["chunks"])
+
+    removed = 0
+    if store.objects.exists():
+        for path in store.objects.glob("*/*"):
+            if path.parent.name + path.name not in used:
+                path.unlink()
+                removed += 1
+    return len(old), removed
+
+
+def format_backups(base_dir: Path) -> str:
+    """
+    スナップショットの一覧（ファイル数・元の大きさ）。
+    """
+    store = BackupStore(backup_root(base_dir))
+    lines = []
+    for snapshot_id in store.snapshots():
+        manifest = store.load_manifest(snapshot_id)
+        size = sum(entry["stamp"][1] for entry in manifest["files"].values())
+        lines.append(f"{snapshot_id}\t{len(manifest['files'])} ファイル\t{size / 1e6:.1f} MB")
+    return "\n".join(lines) or "バックアップはまだありません。"
+
+
+# ------------------------------------------------------------------
+# Part R : 古い記事本文の圧縮保存（入所者・月ごとのブロックを共有辞書付き zlib で）
+# ------------------------------------------------------------------
+
+COLD_DICT_SIZE = 32 * 1024        # zlib の preset dictionary の上限
+COLD_DICT_SAMPLES = 5000          # 辞書を作るのに使う直近の記事数
+COLD_CACHE_BLOCKS = 64            # 接続ごとに展開済みのまま覚えておくブロック数
+COLD_COMMIT_BLOCKS = 200          # この数のブロックごとにコミットする（他の端末を長く待たせない）
+_FRAGMENT_RE = re.compile(r"[、。，．,.!?！？\s（）()・「」]+")
+
+
+def content_digest(text) -> str | None:
+    """
+    本文の SHA-1 の先頭 16 桁（diary_entries.content_hash）。本文が圧縮済みでも重複判定はこの値で行う。
+    一意索引は 入所者・日付・勤務 と組なので、この長さで衝突は実質起きない（索引も小さく済む）。
+    """
+    if text is None:
+        return None
+    return hashlib.sha1(str(text).encode("utf-8")).hexdigest()[:16]
+
+
+def init_cold_storage(conn: sqlite3.Connection) -> None:
+    """
+    圧縮ブロック・辞書のテーブルと、本文を透過的に読むビュー diary_entries_text を作る
+    （コミットは呼び出し側）。
+    重複防止の一意索引は (name_key, 日付, 勤務, content_hash)。氏名は照合キーで比べ
+    （空白・敬称だけ違う同じ記事は 1 行）、本文は content_hash で比べる（本文が NULL に
+    なった圧縮済みの行でも効くように。本文を索引に持たない分 DB も小さくなる）。
+    索引を作る前に、既にある重複は id の小さい 1 行を残して消す。
+    name_key 列は create_database_if_not_exists が先に足して埋めておくこと。
+    ビューは connect_db が登録する SQL 関数 cold_text() を使うので、この DB は connect_db で開くこと。
+    """
+    add_column_if_missing(conn, "diary_entries", "block_id", "INTEGER")
+    add_column_if_missing(conn, "diary_entries", "block_pos", "INTEGER")
+    add_column_if_missing(conn, "diary_entries", "block_len", "INTEGER")
+    if add_column_if_missing(conn, "diary_entries", "content_hash", "TEXT"):
+        conn.execute("UPDATE diary_entries SET content_hash = content_digest(content)")
+    if not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'uniq_entry_key'"
+    ).fetchone():
+        conn.execute('''
+            DELETE FROM diary_entries
+            WHERE name_key IS NOT NULL AND content_hash IS NOT NULL
+              AND id NOT IN (SELECT MIN(id) FROM diary_entries
+                             WHERE name_key IS NOT NULL AND content_hash IS NOT NULL
+                             GROUP BY name_key, date, shift, content_hash)
+        ''')
+        conn.execute('''
+            CREATE UNIQUE INDEX uniq_entry_key
+            ON diary_entries(name_key, date, shift, content_hash)
+        ''')
+    conn.execute("DROP INDEX IF EXISTS uniq_entry_hash")
+    conn.execute("DROP INDEX IF EXISTS uniq_entry")
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS content_dicts (
+            dict_id     INTEGER PRIMARY KEY AUTOINCREMENT,
+            data        BLOB NOT NULL,
+            samples     INTEGER NOT NULL,
+            created_at  TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS content_blocks (
+            block_id       INTEGER PRIMARY KEY AUTOINCREMENT,
+            resident_name  TEXT NOT NULL,
+            ym             TEXT NOT NULL,
+            dict_id        INTEGER,
+            data           BLOB NOT NULL,
+            entries        INTEGER NOT NULL,
+            raw_size       INTEGER NOT NULL,
+            created_at     TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_blocks_resident ON content_blocks(resident_name, ym)
+    ''')
+    conn.execute('''
+        CREATE VIEW IF NOT EXISTS diary_entries_text AS
+        SELECT id, resident_name, name_key, date, shift, author, content_hash,
+               COALESCE(content, cold_text(block_id, block_pos, block_len)) AS content
+        FROM diary_entries
+    ''')
+
+
+def train_content_dict(texts, size: int = COLD_DICT_SIZE) -> bytes:
+    """
+    記事本文から zlib の共有辞書を作る。
+    よく出る行・語句（定型の記録文）を (出現回数 - 1) × バイト数 の大きい順に詰め、
+    一番効くものほど末尾に置く（zlib は辞書の末尾に近いほど短く参照できる）。
+    """
+    counts: Counter = Counter()
+    for text in texts:
+        for line in str(text).split("\n"):
+            line = line.strip()
+            if not line:
+                continue
+            counts[line] += 1
+            for fragment in _FRAGMENT_RE.split(line):
+                if len(fragment) >= 2 and fragment != line:
+                    counts[fragment] += 1
+
+    scored = sorted(((n - 1) * len(s.encode("utf-8")), s) for s, n in counts.items() if n > 1)
+    picked, total = [], 0
+    for score, s in reversed(scored):
+        data = s.encode("utf-8")
+        if total + len(data) > size:
+            continue
+        picked.append((score, data))
+        total += len(data)
+    return b"".join(data for _, data in sorted(picked))
+
+
+def pack_block(texts: List[str], zdict: bytes | None) -> tuple[bytes, List[tuple[int, int]]]:
+    """
+    本文を連結して 1 ブロックに圧縮する。戻り値: (圧縮データ, [(開始位置, バイト数)])
+    """
+    raw, spans = bytearray(), []
+    for text in texts:
+        data = text.encode("utf-8")
+        spans.append((len(raw), len(data)))
+        raw += data
+    comp = zlib.compressobj(9, zdict=zdict) if zdict else zlib.compressobj(9)
+    return comp.compress(bytes(raw)) + comp.flush(), spans
+
+
+def unpack_block(data: bytes, zdict: bytes | None) -> bytes:
+    """
+    pack_block の逆。
+    """
+    decomp = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+    return decomp.decompress(data) + decomp.flush()
+
+
+def _cold_reader(conn: sqlite3.Connection):
+    """
+    SQL 関数 cold_text(block_id, block_pos, block_len) を接続ごとに作る。
+    展開したブロックは COLD_CACHE_BLOCKS 個まで覚えておく（ブロックは書き換えないので古くならない）。
+    """
+    blocks: OrderedDict = OrderedDict()
+    dicts: Dict[int, bytes] = {}
+
+    def cold_text(block_id, pos, length):
+        if block_id is None:
+            return None
+        data = blocks.get(block_id)
+        if data is None:
+            dict_id, packed = conn.execute(
+                "SELECT dict_id, data FROM content_blocks WHERE block_id = ?", (block_id,)
+            ).fetchone()
+            if dict_id is not None and dict_id not in dicts:
+                dicts[dict_id] = conn.execute(
+                    "SELECT data FROM content_dicts WHERE dict_id = ?", (dict_id,)
+                ).fetchone()[0]
+            data = unpack_block(packed, dicts.get(dict_id))
+            blocks[block_id] = data
+            if len(blocks) > COLD_CACHE_BLOCKS:
+                blocks.popitem(last=False)
+        else:
+            blocks.move_to_end(block_id)
+        return data[pos:pos + length].decode("utf-8")
+
+    return cold_text
+
+
+def content_dict(conn: sqlite3.Connection, *, retrain: bool = False) -> tuple[int, bytes]:
+    """
+    圧縮に使う辞書（最新のもの）。無いか retrain なら直近の記事から作って保存する
+    （コミットは呼び出し側）。戻り値: (dict_id, 辞書)
+    """
+    row = conn.execute(
+        "SELECT dict_id, data FROM content_dicts ORDER BY dict_id DESC LIMIT 1"
+    ).fetchone()
+    if row and not retrain:
+        return row
+    texts = [r[0] for r in conn.execute(
+        "SELECT content FROM diary_entries_text WHERE content IS NOT NULL "
+        "ORDER BY id DESC LIMIT ?", (COLD_DICT_SAMPLES,)
+    )]
+    zdict = train_content_dict(texts)
+    cur = conn.execute(
+        "INSERT INTO content_dicts (data, samples, created_at) VALUES (?, ?, ?)",
+        (zdict, len(texts), dt.datetime.now().isoformat(timespec="seconds")),
+    )
+    return cur.lastrowid, zdict
+
+
+def compact_cold_entries(db_path: str | Path, *, older_than_days: int | None = None,
+                         today: dt.date | None = None, retrain: bool = False) -> Dict:
+    """
+    older_than_days 日より前の月の記事本文を、入所者・月ごとのブロックに圧縮する。
+    圧縮した行は content を NULL にして block_id / block_pos / block_len で本文を指す。
+    読むときは diary_entries_text ビューが透過的に展開する。最近の記事はそのまま（書き込みは速いまま）。
+    省略時は prefs.json の cold_after_days（0 なら何もしない）。
+    戻り値: {"entries", "blocks", "raw_bytes", "packed_bytes"}
+    """
+    if older_than_days is None:
+        older_than_days = int(load_prefs().get("cold_after_days", 0))
+    result = {"entries": 0, "blocks": 0, "raw_bytes": 0, "packed_bytes": 0}
+    if older_than_days <= 0:
+        return result
+    today = today or dt.date.today()
+    # 月の途中で分けないように、月初で切る
+    cutoff = (today - dt.timedelta(days=older_than_days)).replace(day=1).strftime("%Y-%m-%d")
+
+    conn = connect_db(db_path)
+    try:
+        dict_id, zdict = content_dict(conn, retrain=retrain)
+        rows = conn.execute('''
+            SELECT id, resident_name, substr(date, 1, 7), content FROM diary_entries
+            WHERE content IS NOT NULL AND date < ?
+            ORDER BY resident_name, date, id
+        ''', (cutoff,)).fetchall()
+
+        now = dt.datetime.now().isoformat(timespec="seconds")
+        pending = 0
+        for (name, ym), group in itertools.groupby(rows, key=lambda r: (r[1], r[2])):
+            group = list(group)
+            packed, spans = pack_block([r[3] for r in group], zdict)
+            raw_size = sum(n for _, n in spans)
+            block_id = conn.execute(
+                """INSERT INTO content_blocks
+                   (resident_name, ym, dict_id, data, entries, raw_size, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (name, ym, dict_id, packed, len(group), raw_size, now),
+            ).lastrowid
+            conn.executemany(
+                """UPDATE diary_entries
+                   SET content = NULL, block_id = ?, block_pos = ?, block_len = ?
+                   WHERE id = ?""",
+                [(block_id, pos, n, r[0]) for r, (pos, n) in zip(group, spans)],
+            )
+            result["entries"] += len(group)
+            result["blocks"] += 1
+            result["raw_bytes"] += raw_size
+            result["packed_bytes"] += len(packed)
+            pending += 1
+            if pending >= COLD_COMMIT_BLOCKS:
+                conn.commit()
+                pending = 0
+        conn.commit()
+    finally:
+        conn.close()
+    return result
+
+
+def vacuum_db(db_path: str | Path) -> tuple[int, int]:
+    """
+    VACUUM で空きページを詰める。戻り値: (前のバイト数, 後のバイト数)
+    """
+    before = os.path.getsize(db_path)
+    conn = connect_db(db_path)
+    conn.execute("VACUUM")
+    conn.close()
+    return before, os.path.getsize(db_path)
+
+
+# ------------------------------------------------------------------
+# Part S : 変更ログによる端末間の差分同期（共有フォルダ経由）
+# ------------------------------------------------------------------
+
+# 同期する表と、端末をまたいで行を特定するキー（AUTOINCREMENT の id は端末ごとに違うので使わない）
+# 氏名は照合キー（name_key）で比べる（「宮本 武蔵」と「宮本　武蔵」を同じ行として競合判定する）
+SYNC_TABLES = {
+    "diary_entries":    (("name_key", "date", "shift", "content_hash"),
+                         ("resident_name", "date", "shift", "author")),
+    "residents":        (("name_key",), ("name", "room", "birthday", "gender", "reading")),
+    "personal_pointer": (("name",), ("name", "file", "sheet", "next_row")),
+}
+# name_key がまだ無い行（外部のツールで足した行など）は、この列の値をキーに使う
+SYNC_NAME_COLUMN = {"diary_entries": "resident_name", "residents": "name"}
+SYNC_NOW = "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')"      # 変更時刻（UTC・ミリ秒）
+SYNC_BASELINE = "1970-01-01T00:00:00.000Z"              # 変更ログを作る前からある行の時刻
+SYNC_SENT = "@sent"                                      # 自分の書き出し位置のカーソル名
+SYNC_ACKS = "acks.json"                                  # 各端末の取り込み済み位置（共有フォルダ）
+
+
+def _sync_key_sql(tbl: str, prefix: str = "") -> str:
+    """
+    変更ログのキー（JSON 配列）を作る SQL 式。prefix は "NEW." / "OLD." / ""。
+    name_key が NULL の行は SYNC_NAME_COLUMN の値で代わりにする。
+    """
+    cols = [f"COALESCE({prefix}name_key, {prefix}{SYNC_NAME_COLUMN[tbl]})" if c == "name_key"
+            else prefix + c for c in SYNC_TABLES[tbl][0]]
+    return f"json_array({', '.join(cols)})"
+
+
+def init_change_log(conn: sqlite3.Connection) -> None:
+    """
+    変更ログ change_log と、SYNC_TABLES の追加・更新・削除を記録するトリガーを作る
+    （コミットは呼び出し側）。
+    seq は単調に増える番号、origin は取り込んだ変更の端末 ID（この端末での変更は NULL）。
+    表のトリガーを初めて作るときは、既にある行を SYNC_BASELINE の時刻で記録する
+    （初回の同期で送る）。トリガーの作成と記録は 1 つのセーブポイントで行い、途中で
+    失敗したら両方とも無かったことにする（次に呼ばれたときにやり直す）。
+    まだ無い表・キーの列がまだ無い古い表（create_database_if_not_exists の移行前）は
+    飛ばし、移行の後で呼ばれたときに作る。
+    氏名をそのままキーにしていた頃のトリガー（trg_log_*）が残っていれば作り直し、
+    記録済みのキーも照合キーに書き換える。
+    """
+    conn.execute("SAVEPOINT init_change_log")
+    try:
+        _init_change_log(conn)
+    except BaseException:
+        conn.execute("ROLLBACK TO init_change_log")
+        conn.execute("RELEASE init_change_log")
+        raise
+    conn.execute("RELEASE init_change_log")
+
+
+def _init_change_log(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+            tbl         TEXT NOT NULL,
+            row_key     TEXT NOT NULL,
+            op          TEXT NOT NULL,
+            origin      TEXT,
+            changed_at  TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_change_log_key ON change_log(tbl, row_key, seq)
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sync_cursors (
+            peer        TEXT PRIMARY KEY,
+            last_seq    INTEGER NOT NULL,
+            updated_at  TEXT NOT NULL
+        )
+    ''')
+
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for tbl, (key_cols, watch_cols) in SYNC_TABLES.items():
+        if tbl not in existing:
+            continue
+        legacy = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+            (f"trg_log_{tbl}_insert",),
+        ).fetchone()
+        columns = {r[1] for r in conn.execute(f"PRAGMA table_info({tbl})")}
+        if not set(key_cols) <= columns:
+            continue
+        logged = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+            (f"trg_sync_{tbl}_insert",),
+        ).fetchone()
+        if legacy:
+            for op in ("insert", "update", "delete"):
+                conn.execute(f"DROP TRIGGER IF EXISTS trg_log_{tbl}_{op}")
+            if tbl in SYNC_NAME_COLUMN:
+                parts = ["normalize_key(json_extract(row_key, '$[0]'))"] + [
+                    f"json_extract(row_key, '$[{i}]')" for i in range(1, len(key_cols))]
+                conn.execute(f"UPDATE change_log SET row_key = json_array({', '.join(parts)}) "
+                             f"WHERE tbl = ?", (tbl,))
+        watch_cols = [c for c in watch_cols if c in columns]
+        new_key, old_key = _sync_key_sql(tbl, "NEW."), _sync_key_sql(tbl, "OLD.")
+        if not logged and not legacy:
+            conn.execute(
+                f"INSERT INTO change_log (tbl, row_key, op, changed_at) "
+                f"SELECT '{tbl}', {_sync_key_sql(tbl)}, 'upsert', ? FROM {tbl}",
+                (SYNC_BASELINE,),
+            )
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_sync_{tbl}_insert AFTER INSERT ON {tbl}
+            BEGIN
+                INSERT INTO change_log (tbl, row_key, op, changed_at)
+                VALUES ('{tbl}', {new_key}, 'upsert', {SYNC_NOW});
+            END
+        ''')
+        # 本文の圧縮や照合キーの埋め直しは中身の変更ではないので記録しない
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_sync_{tbl}_update
+            AFTER UPDATE OF {", ".join(watch_cols)} ON {tbl}
+            BEGIN
+                INSERT INTO change_log (tbl, row_key, op, changed_at)
+                SELECT '{tbl}', {old_key}, 'delete', {SYNC_NOW}
+                WHERE {old_key} IS NOT {new_key};
+                INSERT INTO change_log (tbl, row_key, op, changed_at)
+                VALUES ('{tbl}', {new_key}, 'upsert', {SYNC_NOW});
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_sync_{tbl}_delete AFTER DELETE ON {tbl}
+            BEGIN
+                INSERT INTO change_log (tbl, row_key, op, changed_at)
+                VALUES ('{tbl}', {old_key}, 'delete', {SYNC_NOW});
+            END
+        ''')
+
+
+def sync_origin() -> str:
+    """
+    この端末の ID（prefs.json の sync_origin。空ならコンピューター名）。
+    """
+    return load_prefs().get("sync_origin") or socket.gethostname()
+
+
+def sync_folder(sync_dir: Path, db_path: str | Path) -> Path:
+    """
+    共有フォルダの中の、この DB 用の置き場（端末ごとのサブフォルダに変更ファイルを置く）。
+    """
+    return Path(sync_dir) / Path(db_path).stem
+
+
+def _sync_cursor(conn: sqlite3.Connection, peer: str) -> int:
+    row = conn.execute("SELECT last_seq FROM sync_cursors WHERE peer = ?", (peer,)).fetchone()
+    return row[0] if row else 0
+
+
+def _set_sync_cursor(conn: sqlite3.Connection, peer: str, seq: int) -> None:
+    conn.execute(
+        """INSERT INTO sync_cursors (peer, last_seq, updated_at) VALUES (?, ?, ?)
+           ON CONFLICT(peer) DO UPDATE SET last_seq=excluded.last_seq,
+                                           updated_at=excluded.updated_at""",
+        (peer, seq, dt.datetime.now().isoformat(timespec="seconds")),
+    )
+
+
+# キーの先頭（?1 の照合キー）に当たる行の条件（name_key の無い行は名前の列で比べる）
+_SYNC_NAME_MATCH = {
+    tbl: f"(name_key = ?1 OR (name_key IS NULL AND {col} = ?1))"
+    for tbl, col in SYNC_NAME_COLUMN.items()
+}
+
+
+def sync_key(conn: sqlite3.Connection, tbl: str, row_key: str) -> str:
+    """
+    変更ファイルのキーを、この DB の変更ログと同じ書き方にそろえる
+    （氏名は照合キーに。JSON の書き方は SQLite の json_array に合わせる）。
+    氏名をそのままキーにしていた頃の変更ファイルもこれで同じ行に当たる。
+    """
+    key = json.loads(row_key)
+    if tbl in SYNC_NAME_COLUMN and key and key[0] is not None:
+        key[0] = normalize_key(key[0])
+    return conn.execute(f"SELECT json_array({', '.join('?' * len(key))})", key).fetchone()[0]
+
+
+def sync_row(conn: sqlite3.Connection, tbl: str, row_key: str) -> Optional[Dict]:
+    """
+    変更ログのキーが指す行の今の内容。無ければ None（削除として送る）。
+    diary_entries は圧縮済みの本文も展開して送る。
+    """
+    key = json.loads(row_key)
+    if tbl == "diary_entries":
+        cur = conn.execute(f'''
+            SELECT resident_name, date, shift, author, content FROM diary_entries_text
+            WHERE {_SYNC_NAME_MATCH["diary_entries"]}
+              AND date = ?2 AND shift IS ?3 AND content_hash IS ?4
+            ORDER BY id DESC LIMIT 1
+        ''', key)
+    elif tbl == "residents":
+        cur = conn.execute(f'''
+            SELECT name, room, birthday, gender, reading FROM residents
+            WHERE {_SYNC_NAME_MATCH["residents"]} ORDER BY id DESC LIMIT 1
+        ''', key)
+    else:
+        cur = conn.execute(
+            "SELECT name, file, sheet, next_row FROM personal_pointer WHERE name = ?", key
+        )
+    row = cur.fetchone()
+    return dict(zip((c[0] for c in cur.description), row)) if row else None
+
+
+def export_changes(db_path: str | Path, sync_dir: Path) -> int:
+    """
+    前回の書き出し以降にこの端末で起きた変更を、共有フォルダに 1 ファイルで書き出す。
+    同じ行の変更が何度あっても最後の 1 件（今の内容）だけを送る。
+    ファイルを書いてからカーソルを進めるので、途中で落ちたら次回は同じ範囲を送り直す
+    （取り込み側は seq で読み飛ばす）。
+    戻り値: 書き出した変更の数
+    """
+    conn = connect_db(db_path)
+    try:
+        after = _sync_cursor(conn, SYNC_SENT)
+        latest: Dict[tuple, tuple] = {}
+        last_seq = after
+        for seq, tbl, row_key, changed_at in conn.execute(
+            """SELECT seq, tbl, row_key, changed_at FROM change_log
+               WHERE seq > ? AND origin IS NULL ORDER BY seq""", (after,)
+        ):
+            latest.pop((tbl, row_key), None)
+            latest[(tbl, row_key)] = (seq, changed_at)
+            last_seq = seq
+        if not latest:
+            return 0
+
+        origin = sync_origin()
+        out_dir = sync_folder(sync_dir, db_path) / safe_file_stem(origin)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix="~changes.", dir=out_dir)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for (tbl, row_key), (seq, changed_at) in latest.items():
+                f.write(json.dumps({
+                    "seq": seq, "origin": origin, "tbl": tbl, "key": row_key,
+                    "at": changed_at, "row": sync_row(conn, tbl, row_key),
+                }, ensure_ascii=False) + "\n")
+        os.replace(tmp, out_dir / f"{last_seq:012d}.jsonl")
+
+        _set_sync_cursor(conn, SYNC_SENT, last_seq)
+        conn.commit()
+        return len(latest)
+    finally:
+        conn.close()
+
+
+def _apply_sync_row(conn: sqlite3.Connection, tbl: str, key: list, row: Optional[Dict]) -> None:
+    """
+    取り込んだ 1 行を反映する（row が None なら削除）。
+    """
+    if tbl == "diary_entries":
+        # 氏名の表記だけ違う同じ記事（照合キーが同じ）は 1 行にまとめ、勝った側の表記にそろえる
+        ids = [r[0] for r in conn.execute(f'''
+            SELECT id FROM diary_entries
+            WHERE {_SYNC_NAME_MATCH["diary_entries"]}
+              AND date = ?2 AND shift IS ?3 AND content_hash IS ?4
+            ORDER BY id DESC
+        ''', key)]
+        stale = ids if row is None else ids[1:]
+        conn.executemany("DELETE FROM diary_entries WHERE id = ?", [(i,) for i in stale])
+        if row is None:
+            return
+        if ids:
+            conn.execute(
+                "UPDATE diary_entries SET resident_name = ?, name_key = ?, author = ? WHERE id = ?",
+                (row["resident_name"], normalize_key(row["resident_name"]), row["author"], ids[0]),
+            )
+            return
+        conn.execute('''
+            INSERT INTO diary_entries
+                (resident_name, name_key, date, shift, content, content_hash, author)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(name_key, date, shift, content_hash)
+            DO UPDATE SET author = excluded.author
+        ''', (row["resident_name"], normalize_key(row["resident_name"]), row["date"],
+              row["shift"], row["content"], content_digest(row["content"]), row["author"]))
+    elif tbl == "residents":
+        # update_resident と同じく、照合キーが同じ行を同じ入所者とみなす（表記は勝った側にそろえる）
+        name_key = normalize_key(key[0])
+        if row is None:
+            conn.execute("DELETE FROM residents WHERE name_key = ?", (name_key,))
+        elif conn.execute("SELECT 1 FROM residents WHERE name_key = ?", (name_key,)).fetchone():
+            conn.execute('''UPDATE residents SET name=?, room=?, birthday=?, gender=?,
+                                   reading=CASE WHEN ? THEN ? ELSE reading END
+                            WHERE name_key=?''',
+                         (row["name"], row["room"], row["birthday"], row["gender"],
+                          "reading" in row, row.get("reading"), name_key))
+        else:
+            conn.execute('''INSERT INTO residents (name, name_key, room, birthday, gender, reading)
+                            VALUES (?, ?, ?, ?, ?, ?)''',
+                         (row["name"], name_key, row["room"], row["birthday"], row["gender"],
+                          row.get("reading")))
+    else:
+        if row is None:
+            conn.execute("DELETE FROM personal_pointer WHERE name = ?", key)
+        else:
+            set_pointer(conn, row["name"], row["file"], row["sheet"], row["next_row"])
+
+
+def apply_change(conn: sqlite3.Connection, change: Dict, local_origin: str) -> bool:
+    """
+    他の端末の変更 1 件を、競合の規則に従って反映する（コミットは呼び出し側）。
+    規則: 行ごとに、版 (変更時刻, 端末 ID) の大きい方が勝つ（後から書いた方が残る。
+    同時刻なら端末 ID の順）。どの順で取り込んでも、どの端末でも同じ結果になる。
+    反映で書かれたログは、元の端末 ID と時刻に付け替える（送り返さない・次の比較に使う）。
+    戻り値: 反映したら True、こちらの版の方が新しくて捨てたら False
+    """
+    tbl = change["tbl"]
+    row_key = sync_key(conn, tbl, change["key"])
+    local = conn.execute(
+        """SELECT changed_at, origin FROM change_log
+           WHERE tbl = ? AND row_key = ? ORDER BY seq DESC LIMIT 1""", (tbl, row_key)
+    ).fetchone()
+    if local and (local[0], local[1] or local_origin) >= (change["at"], change["origin"]):
+        return False
+
+    before = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+    _apply_sync_row(conn, tbl, json.loads(row_key), change["row"])
+    marked = conn.execute(
+        "UPDATE change_log SET origin = ?, changed_at = ? WHERE seq > ? AND origin IS NULL",
+        (change["origin"], change["at"], before),
+    ).rowcount
+    if not marked:          # 何も変わらなかった（既に同じ内容・既に削除済み）ときも版は覚える
+        conn.execute(
+            """INSERT INTO change_log (tbl, row_key, op, origin, changed_at)
+               VALUES (?, ?, ?, ?, ?)""",
+            (tbl, row_key, "delete" if change["row"] is None else "upsert",
+             change["origin"], change["at"]),
+        )
+    return True
+
+
+def _read_sync_acks(peer_dir: Path) -> Dict[str, int]:
+    try:
+        return json.loads((peer_dir / SYNC_ACKS).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_sync_acks(own_dir: Path, peer: str, seq: int) -> None:
+    """
+    acks.json の peer の取り込み済み位置を seq にする（書き換えは一時ファイル経由で一度に）。
+    """
+    own_dir.mkdir(parents=True, exist_ok=True)
+    acks = _read_sync_acks(own_dir)
+    acks[peer] = seq
+    fd, tmp = tempfile.mkstemp(prefix="~acks.", dir=own_dir)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(acks, f, ensure_ascii=False)
+    os.replace(tmp, own_dir / SYNC_ACKS)
+
+
+def import_changes(db_path: str | Path, sync_dir: Path) -> Dict[str, int]:
+    """
+    共有フォルダにある他の端末の変更のうち、端末ごとのカーソルより後の分だけを取り込む。
+    端末ごとに 1 トランザクション（変更とカーソルを一緒に確定する）。
+    確定したカーソルは共有フォルダの自分の置き場の acks.json にも書き、
+    送った側が変更ログと変更ファイルを片付けられるようにする（prune_change_log）。
+    戻り値: {"files", "applied", "skipped"}  skipped は競合でこちらの版が残った数
+    """
+    result = {"files": 0, "applied": 0, "skipped": 0}
+    folder = sync_folder(sync_dir, db_path)
+    if not folder.exists():
+        return result
+    local_origin = sync_origin()
+    conn = connect_db(db_path)
+    try:
+        for peer_dir in sorted(p for p in folder.iterdir() if p.is_dir()):
+            if peer_dir.name == safe_file_stem(local_origin):
+                continue
+            cursor = _sync_cursor(conn, peer_dir.name)
+            files = sorted(p for p in peer_dir.glob("*.jsonl")
+                           if p.stem.isdigit() and int(p.stem) > cursor)
+            if not files:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            last_seq = cursor
+            for path in files:
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        change = json.loads(line)
+                        if change["seq"] <= cursor:
+                            continue
+                        if apply_change(conn, change, local_origin):
+                            result["applied"] += 1
+                        else:
+                            result["skipped"] += 1
+                last_seq = max(last_seq, int(path.stem))
+                result["files"] += 1
+            _set_sync_cursor(conn, peer_dir.name, last_seq)
+            conn.commit()
+            _write_sync_acks(folder / safe_file_stem(local_origin), peer_dir.name, last_seq)
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return result
+
+
+def prune_change_log(db_path: str | Path, sync_dir: Path) -> tuple[int, int]:
+    """
+    どの端末も取り込み済みの範囲（各端末の acks.json にある、この端末の位置の最小値）まで、
+    変更ログと自分の変更ファイルを片付ける。
+    ログは同じ行の古い版だけを消し、行ごとの最新の版は残す（競合の比較に使うため）。
+    取り込んだ変更のログ（origin あり）は送り返さないので、新しい版があればいつでも消せる。
+    他の端末がまだ 1 つも無い・acks.json の無い端末があるときは、自分の分は何も消さない
+    （後から加わる端末は、既存の端末の DB を複製してから同期を始める）。
+    戻り値: (消したログの行数, 消した変更ファイルの数)
+    """
+    folder = sync_folder(sync_dir, db_path)
+    me = safe_file_stem(sync_origin())
+    peers = [p for p in folder.iterdir() if p.is_dir() and p.name != me] if folder.exists() else []
+    acked = min((_read_sync_acks(p).get(me, 0) for p in peers), default=0)
+
+    conn = connect_db(db_path)
+    try:
+        upto = min(acked, _sync_cursor(conn, SYNC_SENT))
+        rows = conn.execute(
+            """DELETE FROM change_log
+               WHERE (seq <= ? OR origin IS NOT NULL)
+                 AND EXISTS (SELECT 1 FROM change_log AS newer
+                             WHERE newer.tbl = change_log.tbl
+                               AND newer.row_key = change_log.row_key
+                               AND newer.seq > change_log.seq)""", (upto,)
+        ).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+
+    files = 0
+    for path in (folder / me).glob("*.jsonl") if acked else ():
+        if path.stem.isdigit() and int(path.stem) <= acked:
+            path.unlink(missing_ok=True)
+            files += 1
+    return rows, files
+
+
+# ------------------------------------------------------------------
+# Part T : 入所者名の前方一致索引（名簿登録の入力補完・抽出時の名簿照合）
+# ------------------------------------------------------------------
+
+RESIDENT_SUGGEST = 8        # 入力補完で一度に出す候補の数
+
+# カタカナ → ひらがな（読みはどちらで入力しても同じキーにする）
+_KANA_TABLE = {c: c - 0x60 for c in range(ord("ァ"), ord("ヶ") + 1)}
+
+
+def complete_key(text) -> str:
+    """
+    前方一致用のキー: resolver_key（空白・敬称・旧字体の統一）にひらがな化を加えたもの。
+    """
+    return resolver_key(text).translate(_KANA_TABLE)
+
+
+class ResidentIndex:
+    """
+    residents から作る入力補完用の索引。1 文字打つごとの候補探しで SQLite を引かない。
+    氏名と読み（姓・名それぞれの読みからも引ける）を (キー, 氏名) の整列済み配列に持ち、
+    前方一致は bisect で範囲の先頭を探して読み進めるだけで済ませる。居室番号も同様。
+    version は作ったときの名簿の版（roster_version）。
+    """
+
+    def __init__(self, rows=(), version=None):
+        self.version = version
+        # rows: [(氏名, 居室, 生年月日, 性別, 読み)]  後の行ほど新しい（id 順）
+        self.records: Dict[str, tuple] = {}      # 氏名 → (居室, 生年月日, 性別, 読み)
+        self.exact: Dict[str, str] = {}          # resolver_key → 氏名（在籍中を優先）
+        self.occupants: Dict[str, str] = {}      # 居室 → 在室中の氏名
+        self._keys: Dict[str, set] = {}
+        self.keys: List[tuple[str, str]] = []
+        self.rooms: List[str] = sorted(set(ROOM_SEQ) | {"保留", "退所"})
+        for name, room, birthday, gender, reading in rows:
+            self._set(name, room, birthday, gender, reading)
+        # 一括で作るときは最後に 1 回だけ並べる
+        self.keys = sorted({(k, n) for n, keys in self._keys.items() for k in keys})
+        self.rooms = sorted(set(self.rooms) | {r[0] for r in self.records.values() if r[0]})
+
+    @classmethod
+    def from_db(cls, conn: sqlite3.Connection) -> "ResidentIndex":
+        rows = conn.execute(
+            "SELECT name, room, birthday, gender, reading FROM residents ORDER BY id"
+        ).fetchall()
+        return cls(rows, roster_version(conn))
+
+    @staticmethod
+    def _search_keys(name: str, reading: str) -> set:
+        keys = set()
+        for text in (name, reading):
+            if not text:
+                continue
+            keys.add(complete_key(text))
+            # 「宮本 武蔵」「みやもと むさし」なら名の方からも引けるようにする
+            keys.update(complete_key(part) for part in str(text).split()[1:])
+        keys.discard("")
+        return keys
+
+    def _set(self, name, room, birthday, gender, reading) -> set:
+        old = self.records.get(name)
+        if old and old[0] and self.occupants.get(old[0]) == name:
+            del self.occupants[old[0]]
+        reading = reading or (old[3] if old else "") or ""
+        self.records[name] = (room, birthday, gender, reading)
+        if room and room not in ("保留", "退所"):
+            self.occupants[room] = name
+        key = resolver_key(name)
+        if key and (room != "退所" or key not in self.exact):
+            self.exact[key] = name
+        new_keys = self._search_keys(name, reading)
+        old_keys = self._keys.get(name, set())
+        self._keys[name] = new_keys
+        return old_keys
+
+    def add(self, name: str, room: str, birthday=None, gender=None, reading: str = "") -> None:
+        """
+        1 人分を追加・更新する（update_resident から呼ぶ）。読みが空なら前の読みを残す。
+        """
+        old_keys = self._set(name, room, birthday, gender, reading)
+        new_keys = self._keys[name]
+        for key in old_keys - new_keys:
+            i = bisect.bisect_left(self.keys, (key, name))
+            if i < len(self.keys) and self.keys[i] == (key, name):
+                del self.keys[i]
+        for key in new_keys - old_keys:
+            bisect.insort(self.keys, (key, name))
+        if room:
+            i = bisect.bisect_left(self.rooms, room)
+            if i == len(self.rooms) or self.rooms[i] != room:
+                self.rooms.insert(i, room)
+
+    def move(self, name: str, room: str) -> None:
+        """
+        居室だけを変える（居室が重なって保留にしたときなど）。
+        """
+        if name in self.records:
+            _, birthday, gender, reading = self.records[name]
+            self.add(name, room, birthday, gender, reading)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def complete(self, typed: str, limit: int = RESIDENT_SUGGEST) -> List[str]:
+        """
+        氏名か読みが typed で始まる入所者。在籍中を先に、キーの順で最大 limit 人。
+        """
+        key = complete_key(typed)
+        if not key:
+            return []
+        active, retired, seen = [], [], set()
+        for k, name in itertools.islice(self.keys, bisect.bisect_left(self.keys, (key,)), None):
+            if not k.startswith(key):
+                break
+            if name in seen:
+                continue
+            seen.add(name)
+            (retired if self.records[name][0] == "退所" else active).append(name)
+            if len(active) >= limit:
+                break
+        return (active + retired)[:limit]
+
+    def complete_room(self, typed: str, limit: int = RESIDENT_SUGGEST) -> List[tuple[str, str]]:
+        """
+        typed で始まる居室番号と、いま入っている入所者（空室・保留・退所は ""）。
+        """
+        typed = unicodedata.normalize("NFKC", typed).strip()
+        start = bisect.bisect_left(self.rooms, typed)
+        return [(room, self.occupants.get(room, ""))
+                for room in itertools.islice(self.rooms, start, start + limit)
+                if room.startswith(typed)]
+
+    def lookup(self, typed: str) -> Optional[str]:
+        """
+        照合キーが名簿の氏名と一致すればその氏名、無ければ None。
+        """
+        return self.exact.get(resolver_key(typed))
+
+
+_resident_indexes: Dict[str, ResidentIndex] = {}
+_resident_index_lock = threading.Lock()
+
+
+def init_roster_version(conn: sqlite3.Connection) -> None:
+    """
+    名簿の版を数える 1 行だけの表と、residents の追加・変更・削除で版を進めるトリガーを作る
+    （コミットは呼び出し側）。照合キーの埋め直し（name_key だけの更新）では進めない。
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS roster_version (
+            id       INTEGER PRIMARY KEY CHECK (id = 1),
+            version  INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO roster_version (id, version) VALUES (1, 0)")
+    bump = "BEGIN UPDATE roster_version SET version = version + 1 WHERE id = 1; END"
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_roster_insert
+                     AFTER INSERT ON residents {bump}""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_roster_update
+                     AFTER UPDATE OF name, room, birthday, gender, reading ON residents {bump}""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_roster_delete
+                     AFTER DELETE ON residents {bump}""")
+
+
+def roster_version(conn: sqlite3.Connection) -> Optional[int]:
+    """
+    名簿の版（roster_version 表の番号）。他の端末での登録や同期の取り込みでも進むので、
+    索引が古いかどうかをこれで見る。まだ表の無い DB では None。
+    """
+    try:
+        row = conn.execute("SELECT version FROM roster_version WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def resident_index(db_path: str | Path) -> ResidentIndex:
+    """
+    DB ごとの入力補完索引。最初に使うときに residents から作り、以後は使い回す
+    （update_resident が差分で更新する）。名簿の版が変わっていたら作り直す。
+    版を見るのは画面を開くときや転記のときの 1 回だけで、キー入力ごとには引かない。
+    """
+    key = str(Path(db_path).resolve())
+    with _resident_index_lock:
+        conn = connect_db(db_path)
+        try:
+            index = _resident_indexes.get(key)
+            if index is None or index.version != roster_version(conn):
+                index = _resident_indexes[key] = ResidentIndex.from_db(conn)
+        finally:
+            conn.close()
+        return index
+
+
+def cached_resident_index(db_path: str | Path) -> Optional[ResidentIndex]:
+    """
+    作成済みの索引（まだ作っていなければ None。次に使うときに DB から作られる）。
+    """
+    return _resident_indexes.get(str(Path(db_path).resolve()))
+
+
+class SuggestEntry(tk.Entry):
+    """
+    入力のたびに候補を下に出す Entry。
+    suggest(入力文字列) → [(表示文字列, 値)] で候補を受け取り、↓↑ で選んで Enter かクリックで確定する。
+    確定すると値を入れてから on_pick(値) を呼ぶ。
+    """
+
+    def __init__(self, master, suggest, on_pick=None, **kw):
+        self.var = tk.StringVar()
+        super().__init__(master, textvariable=self.var, **kw)
+        self.suggest = suggest
+        self.on_pick = on_pick
+        self.values: List[str] = []
+        self.picking = False
+        self.listbox = tk.Listbox(master, exportselection=False)
+        # IME の確定や貼り付けでも候補を出すよう、キーではなく値の変化を見る
+        self.var.trace_add("write", lambda *_: self.refresh())
+        self.bind("<Down>", lambda e: self.move(1))
+        self.bind("<Up>", lambda e: self.move(-1))
+        self.bind("<Return>", self.pick)
+        self.bind("<Escape>", lambda e: self.hide())
+        self.bind("<FocusOut>", lambda e: self.after(200, self.hide))   # クリックの確定を先に通す
+        self.listbox.bind("<ButtonRelease-1>", self.pick)
+
+    def refresh(self) -> None:
+        if self.picking:
+            return
+        text = self.var.get()
+        items = self.suggest(text) if text.strip() else []
+        if not items:
+            self.hide()
+            return
+        self.values = [value for _, value in items]
+        self.listbox.delete(0, tk.END)
+        for label, _ in items:
+            self.listbox.insert(tk.END, label)
+        self.listbox.configure(height=len(items))
+        self.listbox.place(in_=self, x=0, rely=1.0, relwidth=1.0)
+        self.listbox.lift()
+
+    def hide(self) -> None:
+        self.listbox.place_forget()
+        self.values = []
+
+    def move(self, step: int):
+        if not self.values:
+            return "break"
+        picked = self.listbox.curselection()
+        i = max(0, min(len(self.values) - 1, picked[0] + step if picked else 0))
+        self.listbox.selection_clear(0, tk.END)
+        self.listbox.selection_set(i)
+        self.listbox.see(i)
+        return "break"
+
+    def pick(self, event=None):
+        picked = self.listbox.curselection()
+        if not self.values or not picked:
+            self.hide()
+            return None
+        value = self.values[picked[0]]
+        self.picking = True
+        try:
+            self.var.set(value)
+        finally:
+            self.picking = False
+        self.icursor(tk.END)
+        self.hide()
+        if self.on_pick:
+            self.on_pick(value)
+        return "break"
 
 
 def create_database_if_not_exists(db_path: str):
@@ -706,7 +4939,7 @@ def create_database_if_not_exists(db_path: str):
     residents/diary_entriesテーブルがなければ作成する。
     DB初期化用。
     """
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     cursor = conn.cursor()
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS residents (
@@ -728,54 +4961,78 @@ def create_database_if_not_exists(db_path: str):
         )
     ''')
     cursor.execute('''
-        CREATE UNIQUE INDEX IF NOT EXISTS uniq_entry
-        ON diary_entries(resident_name, date, shift, content)
-    ''')   
+        CREATE INDEX IF NOT EXISTS idx_residents_name ON residents(name)
+    ''')
+
+    # 照合キー列（normalize_key の値）。古い DB には列を足して埋める
+    add_column_if_missing(conn, "residents", "name_key", "TEXT")
+    add_column_if_missing(conn, "diary_entries", "name_key", "TEXT")
+    # ふりがな（入力補完で読みからも引けるようにする）
+    add_column_if_missing(conn, "residents", "reading", "TEXT")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_residents_name_key ON residents(name_key)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_entries_name_key
+        ON diary_entries(name_key, date)
+    ''')
+    sync_name_keys(conn)
+
+    # 重複防止の一意索引（content_hash）と古い本文の圧縮保存
+    init_cold_storage(conn)
+    # 端末間同期用の変更ログ
+    init_change_log(conn)
+    # 入力補完の索引が古いかどうかを見る名簿の版
+    init_roster_version(conn)
+    init_stats_tables(conn)
     conn.commit()
     conn.close()
 
-# -----------------------------------------------------------------------------
-#  ユーティリティ
-# -----------------------------------------------------------------------------
-
-def normalize_text(val: str) -> str:
-    """None → 空文字 / 前後空白除去。セル値を安定化。"""
-    return val.strip() if val else ""
 
+def add_column_if_missing(conn: sqlite3.Connection, table: str, column: str, decl: str) -> bool:
+    """
+    table に column が無ければ ALTER TABLE で追加する。追加したら True。
+    """
+    cols = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+    if column in cols:
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return True
 
-def iter_rows(sheet, start: int = 2) -> Iterator[tuple[int, str, str]]:
-    """指定行から A 列・B 列の文字列を順に返す。"""
-    row = start
-    while row <= sheet.max_row:
-        name = sheet.cell(row, 1).value
-        content = sheet.cell(row, 2).value
-        yield row, normalize_text(str(name)) if name else "", normalize_text(str(content)) if content else ""
-        row += 1
 
+def yearly_databases(base_dir: Path) -> List[Path]:
+    """
+    フォルダ内の年ごとの DB（diary_YYYY.db）。新しい年から順に並べる。
+    """
+    return sorted((p for p in Path(base_dir).glob("diary_*.db")
+                   if re.fullmatch(r"diary_\d{4}\.db", p.name)), reverse=True)
 
-def apply_night_header(sheet, row: int, template_sheet) -> None:
-    """`template_sheet` 先頭 2 行を `row` 位置へコピー。"""
-    for offset in range(HEADER_ROWS):
-        for col in range(1, 3):  # A 列・B 列だけコピー（必要なら拡張）
-            src_cell = template_sheet.cell(offset + 1, col)
-            dst_cell = sheet.cell(row + offset, col)
-            dst_cell.value = src_cell.value
-            if src_cell.has_style:
-                dst_cell._style = src_cell._style
 
+def migrate_databases(base_dir: Path) -> List[Path]:
+    """
+    起動時に 1 回だけ、年ごとの DB のスキーマを最新にする（列・索引・ビュー・トリガーの追加と
+    name_key の埋め直し）。閲覧・出力は読み取り専用で開くので、移行はここでまとめて済ませる。
+    戻り値: 移行できなかった DB（他の端末が書き込み中で待ちきれなかったなど）
+    """
+    failed = []
+    for db_path in yearly_databases(base_dir):
+        try:
+            create_database_if_not_exists(str(db_path))
+        except sqlite3.OperationalError:
+            failed.append(db_path)
+    return failed
 
-def setup_page_breaks(sheet, rows_per_page: int = ARTICLE_ROWS_PER_PAGE) -> None:
-    """長大シートを印刷する際の手動改ページを自動挿入する。"""
-    from openpyxl.worksheet.pagebreak import Break
 
-    # 既存ブレークをリセット
-    sheet.page_breaks = []
+def sync_name_keys(conn: sqlite3.Connection) -> None:
+    """
+    name_key が未設定の行を埋める（コミットは呼び出し側）。
+    通常は書き込み時に設定済みなので、索引を引くだけで終わる。
+    """
+    conn.execute("UPDATE residents SET name_key = normalize_key(name) WHERE name_key IS NULL")
+    conn.execute(
+        "UPDATE diary_entries SET name_key = normalize_key(resident_name) WHERE name_key IS NULL"
+    )
 
-    total_rows = sheet.max_row
-    idx = rows_per_page + 1  # 改ページ位置 = 次ページ先頭行
-    while idx < total_rows:
-        sheet.page_breaks.append(Break(id=idx))
-        idx += rows_per_page
 
 # -----------------------------------------------------------------------------
 #  メイン関数
@@ -784,6 +5041,12 @@ def setup_page_breaks(sheet, rows_per_page: int = ARTICLE_ROWS_PER_PAGE) -> None
 
     
 def create_input_sheet(template_path: str, target_path: str, date: dt):
+    with FileLock(target_path):
+        _create_input_sheet(template_path, target_path, date)
+    os.startfile(target_path)
+
+
+def _create_input_sheet(template_path: str, target_path: str, date: dt):
     if not Path(target_path).exists():
         shutil.copy(template_path, target_path)
 
@@ -813,18 +5076,24 @@ def create_input_sheet(template_path: str, target_path: str, date: dt):
         wb._sheets.remove(new_ws)
         wb._sheets.insert(0, new_ws)   # 表と同じく左端へ
 
-    wb.save(target_path)
-    os.startfile(target_path)
+    save_workbook_atomic(wb, target_path)
 
 
 def add_ura_sheet(template_path: str, target_path: str, date: dt):
+    with FileLock(target_path):
+        added = _add_ura_sheet(template_path, target_path, date)
+    if added:
+        os.startfile(target_path)
+
+
+def _add_ura_sheet(template_path: str, target_path: str, date: dt) -> bool:
     sheet_base = f"{date.day}日裏"
     wb = openpyxl.load_workbook(target_path)
     remove_sheet1(wb)
 
     if sheet_base not in wb.sheetnames:
         messagebox.showerror("エラー", f"{sheet_base} が存在しません。先に日誌を作成してください。")
-        return
+        return False
 
     # 新しい裏番号を決定（例: 〇日裏(2), (3), ...）
     i = 2
@@ -836,7 +5105,7 @@ def add_ura_sheet(template_path: str, target_path: str, date: dt):
 
     if "B_temp" not in wb.sheetnames:
         messagebox.showerror("エラー", "テンプレート B_temp が見つかりません。")
-        return
+        return False
 
     new_sheet = wb.copy_worksheet(wb["B_temp"])
     wb._sheets.remove(new_sheet)  # 末尾に追加されるので先に削除
@@ -844,22 +5113,32 @@ def add_ura_sheet(template_path: str, target_path: str, date: dt):
     wb._sheets.insert(base_index, new_sheet)  # 指定位置に挿入
     new_sheet.title = new_sheet_name
 
-    wb.save(target_path)
-    os.startfile(target_path)
+    save_workbook_atomic(wb, target_path)
+    return True
 
 ROOM_SEQ = [str(i) for i in range(201, 226)] + [str(i) for i in range(301, 326)]
 
-def update_resident(name, room, birthday, gender, db_path, excel_path):
+def update_resident(name, room, birthday, gender, db_path, excel_path, reading=""):
     # ---------- DB ----------
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     cur  = conn.cursor()
-
-    cur.execute("SELECT 1 FROM residents WHERE name = ?", (name,))
-    if cur.fetchone():
+    # 入力補完の索引が作成済みで名簿の版も同じなら、作り直さずに差分で更新する
+    index = cached_resident_index(db_path)
+    if index is not None and index.version != roster_version(conn):
+        index = None
+
+    # 空白や敬称だけ違う氏名は同じ入所者として扱う（照合キーで検索）
+    name_key = normalize_key(name)
+    cur.execute("SELECT name FROM residents WHERE name_key = ?", (name_key,))
+    found = cur.fetchone()
+    if found:
+        # 読みが空欄なら登録済みの読みを残す
         cur.execute("""UPDATE residents
-                       SET room=?, birthday=?, gender=?
-                       WHERE name=?""",
-                    (room, birthday, gender, name))
+                       SET room=?, birthday=?, gender=?,
+                           reading=COALESCE(NULLIF(?, ''), reading)
+                       WHERE name_key=?""",
+                    (room, birthday, gender, reading, name_key))
+        name = found[0]
     else:
         cur.execute("""SELECT name FROM residents
                        WHERE room=? AND room NOT IN ('退所','保留')""", (room,))
@@ -867,14 +5146,19 @@ def update_resident(name, room, birthday, gender, db_path, excel_path):
         if dup:
             cur.execute("UPDATE residents SET room='保留' WHERE name=?",
                         (dup[0],))
+            if index is not None:
+                index.move(dup[0], "保留")
             messagebox.showinfo("居室重複",
                                 f"{dup[0]} さんの居室番号を保留としています")
         cur.execute("""INSERT INTO residents
-                       (name, room, birthday, gender)
-                       VALUES (?,?,?,?)""",
-                    (name, room, birthday, gender))
+                       (name, name_key, room, birthday, gender, reading)
+                       VALUES (?,?,?,?,?,?)""",
+                    (name, name_key, room, birthday, gender, reading or None))
 
     conn.commit()
+    if index is not None:
+        index.add(name, room, birthday, gender, reading)
+        index.version = roster_version(conn)
 
     # ---------- データ取得 ----------
     cur.execute("""SELECT name, room, birthday, gender
@@ -923,35 +5207,58 @@ def update_resident(name, room, birthday, gender, db_path, excel_path):
 def manage_residents_ui(db_path, excel_path):
     win = tk.Toplevel()
     win.title("入所者名簿管理")
+    index = resident_index(db_path)      # 候補は索引から出す（1 文字ごとに DB は引かない）
+
+    def fill(name):
+        # 登録済みの入所者を選んだら、今の登録内容を入れておく（変更だけ直せばよい）
+        room, birthday, gender, reading = index.records[name]
+        for entry, value in ((room_entry, room), (reading_entry, reading)):
+            entry.delete(0, tk.END)
+            entry.insert(0, value or "")
+        if birthday and re.fullmatch(r"\d{4}-\d{2}-\d{2}", birthday):
+            for entry, value in zip((birth_y, birth_m, birth_d), birthday.split("-")):
+                entry.delete(0, tk.END)
+                entry.insert(0, str(int(value)))
+        if gender:
+            gender_var.set(gender)
 
     tk.Label(win, text="氏名").grid(row=0, column=0)
-    name_entry = tk.Entry(win)
+    name_entry = SuggestEntry(
+        win, lambda text: [(f"{n}（{index.records[n][0]}）", n) for n in index.complete(text)],
+        on_pick=fill)
     name_entry.grid(row=0, column=1)
 
-    tk.Label(win, text="居室番号").grid(row=1, column=0)
-    room_entry = tk.Entry(win)
-    room_entry.grid(row=1, column=1)
+    tk.Label(win, text="ふりがな").grid(row=1, column=0)
+    reading_entry = tk.Entry(win)
+    reading_entry.grid(row=1, column=1)
 
-    tk.Label(win, text="生年月日").grid(row=2, column=0)
+    tk.Label(win, text="居室番号").grid(row=2, column=0)
+    room_entry = SuggestEntry(
+        win, lambda text: [(f"{room}　{name or '空室'}" if room not in ("保留", "退所") else room,
+                            room) for room, name in index.complete_room(text)])
+    room_entry.grid(row=2, column=1)
+
+    tk.Label(win, text="生年月日").grid(row=3, column=0)
     birth_y = tk.Entry(win, width=6)
-    birth_y.grid(row=2, column=1, sticky="w")
-    tk.Label(win, text="月").grid(row=2, column=1, padx=(40, 0))
+    birth_y.grid(row=3, column=1, sticky="w")
+    tk.Label(win, text="月").grid(row=3, column=1, padx=(40, 0))
 
     birth_m = tk.Entry(win, width=4)
-    birth_m.grid(row=2, column=1, padx=(80, 0), sticky="w")
-    tk.Label(win, text="日").grid(row=2, column=1, padx=(110, 0))
+    birth_m.grid(row=3, column=1, padx=(80, 0), sticky="w")
+    tk.Label(win, text="日").grid(row=3, column=1, padx=(110, 0))
 
     birth_d = tk.Entry(win, width=4)
-    birth_d.grid(row=2, column=1, padx=(140, 0), sticky="w")
-    tk.Label(win, text="日").grid(row=2, column=1, padx=(170, 0))
+    birth_d.grid(row=3, column=1, padx=(140, 0), sticky="w")
+    tk.Label(win, text="日").grid(row=3, column=1, padx=(170, 0))
 
     gender_var = tk.StringVar(value="男性")
-    tk.Radiobutton(win, text="男性", variable=gender_var, value="男性").grid(row=3, column=0)
-    tk.Radiobutton(win, text="女性", variable=gender_var, value="女性").grid(row=3, column=1)
+    tk.Radiobutton(win, text="男性", variable=gender_var, value="男性").grid(row=4, column=0)
+    tk.Radiobutton(win, text="女性", variable=gender_var, value="女性").grid(row=4, column=1)
 
     def register():
         name = name_entry.get().strip()
         room = room_entry.get().strip()
+        reading = reading_entry.get().strip()
         y, m, d = birth_y.get(), birth_m.get(), birth_d.get()
         try:
             birthday = f"{int(y):04d}-{int(m):02d}-{int(d):02d}"
@@ -962,10 +5269,10 @@ def manage_residents_ui(db_path, excel_path):
         if not name or not room:
             messagebox.showerror("エラー", "氏名と居室番号を入力してください")
             return
-        update_resident(name, room, birthday, gender, db_path, excel_path)
+        update_resident(name, room, birthday, gender, db_path, excel_path, reading=reading)
         messagebox.showinfo("完了", "登録が完了しました。")
 
-    tk.Button(win, text="新規登録", command=register).grid(row=4, column=0, columnspan=2, pady=10)
+    tk.Button(win, text="新規登録", command=register).grid(row=5, column=0, columnspan=2, pady=10)
 
     # ---------------------------------------------------------------------------
     #  個人ファイル転記メインフロー (GUI から呼ばれる想定)
@@ -988,10 +5295,31 @@ def personal_transfer(
         messagebox.showerror("エラー", "日勤と夜勤の担当者名を入力してください。")
         return
 
+    # 月次日誌は転記が終わるまでロックする（他の端末の転記は順番待ち）
+    target_file = base_dir / f"{date.year}_{date.month:02d}_処遇日誌.xlsx"
+    try:
+        with FileLock(target_file):
+            transfer_day(date, author_day, author_night, base_dir, template_xlsx)
+    except LockTimeout as e:
+        messagebox.showerror("ロック待ち", f"{e}\n時間をおいてもう一度実行してください。")
+
+
+def transfer_day(
+    date: dt.date,
+    author_day: str,
+    author_night: str,
+    base_dir: Path,
+    template_xlsx: Path,
+):
+    """personal_transfer の本体。月次日誌のロックを持った状態で呼ぶ。"""
     yyyy, mm = date.year, date.month
     target_file = base_dir / f"{yyyy}_{mm:02d}_処遇日誌.xlsx"
     db_path     = base_dir / f"diary_{yyyy}.db"
 
+    # --- 前回途中で止まった転記があれば先に仕上げる ---
+    create_database_if_not_exists(str(db_path))
+    resume_transfers(db_path, base_dir)
+
     # shutil.copyfile の方がメモリ効率◎
     if not target_file.exists():
         target_file.write_bytes(template_xlsx.read_bytes())
@@ -1003,37 +5331,111 @@ def personal_transfer(
         wb.close()
         return
 
-    sheet = wb[sheet_name]
+    # 「○日裏(2)」以降の続きページもまとめて1本として読む
+    sheets = ura_series(wb, sheet_name)
     night_tpl = wb["Header_Night"] if "Header_Night" in wb.sheetnames else None
 
-    entries = extract_entries(sheet)
-    if not entries:
-        messagebox.showinfo("確認", "転記対象の記事がありません。")
+    # --- 前回から変わっていないシートはすぐ終わる ---
+    # Footer は転記の後で貼られるので指紋から外す
+    skip = ()
+    if "Footer" in wb.sheetnames and wb["Footer"].cell(1, 1).value:
+        skip = (str(wb["Footer"].cell(1, 1).value),)
+    conn = connect_db(db_path)
+    previous = load_sheet_fingerprint(conn, target_file.name, sheet_name)
+    conn.close()
+    if previous and previous[0] == sheet_fingerprint(sheets, skip_names=skip):
+        messagebox.showinfo("確認", f"{sheet_name} は前回の転記から変更がありません。")
         wb.close()
         return
 
-    entries = add_authors(entries, author_day=author_day, author_night=author_night)
-
-    save_entries_to_db(entries, db_path, date=date)  # DB スキーマ存在確認必須
-
-    update_diary_sheet(sheet, template_sheet=night_tpl)
-    wb.save(target_file)
-    wb.close()
+    extracted = extract_series_entries(sheets, skip_names=skip)
+    # 前回の抽出結果と比べ、追加・修正されたエントリだけを流す
+    # 削除・修正前のエントリ（removed）は個人ファイル・台帳・DB から取り消す
+    if previous:
+        entries, removed = diff_entries(previous[1], extracted, date)
+    else:
+        entries, removed = extracted, []
+    if not extracted and not removed:
+        messagebox.showinfo("確認", "転記対象の記事がありません。")
+        wb.close()
+        return
 
-    # --- 個人ファイル転記 ---
-    if transfer_to_personal_files:
-        transfer_to_personal_files(entries, date, db_path, base_dir, template_xlsx)
+    # 氏名を名簿と照合（空白・敬称・旧字体の違いはそろえ、怪しいものは確認に回す）
+    # 名簿どおりの氏名だけなら入力補完と同じ索引で済ませ、名簿に無い氏名が
+    # 混じっているときだけ照合器（別名・表記ゆれ・誤字の候補探し）を作る
+    index = resident_index(db_path)
+    known = {e["name"]: index.lookup(e["name"]) for e in entries}
+    if all(known.values()):
+        entries = [dict(e, name=known[e["name"]]) for e in entries]
     else:
-        messagebox.showwarning("警告", "transfer_to_personal_files が見つかりません")
+        conn = connect_db(db_path)
+        entries, review = resolve_entry_names(entries, ResidentResolver.from_db(conn))
+        if review:
+            accepted = confirm_name_review(review)
+            record_name_review(conn, date, review, "accepted" if accepted else "rejected")
+            if not accepted:
+                conn.close()
+                wb.close()
+                return
+            candidates = {m["typed"]: m["name"] for m in review if m["status"] == "review"}
+            for e in entries:
+                e["name"] = candidates.get(e["name"], e["name"])
+        conn.close()
+    entries = add_authors(entries, author_day=author_day, author_night=author_night)
 
-    # --- 夜勤フッター ---
-    if any(e["shift"] == "夜勤" for e in entries):
-        if add_footer:
-            add_footer(str(target_file), sheet_name)
-        else:
-            messagebox.showwarning("警告", "add_footer が見つかりません")
+    # --- ここからパイプライン ---
+    # DB への書き込み（日誌行・ジャーナル・ポインタ・台帳・指紋）は writer スレッドに積み、
+    # 月次日誌の保存（ヘッダー・改ページ・Footer）と個人ファイルの転記は並行して進める。
+    writer = DBWriter(db_path)
+    ok = False
+    try:
+        writer.submit(insert_diary_rows, entries, date)   # DB スキーマ存在確認必須
+        _, missed = retract_entries(db_path, base_dir, date, removed, writer=writer)
+
+        conn = connect_db(db_path)
+        new_count = len(filter_untransferred(conn, entries, date))
+        conn.close()
+
+        # --- 個人ファイル転記 + 夜勤フッター（ジャーナル経由） ---
+        footer = None
+        if any(e["shift"] == "夜勤" for e in extracted):
+            footer = (str(target_file), sheet_name)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            diary_stage = pool.submit(finish_diary_book, wb, sheets, target_file,
+                                      night_tpl=night_tpl,
+                                      footer_sheet=sheet_name if footer else None)
+            run_id = transfer_to_personal_files(entries, date, db_path, base_dir,
+                                                template_xlsx, footer=footer,
+                                                writer=writer, diary_stage=diary_stage)
+
+        # ヘッダー貼付後のシートを次回の比較元にする（Footer だけのページは指紋に入らない）
+        sheets = ura_series(wb, sheet_name)
+        writer.submit(save_sheet_fingerprint, target_file.name, sheet_name, date,
+                      sheet_fingerprint(sheets, skip_names=skip),
+                      extract_series_entries(sheets, skip_names=skip))
+        ok = True
+    finally:
+        writer.close(commit=ok)
+        wb.close()
 
-    messagebox.showinfo("完了", "個人ファイルへの転記と DB 登録が完了しました。")
+    # 保存が重くなってきたファイルがあれば早めに知らせる
+    _, warnings = growth_report(db_path, run_id=run_id)
+    if warnings:
+        messagebox.showwarning("ファイルの肥大化",
+                               "\n".join(warnings) + "\n\n" + GROWTH_ADVICE)
+    if missed:
+        messagebox.showwarning("取り消せなかった記事",
+                               "次の個人ファイルのシートが見つからず、日裏から消えた記事を"
+                               "取り消せませんでした。手で訂正してください。\n" + "\n".join(missed))
+
+    if new_count == 0 and not removed:
+        messagebox.showinfo("確認", "この日の記事はすべて転記済みです。")
+        return
+    skipped = len(entries) - new_count
+    note = f"\n（転記済みの {skipped} 件は書き込みませんでした）" if skipped else ""
+    if removed:
+        note += f"\n（日裏から消えた・修正前の {len(removed)} 件を取り消しました）"
+    messagebox.showinfo("完了", "個人ファイルへの転記と DB 登録が完了しました。" + note)
 
 
 
@@ -1043,7 +5445,7 @@ def main_ui():
     """
     root = tk.Tk()
     root.title("処遇日誌アプリ")
-    root.geometry("300x500")
+    root.geometry("300x620")
 
 
     prefs = load_prefs()                 # ← ここで読込
@@ -1115,9 +5517,44 @@ def main_ui():
 
 
 
+    def run_transfer():
+        date = get_date()
+        if not date:
+            return
+        base = Path().resolve()
+        personal_transfer(
+            date,
+            author_day_var.get().strip(),
+            author_night_var.get().strip(),
+            base,
+            base / "Tre_diary_temp.xlsx",
+        )
+
+    def open_stats():
+        date = get_date()
+        if not date:
+            return
+        db_file = Path().resolve() / f"diary_{date.year}.db"
+        create_database_if_not_exists(str(db_file))
+        stats_report_ui(db_file)
+
+    def open_timeline():
+        date = get_date()
+        if not date:
+            return
+        base = Path().resolve()
+        timeline_ui(base, base / f"diary_{date.year}.db")
+
+    def open_handover():
+        handover_ui(Path().resolve())
+
     def open_resident_manager():
+        date = get_date()
+        if not date:
+            return
+        # 転記（transfer_day）と同じ年の DB の名簿を使う
         base = Path().resolve()
-        db_file = base / "diary_2025.db"
+        db_file = base / f"diary_{date.year}.db"
         excel_file = base / "入所者名簿.xlsx"
         create_database_if_not_exists(str(db_file))
         if not excel_file.exists():
@@ -1153,18 +5590,308 @@ def main_ui():
     tk.Button(root, text="日誌裏追加", font=("Arial", 14), command=add_extra_ura).grid(row=7, column=0, columnspan=2, pady=10)
     tk.Button(root, text="個人ファイルに転記",
           font=("Arial", 14),
-          command=personal_transfer).grid(row=8, column=0, columnspan=2, pady=10)
+          command=run_transfer).grid(row=8, column=0, columnspan=2, pady=10)
 
     tk.Button(root, text="入所者名簿管理", font=("Arial", 14), command=open_resident_manager).grid(row=9, column=0, columnspan=2, pady=10)
+    tk.Button(root, text="記録統計", font=("Arial", 14), command=open_stats).grid(row=10, column=0, columnspan=2, pady=10)
+    tk.Button(root, text="記録の振り返り", font=("Arial", 14), command=open_timeline).grid(row=11, column=0, columnspan=2, pady=10)
+    tk.Button(root, text="申し送り作成", font=("Arial", 14), command=open_handover).grid(row=12, column=0, columnspan=2, pady=10)
 
     root.mainloop()
 
 
+# ---------------------------------------------------------------------------
+#  コマンドライン（保守用）: 引数なしで起動すると GUI
+# ---------------------------------------------------------------------------
+
+def cli_main(argv: List[str]) -> int:
+    """
+    保守作業用のコマンドを実行する。
+      python WorkDiary.py migrate-layout resident_year
+      python WorkDiary.py stats 2025-07
+      python WorkDiary.py export --format jsonl --from 2025-04-01 --floor 2階
+      python WorkDiary.py archive --retired-days 365
+      python WorkDiary.py history 宮本武蔵
+      python WorkDiary.py growth
+      python WorkDiary.py handover --floor 2階 --hours 48
+      python WorkDiary.py slim-personal
+      python WorkDiary.py plan --from 2025-07-01 --to 2025-07-31 --out plan.json
+      python WorkDiary.py apply-plan plan.json
+      python WorkDiary.py backup --keep 30
+      python WorkDiary.py restore 20250715-230000 --file diary_2025.db
+      python WorkDiary.py compact --days 180 --vacuum
+      python WorkDiary.py sync --dir //server/共有/日誌同期
+    """
+    base = Path().resolve()
+    parser = argparse.ArgumentParser(prog="WorkDiary.py")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("migrate-layout", help="階ごとの個人ファイルを分割レイアウトへ移行")
+    p.add_argument("layout", choices=[l for l in PERSONAL_LAYOUTS if l != "floor"])
+    p.add_argument("--year", type=int, default=dt.date.today().year,
+                   help="ポインタ DB の年（diary_{year}.db）")
+
+    p = sub.add_parser("stats", help="月次の記録統計を表示")
+    p.add_argument("month", help="YYYY-MM")
+    p.add_argument("--days", type=int, default=7, help="記事なしとみなす日数")
+
+    p = sub.add_parser("export", help="日誌データを CSV / JSONL で出力")
+    p.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    p.add_argument("--from", dest="date_from", type=dt.date.fromisoformat,
+                   help="開始日 YYYY-MM-DD")
+    p.add_argument("--to", dest="date_to", type=dt.date.fromisoformat,
+                   help="終了日 YYYY-MM-DD")
+    p.add_argument("--floor", choices=tuple(FLOOR_SQL))
+    p.add_argument("--resident")
+    p.add_argument("--since-last", metavar="NAME",
+                   help="NAME で前回出力した分より後に追加された行だけを出す")
+    p.add_argument("--year", type=int, action="append",
+                   help="対象 DB の年（複数指定可。省略時は --from〜--to の年）")
+    p.add_argument("--out", default="-", help="出力ファイル（省略時は標準出力）")
+
+    p = sub.add_parser("archive", help="退所者・過年度のシートをアーカイブへ移す")
+    p.add_argument("--retired-days", type=int, default=RETIRED_ARCHIVE_DAYS,
+                   help="退所後この日数記事が無い入所者をアーカイブする")
+    p.add_argument("--closed-before", type=int, metavar="WAREKI",
+                   help="この令和年より前のシートをアーカイブする（省略時は今年）")
+    p.add_argument("--year", type=int, default=dt.date.today().year,
+                   help="ポインタ DB の年（diary_{year}.db）")
+
+    p = sub.add_parser("history", help="入所者の記録があるシートの所在を表示")
+    p.add_argument("name")
+    p.add_argument("--year", type=int, default=dt.date.today().year,
+                   help="ポインタ DB の年（diary_{year}.db）")
+
+    p = sub.add_parser("growth", help="個人ファイル・日誌ファイルの大きさと保存時間の予測を表示")
+    p.add_argument("--year", type=int, default=dt.date.today().year,
+                   help="ポインタ DB の年（diary_{year}.db）")
+
+    p = sub.add_parser("handover", help="直近の記事から申し送り表を作成")
+    p.add_argument("--floor", choices=("2階", "3階"))
+    p.add_argument("--hours", type=int, default=HANDOVER_HOURS[0])
+
+    sub.add_parser("slim-personal", help="個人ファイルから日誌用シート・不要な書式を取り除く")
+
+    p = sub.add_parser("plan", help="未転記の記事の転記先を、個人ファイルを開かずに表示")
+    p.add_argument("--from", dest="date_from", type=dt.date.fromisoformat, required=True,
+                   help="開始日 YYYY-MM-DD")
+    p.add_argument("--to", dest="date_to", type=dt.date.fromisoformat,
+                   help="終了日 YYYY-MM-DD（省略時は開始日のみ）")
+    p.add_argument("--out", help="計画を JSON で保存する（apply-plan で反映）")
+
+    p = sub.add_parser("apply-plan", help="plan --out で保存した計画をそのまま反映")
+    p.add_argument("plan_file")
+
+    p = sub.add_parser("backup", help="日誌・個人ファイル・DB の差分バックアップを取る")
+    p.add_argument("--keep", type=int, default=BACKUP_KEEP, help="残すスナップショットの数")
+
+    sub.add_parser("backups", help="バックアップの一覧を表示")
+
+    p = sub.add_parser("restore", help="バックアップを書き出す")
+    p.add_argument("snapshot", help="スナップショット ID（backups で確認）")
+    p.add_argument("--to", help=f"書き出し先（省略時は {RESTORE_DIR}/ID）")
+    p.add_argument("--file", action="append", help="このファイルだけ戻す（複数指定可）")
+
+    p = sub.add_parser("compact", help="古い月の記事本文を圧縮して DB を小さくする")
+    p.add_argument("--days", type=int, help="これより古い月を圧縮（省略時は prefs の cold_after_days）")
+    p.add_argument("--year", type=int, action="append",
+                   help="対象 DB の年（複数指定可。省略時はすべての diary_YYYY.db）")
+    p.add_argument("--retrain", action="store_true", help="圧縮用の辞書を作り直す")
+    p.add_argument("--vacuum", action="store_true", help="圧縮後に VACUUM で空きを詰める")
+
+    p = sub.add_parser("sync", help="共有フォルダ経由で他の端末と変更を受け渡す")
+    p.add_argument("--dir", help="共有フォルダ（省略時は prefs の sync_dir）")
+    p.add_argument("--year", type=int, default=dt.date.today().year,
+                   help="対象 DB の年（diary_{year}.db）")
+    mode = p.add_mutually_exclusive_group()
+    mode.add_argument("--export-only", action="store_true", help="書き出しだけ行う")
+    mode.add_argument("--import-only", action="store_true", help="取り込みだけ行う")
+
+    args = parser.parse_args(argv)
+
+    # GUI の起動時と同じく、先に年ごとの DB のスキーマを最新にしておく
+    # （古い DB のまま init_personal_tables などを通すと変更ログが作れない）
+    for db_path in migrate_databases(base):
+        print(f"{db_path.name} を最新の形式にできませんでした（他の端末が書き込み中）。",
+              file=sys.stderr)
+
+    if args.command == "migrate-layout":
+        moved = migrate_personal_layout(base, base / f"diary_{args.year}.db",
+                                        args.layout, base / "Tre_diary_temp.xlsx")
+        for target, sheets in moved.items():
+            print(f"{target}: {', '.join(sheets)}")
+    elif args.command == "stats":
+        db_path = base / f"diary_{args.month[:4]}.db"
+        create_database_if_not_exists(str(db_path))
+        print(format_stats_report(db_path, args.month, args.days))
+    elif args.command == "export":
+        years = args.year
+        if not years:
+            first = (args.date_from or args.date_to or dt.date.today()).year
+            last = (args.date_to or dt.date.today()).year
+            years = list(range(first, last + 1))
+        out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8", newline="")
+        try:
+            total, first = 0, True
+            for year in years:
+                db_path = base / f"diary_{year}.db"
+                if not db_path.exists():
+                    continue
+                # CSV の見出しは最初の DB の分だけ
+                sink = out if first or args.format == "jsonl" else _SkipFirstLine(out)
+                first = False
+                total += export_entries(
+                    db_path, sink, fmt=args.format,
+                    date_from=args.date_from, date_to=args.date_to,
+                    floor=args.floor, resident=args.resident,
+                    since_last=args.since_last,
+                )
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        print(f"{total} 件を出力しました。", file=sys.stderr)
+    elif args.command == "archive":
+        moved = archive_personal_sheets(base, base / f"diary_{args.year}.db",
+                                        retired_days=args.retired_days,
+                                        closed_before=args.closed_before)
+        for target, sheets in moved.items():
+            print(f"{target}: {', '.join(sheets)}")
+    elif args.command == "history":
+        for file, sheet, archived in resident_history(base / f"diary_{args.year}.db", args.name):
+            print(f"{file}\t{sheet}" + ("\t(アーカイブ)" if archived else ""))
+    elif args.command == "growth":
+        print(format_growth_report(base / f"diary_{args.year}.db"))
+    elif args.command == "handover":
+        print(write_handover_report(base, hours=args.hours, floor=args.floor))
+    elif args.command == "slim-personal":
+        for file in hot_personal_files(base):
+            before, after = slim_personal_file(base / file)
+            print(f"{file}: {before:,} → {after:,} バイト")
+    elif args.command == "plan":
+        # ポインタ・台帳は年ごとの DB にあるので、1 つの計画は 1 年の中に限る
+        if args.date_to and args.date_to.year != args.date_from.year:
+            print("年をまたぐ期間は計画できません。年ごとに分けて plan / apply-plan してください。",
+                  file=sys.stderr)
+            return 1
+        db_path = base / f"diary_{args.date_from.year}.db"
+        create_database_if_not_exists(str(db_path))
+        days = untransferred_entries(db_path, args.date_from, args.date_to)
+        plan = plan_transfer(
+            [(dt.date.fromisoformat(d), entries) for d, entries in days.items()],
+            db_path, base, base / "Tre_diary_temp.xlsx",
+        )
+        conn = connect_db(db_path)
+        store_plan_catalog(conn, plan)
+        conn.commit()
+        conn.close()
+        print(format_transfer_plan(plan))
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump({k: v for k, v in plan.items() if k != "scanned"}, f,
+                          ensure_ascii=False)
+    elif args.command == "apply-plan":
+        with open(args.plan_file, encoding="utf-8") as f:
+            plan = json.load(f)
+        if not plan["plans"]:
+            print("転記する記事はありません。")
+            return 0
+        if {p["date"][:4] for p in plan["plans"]} != {plan["date"][:4]}:
+            print("年をまたぐ計画は反映できません。年ごとに plan からやり直してください。",
+                  file=sys.stderr)
+            return 1
+        try:
+            run_id = apply_transfer_plan(plan, base / f"diary_{plan['date'][:4]}.db", base)
+        except StalePlan as e:
+            print(f"{e}\nもう一度 plan からやり直してください。", file=sys.stderr)
+            return 1
+        print(f"{len(plan['plans'])} 件を転記しました（run {run_id}）。")
+    elif args.command == "backup":
+        result = backup_snapshot(base)
+        print(f"{result['id']}: {result['files']} ファイルを保存、{result['reused']} ファイルは変更なし"
+              f"（新しい塊 {result['objects_bytes'] / 1e6:.1f} MB）")
+        for rel in result["skipped"]:
+            print(f"  使用中のため前回の分を使用: {rel}")
+        removed, objects = prune_backups(base, args.keep)
+        if removed:
+            print(f"古いスナップショット {removed} 個と塊 {objects} 個を削除しました。")
+    elif args.command == "backups":
+        print(format_backups(base))
+    elif args.command == "restore":
+        dest = Path(args.to) if args.to else base / RESTORE_DIR / args.snapshot
+        restored = restore_snapshot(base, args.snapshot, dest, files=args.file)
+        print(f"{len(restored)} ファイルを {dest} に書き出しました。")
+    elif args.command == "compact":
+        if args.year:
+            db_paths = [base / f"diary_{year}.db" for year in args.year]
+        else:
+            db_paths = sorted(p for p in base.glob("diary_*.db")
+                              if re.fullmatch(r"diary_\d{4}\.db", p.name))
+        for db_path in db_paths:
+            if not db_path.exists():
+                continue
+            create_database_if_not_exists(str(db_path))
+            result = compact_cold_entries(db_path, older_than_days=args.days,
+                                          retrain=args.retrain)
+            line = (f"{db_path.name}: {result['entries']} 件を {result['blocks']} ブロックに圧縮"
+                    f"（{result['raw_bytes']:,} → {result['packed_bytes']:,} バイト）")
+            if args.vacuum and result["entries"]:
+                before, after = vacuum_db(db_path)
+                line += f"、DB {before:,} → {after:,} バイト"
+            print(line)
+    elif args.command == "sync":
+        sync_dir = args.dir or load_prefs().get("sync_dir")
+        if not sync_dir:
+            print("共有フォルダを --dir か prefs.json の sync_dir で指定してください。", file=sys.stderr)
+            return 1
+        db_path = base / f"diary_{args.year}.db"
+        create_database_if_not_exists(str(db_path))
+        init_personal_tables(str(db_path))
+        if not args.import_only:
+            print(f"書き出し: {export_changes(db_path, Path(sync_dir))} 件")
+        if not args.export_only:
+            result = import_changes(db_path, Path(sync_dir))
+            print(f"取り込み: {result['files']} ファイル、反映 {result['applied']} 件、"
+                  f"競合で不採用 {result['skipped']} 件")
+        rows, files = prune_change_log(db_path, Path(sync_dir))
+        if rows or files:
+            print(f"片付け: 変更ログ {rows} 行、変更ファイル {files} 個")
+    return 0
+
+
+class _SkipFirstLine:
+    """
+    書き込まれた最初の 1 行だけを捨てるストリーム（CSV 見出しの重複防止）。
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.skipping = True
+
+    def write(self, text: str):
+        if self.skipping:
+            head, sep, rest = text.partition("\n")
+            if not sep:
+                return
+            self.skipping = False
+            text = rest
+        if text:
+            self.out.write(text)
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(cli_main(sys.argv[1:]))
+
+    # 年ごとの DB のスキーマを最新にしておく（閲覧・出力は読み取り専用で開く）
+    migrate_databases(Path().resolve())
+
     # 今年の DB パスを決めてテーブルを保証
     db_file = Path().resolve() / f"diary_{dt.datetime.now().year}.db"
     init_personal_tables(str(db_file))
 
+    # 前回の転記が途中で止まっていれば続きから仕上げる
+    resume_transfers(str(db_file), Path().resolve())
+
     # メイン画面
     main_ui()
 
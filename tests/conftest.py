@@ -0,0 +1,40 @@
+import sys
+from pathlib import Path
+
+import openpyxl
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import WorkDiary as W  # noqa: E402
+
+
+@pytest.fixture
+def messages(monkeypatch):
+    """
+    messagebox を差し替え、出したメッセージを (種類, タイトル, 本文) で記録する。
+    """
+    shown = []
+    for kind in ("showinfo", "showwarning", "showerror"):
+        monkeypatch.setattr(W.messagebox, kind,
+                            lambda title, text, *a, _kind=kind, **k: shown.append((_kind, title, text)))
+    return shown
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch, messages):
+    """
+    一時フォルダに年の DB と名簿ファイルを作り、宮本 武蔵（201）と沖田 総司（202）を登録する。
+    """
+    monkeypatch.setattr(W, "PREF_FILE", tmp_path / "prefs.json")
+    db = tmp_path / "diary_2026.db"
+    W.create_database_if_not_exists(str(db))
+    W.init_personal_tables(str(db))
+    roster = tmp_path / "入所者名簿.xlsx"
+    openpyxl.Workbook().save(roster)
+    W.update_resident("宮本 武蔵", "201", "1930-01-02", "男性", str(db), str(roster),
+                      reading="みやもと むさし")
+    W.update_resident("沖田 総司", "202", "1940-01-01", "男性", str(db), str(roster),
+                      reading="おきた そうじ")
+    return tmp_path, db, roster
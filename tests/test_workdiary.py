@@ -0,0 +1,577 @@
+import datetime as dt
+import json
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import openpyxl
+import pytest
+
+import WorkDiary as W
+
+TEMPLATE = Path(W.__file__).with_name("Tre_diary_temp.xlsx")
+DATE = dt.date(2026, 5, 1)
+PERSONAL = "2階個人ファイル.xlsx"
+
+
+def entry(name, content, shift="日勤", author="日勤者"):
+    return {"name": name, "content": content, "shift": shift, "author": author}
+
+
+def sheet_rows(path, sheet, first=4, last=12):
+    wb = openpyxl.load_workbook(path)
+    rows = [[c.value for c in r] for r in wb[sheet].iter_rows(min_row=first, max_row=last,
+                                                              max_col=4)]
+    wb.close()
+    return [r for r in rows if any(v is not None for v in r)]
+
+
+def query(db, sql, *args):
+    conn = W.connect_db(db)
+    try:
+        return conn.execute(sql, args).fetchall()
+    finally:
+        conn.close()
+
+
+# --- ジャーナル（保存の後・コミットの前に落ちた転記の再開） ---
+
+def test_resume_after_crash_between_save_and_commit(workdir, monkeypatch):
+    base, db, _ = workdir
+    ents = [entry("宮本 武蔵", "散歩した\nよく笑った"), entry("沖田 総司", "良眠")]
+
+    def crash(*args, **kwargs):
+        raise RuntimeError("落ちた")
+
+    with monkeypatch.context() as m:
+        m.setattr(W, "commit_file_progress", crash)
+        with pytest.raises(RuntimeError):
+            W.transfer_to_personal_files(ents, DATE, str(db), base, TEMPLATE)
+
+    # 個人ファイルは保存済み、ポインタと台帳は未確定
+    assert (base / PERSONAL).exists()
+    assert query(db, "SELECT state FROM transfer_runs") == [("planned",)]
+    assert query(db, "SELECT * FROM transfer_ledger") == []
+
+    run_ids = W.resume_transfers(db, base)
+    assert len(run_ids) == 1
+    assert query(db, "SELECT state FROM transfer_runs") == [("done",)]
+    assert query(db, "SELECT DISTINCT state FROM transfer_journal") == [("done",)]
+    assert sorted(query(db, "SELECT name, next_row FROM personal_pointer")) == [
+        ("宮本 武蔵", 6), ("沖田 総司", 5)]
+    # 同じ行に書き直すだけで二重にはならない
+    assert sheet_rows(base / PERSONAL, "宮本 武蔵") == [
+        ["5/1", "金", "散歩した", None], [None, None, "よく笑った", "日勤者"]]
+    assert W.resume_transfers(db, base) == []
+
+
+# --- 転記台帳（再実行で二重に書かない） ---
+
+def test_ledger_skips_entries_on_rerun(workdir):
+    base, db, _ = workdir
+    ents = [entry("宮本 武蔵", "散歩した"), entry("沖田 総司", "良眠")]
+    W.transfer_to_personal_files(ents, DATE, str(db), base, TEMPLATE)
+    before = sheet_rows(base / PERSONAL, "宮本 武蔵")
+
+    conn = W.connect_db(db)
+    assert W.filter_untransferred(conn, ents, DATE) == []
+    conn.close()
+    plan = W.plan_transfer([(DATE, ents)], db, base, TEMPLATE)
+    assert plan["plans"] == []
+
+    W.transfer_to_personal_files(ents + [entry("宮本 武蔵", "入浴した")], DATE, str(db),
+                                 base, TEMPLATE)
+    assert sheet_rows(base / PERSONAL, "宮本 武蔵") == before + [
+        ["5/1", "金", "入浴した", "日勤者"]]
+    assert len(query(db, "SELECT * FROM transfer_ledger")) == 3
+
+
+# --- 指紋と差分（日裏の修正・削除） ---
+
+def test_diff_entries_reports_added_and_removed():
+    previous = [entry("宮本 武蔵", "散歩した"), entry("沖田 総司", "良眠"),
+                entry("沖田 総司", "良眠")]
+    current = [entry("宮本 武蔵", "散歩した（修正）"), entry("沖田 総司", "良眠")]
+    added, removed = W.diff_entries(previous, current, DATE)
+    assert added == [entry("宮本 武蔵", "散歩した（修正）")]
+    # 同じ内容が 1 件でも残っていれば取り消さない
+    assert removed == [entry("宮本 武蔵", "散歩した")]
+    assert W.diff_entries(current, current, DATE) == ([], [])
+
+
+def write_ura(path, rows):
+    wb = openpyxl.load_workbook(path if path.exists() else TEMPLATE)
+    if "1日裏" in wb.sheetnames:
+        del wb["1日裏"]
+    ws = wb.copy_worksheet(wb["B_temp"])
+    ws.title = "1日裏"
+    for r in range(2, 40):
+        ws.cell(r, 1).value = ws.cell(r, 2).value = None
+    for r, (name, content) in enumerate(rows, start=2):
+        ws.cell(r, 1).value, ws.cell(r, 2).value = name, content
+    wb.save(path)
+
+
+def test_transfer_day_retracts_edited_and_deleted_entries(workdir, messages):
+    base, db, _ = workdir
+    diary = base / "2026_05_処遇日誌.xlsx"
+    write_ura(diary, [("宮本 武蔵", "散歩した"), (None, "よく笑った"), ("沖田 総司", "良眠")])
+    W.transfer_day(DATE, "日勤者", "夜勤者", base, TEMPLATE)
+
+    # 修正: 修正前の行は取り消し、修正後を新しく転記する
+    write_ura(diary, [("宮本 武蔵", "散歩した"), (None, "よく眠った"), ("沖田 総司", "良眠")])
+    W.transfer_day(DATE, "日勤者", "夜勤者", base, TEMPLATE)
+    assert sheet_rows(base / PERSONAL, "宮本 武蔵") == [
+        ["5/1", "金", W.RETRACTED_TEXT, None], [None, None, "〃", None],
+        ["5/1", "金", "散歩した", None], [None, None, "よく眠った", "日勤者"]]
+
+    # 削除: 転記はせずに取り消しだけ
+    messages.clear()
+    write_ura(diary, [("宮本 武蔵", "散歩した"), (None, "よく眠った")])
+    W.transfer_day(DATE, "日勤者", "夜勤者", base, TEMPLATE)
+    assert sheet_rows(base / PERSONAL, "沖田 総司") == [["5/1", "金", W.RETRACTED_TEXT, None]]
+    assert "取り消しました" in messages[-1][2]
+
+    assert query(db, "SELECT resident_name, content FROM diary_entries_text") == [
+        ("宮本 武蔵", "散歩した\nよく眠った")]
+    assert query(db, "SELECT name, start_row, end_row FROM transfer_ledger") == [
+        ("宮本 武蔵", 6, 7)]
+
+    # 変更の無いシートは指紋だけで終わる
+    messages.clear()
+    W.transfer_day(DATE, "日勤者", "夜勤者", base, TEMPLATE)
+    assert messages == [("showinfo", "確認", "1日裏 は前回の転記から変更がありません。")]
+
+
+# --- 同期（表記ゆれのある同じ入所者の競合） ---
+
+def test_sync_converges_on_name_key(workdir, monkeypatch):
+    base, _, roster = workdir
+    share = base / "share"
+    dbs = {}
+    for pc in ("A", "B"):
+        (base / pc).mkdir()
+        dbs[pc] = base / pc / "diary_2026.db"
+        W.create_database_if_not_exists(str(dbs[pc]))
+        W.init_personal_tables(str(dbs[pc]))
+
+    def as_pc(pc):
+        W.PREF_FILE.write_text(json.dumps({"sync_origin": pc}), encoding="utf-8")
+
+    def sync(pc):
+        as_pc(pc)
+        sent = W.export_changes(dbs[pc], share)
+        got = W.import_changes(dbs[pc], share)
+        W.prune_change_log(dbs[pc], share)
+        return sent, got["applied"]
+
+    as_pc("A")
+    W.update_resident("宮本 武蔵", "301", "1930-01-02", "男性", str(dbs["A"]), str(roster))
+    W.save_entries_to_db([entry("宮本 武蔵", "散歩", author="a")], dbs["A"], date=DATE)
+    time.sleep(1.1)                 # 版の時刻は秒単位。B の方を後の変更にする
+    as_pc("B")
+    W.update_resident("宮本　武蔵", "201", "1930-01-02", "男性", str(dbs["B"]), str(roster))
+    W.save_entries_to_db([entry("宮本　武蔵", "散歩", author="b")], dbs["B"], date=DATE)
+
+    for _ in range(2):
+        for pc in ("A", "B"):
+            sync(pc)
+    for pc in ("A", "B"):
+        assert query(dbs[pc], "SELECT name, room FROM residents") == [("宮本　武蔵", "201")]
+        assert query(dbs[pc], "SELECT resident_name, author FROM diary_entries") == [
+            ("宮本　武蔵", "b")]
+    # 収束した後は何も送らない・何も反映しない
+    assert [sync(pc) for pc in ("A", "B")] == [(0, 0), (0, 0)]
+
+
+# --- 入力補完の索引（差分での追加・居室の移動） ---
+
+def test_resident_index_updates_incrementally(workdir):
+    _, db, roster = workdir
+    index = W.resident_index(db)
+    assert index.complete("みや") == ["宮本 武蔵"]
+
+    W.update_resident("土方 歳三", "203", "1935-05-05", "男性", str(db), str(roster),
+                      reading="ひじかた としぞう")
+    assert W.resident_index(db) is index          # 作り直さずに差分で更新
+    assert index.complete("ひじ") == ["土方 歳三"]
+    assert index.complete("とし") == ["土方 歳三"]
+
+    # 同じ居室に入ると前の入所者は保留に移る
+    W.update_resident("近藤 勇", "201", "1934-11-09", "男性", str(db), str(roster))
+    assert W.resident_index(db) is index
+    assert index.records["宮本 武蔵"][0] == "保留"
+    assert index.occupants["201"] == "近藤 勇"
+    assert index.lookup("近藤勇") == "近藤 勇"
+
+    conn = W.connect_db(db)
+    assert index.version == W.roster_version(conn)
+    conn.close()
+
+
+def test_legacy_database_is_migrated_before_change_log(tmp_path, monkeypatch, messages, capsys):
+    monkeypatch.setattr(W, "PREF_FILE", tmp_path / "prefs.json")
+    monkeypatch.chdir(tmp_path)
+    db = tmp_path / "diary_2025.db"
+    conn = W.sqlite3.connect(db)
+    # この一連の変更より前の形（content_hash・name_key・変更ログが無い）
+    conn.executescript("""
+        CREATE TABLE residents (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL,
+                                room TEXT NOT NULL, birthday TEXT, gender TEXT);
+        CREATE TABLE diary_entries (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    resident_name TEXT NOT NULL, date TEXT NOT NULL,
+                                    shift TEXT CHECK(shift IN ('日勤', '夜勤')),
+                                    content TEXT, author TEXT);
+        INSERT INTO residents (name, room) VALUES ('宮本 武蔵', '201');
+        INSERT INTO diary_entries (resident_name, date, shift, content, author)
+        VALUES ('宮本 武蔵', '2025-07-01', '日勤', '散歩', 'a');
+    """)
+    conn.close()
+
+    # 移行前に個人用の表を作っても落ちず、変更ログの記録も後に回る
+    W.init_personal_tables(str(db))
+    assert W.cli_main(["history", "宮本武蔵", "--year", "2025"]) == 0
+    capsys.readouterr()
+
+    assert W.export_changes(db, tmp_path / "share") == 2
+
+
+# --- 重複防止（氏名は照合キーで比べる） ---
+
+def test_entries_deduplicate_on_name_key(workdir):
+    _, db, _ = workdir
+    W.save_entries_to_db([entry("宮本　武蔵", "散歩")], db, date=DATE)
+    W.save_entries_to_db([entry("宮本 武蔵", "散歩")], db, date=DATE)
+    assert query(db, "SELECT resident_name, name_key FROM diary_entries") == [
+        ("宮本　武蔵", "宮本武蔵")]
+
+    # 生の氏名で一意にしていた頃の DB は、移行で重複をまとめる
+    conn = W.connect_db(db)
+    conn.execute("DROP INDEX uniq_entry_key")
+    conn.execute("""CREATE UNIQUE INDEX uniq_entry_hash
+                    ON diary_entries(resident_name, date, shift, content_hash)""")
+    W.insert_diary_rows(conn, [entry("宮本 武蔵", "散歩")], DATE)
+    conn.commit()
+    conn.close()
+    assert len(query(db, "SELECT * FROM diary_entries")) == 2
+    W.create_database_if_not_exists(str(db))
+    assert query(db, "SELECT resident_name FROM diary_entries") == [("宮本　武蔵",)]
+    assert query(db, "SELECT name FROM sqlite_master WHERE name LIKE 'uniq_entry%'") == [
+        ("uniq_entry_key",)]
+
+
+# --- 転記の計画（plan / apply-plan） ---
+
+@pytest.fixture
+def cli(workdir, monkeypatch, capsys):
+    base = workdir[0]
+    monkeypatch.chdir(base)
+    (base / "Tre_diary_temp.xlsx").write_bytes(TEMPLATE.read_bytes())
+
+    def run(*argv):
+        code = W.cli_main(list(argv))
+        out = capsys.readouterr()
+        return code, out.out + out.err
+    return run
+
+
+def test_plan_resolves_name_variants_before_routing(workdir, cli):
+    base, db, _ = workdir
+    W.save_entries_to_db([entry("宮本　武蔵", "散歩")], db, date=DATE)   # 名簿と表記が違う行
+
+    code, out = cli("plan", "--from", "2026-05-01", "--out", "plan.json")
+    assert code == 0
+    assert "退所者" not in out
+    plan = json.loads((base / "plan.json").read_text(encoding="utf-8"))
+    assert [(p["file"], p["name"], p["sheet"]) for p in plan["plans"]] == [
+        (PERSONAL, "宮本 武蔵", "宮本 武蔵")]
+
+    assert cli("apply-plan", "plan.json")[0] == 0
+    assert sheet_rows(base / PERSONAL, "宮本 武蔵") == [["5/1", "金", "散歩", "日勤者"]]
+    # 転記済みなので次の計画には出ない
+    cli("plan", "--from", "2026-05-01", "--out", "plan.json")
+    assert json.loads((base / "plan.json").read_text(encoding="utf-8"))["plans"] == []
+
+
+def test_apply_plan_rejects_stale_plan(workdir, cli):
+    base, db, _ = workdir
+    W.save_entries_to_db([entry("宮本 武蔵", "散歩")], db, date=DATE)
+    cli("plan", "--from", "2026-05-01", "--out", "plan.json")
+    cli("apply-plan", "plan.json")
+
+    W.save_entries_to_db([entry("宮本 武蔵", "入浴")], db, date=DATE)
+    cli("plan", "--from", "2026-05-01", "--out", "plan.json")
+    # 計画の後に個人ファイルが書き換わった
+    wb = openpyxl.load_workbook(base / PERSONAL)
+    wb["宮本 武蔵"].cell(5, 3).value = "手で追記"
+    wb.save(base / PERSONAL)
+
+    code, out = cli("apply-plan", "plan.json")
+    assert code == 1 and "plan からやり直して" in out
+    assert sheet_rows(base / PERSONAL, "宮本 武蔵")[-1] == [None, None, "手で追記", None]
+    assert len(query(db, "SELECT * FROM transfer_ledger")) == 1
+
+
+def test_plan_rejects_ranges_across_years(cli):
+    code, out = cli("plan", "--from", "2025-12-30", "--to", "2026-01-02")
+    assert code == 1 and "年をまたぐ" in out
+
+
+# --- 個人ファイルのレイアウト移行 ---
+
+def test_migrate_layout_resumes_after_crash_and_repoints_every_year(workdir, monkeypatch):
+    base, db, _ = workdir
+    W.transfer_to_personal_files([entry("宮本 武蔵", "散歩")], DATE, str(db), base, TEMPLATE)
+    # 前の年の DB の台帳も同じファイルを指している
+    old_db = base / "diary_2025.db"
+    W.create_database_if_not_exists(str(old_db))
+    W.init_personal_tables(str(old_db))
+    conn = W.connect_db(old_db)
+    conn.execute("""INSERT INTO transfer_ledger VALUES
+                    ('k', '2025-12-01', '宮本 武蔵', '日勤', ?, '宮本 武蔵', 4, 4, 1)""",
+                 (PERSONAL,))
+    conn.commit()
+    conn.close()
+
+    real_replace = W.os.replace
+
+    def crash_on_backup(src, dst):
+        if Path(dst).parent.name == "移行前":
+            raise OSError("落ちた")
+        return real_replace(src, dst)
+
+    with monkeypatch.context() as m:
+        m.setattr(W.os, "replace", crash_on_backup)
+        with pytest.raises(OSError):
+            W.migrate_personal_layout(base, db, "resident", TEMPLATE)
+    assert (base / PERSONAL).exists()       # 元のファイルはまだ退避していない
+
+    moved = W.migrate_personal_layout(base, db, "resident", TEMPLATE)
+    target = W.personal_file_for("201", "宮本 武蔵", 2026, "resident")
+    assert moved == {target: ["宮本 武蔵"]}
+    assert not (base / PERSONAL).exists()
+    assert (base / W.PERSONAL_DIR / "移行前" / PERSONAL).exists()
+    assert sheet_rows(base / target, "宮本 武蔵") == [["5/1", "金", "散歩", "日勤者"]]
+    for path in (db, old_db):
+        assert query(path, "SELECT DISTINCT file FROM transfer_ledger") == [(target,)]
+    assert query(db, "SELECT file FROM personal_pointer") == [(target,)]
+
+
+# --- アーカイブ（読み取り専用ブックへの退避） ---
+
+def test_archive_sheet_is_retracted_in_place_and_found_by_variant(workdir, messages):
+    base, db, roster = workdir
+    diary = base / "2026_05_処遇日誌.xlsx"
+    write_ura(diary, [("宮本 武蔵", "散歩した"), ("沖田 総司", "良眠")])
+    W.transfer_day(DATE, "日勤者", "夜勤者", base, TEMPLATE)
+
+    # 退所した沖田さんのシートをアーカイブへ
+    W.update_resident("沖田 総司", "退所", "1940-01-01", "男性", str(db), str(roster))
+    moved = W.archive_personal_sheets(base, db, retired_days=0)
+    archive = W.archive_file_for(8)
+    assert moved == {archive: ["沖田 総司"]}
+    assert query(db, "SELECT file FROM transfer_ledger WHERE name = '沖田 総司'") == [(archive,)]
+
+    # 表記ゆれのある氏名でも所在が出る
+    assert W.resident_history(db, "沖田　総司") == W.resident_history(db, "沖田 総司") == [
+        (archive, "沖田 総司", True)]
+
+    # 日裏から消すと、読み取り専用の退避先でも取り消し、属性は元に戻す
+    write_ura(diary, [("宮本 武蔵", "散歩した")])
+    W.transfer_day(DATE, "日勤者", "夜勤者", base, TEMPLATE)
+    path = base / archive
+    assert not path.stat().st_mode & W.stat.S_IWRITE
+    assert sheet_rows(path, "沖田 総司") == [["5/1", "金", W.RETRACTED_TEXT, None]]
+    wb = openpyxl.load_workbook(path)
+    assert wb["沖田 総司"].protection.sheet and wb.security.lockStructure
+    wb.close()
+    assert not any(kind == "showwarning" for kind, _, _ in messages)
+    assert query(db, "SELECT * FROM transfer_ledger WHERE name = '沖田 総司'") == []
+
+
+def test_retraction_warns_when_sheet_is_missing(workdir, messages):
+    base, db, _ = workdir
+    diary = base / "2026_05_処遇日誌.xlsx"
+    write_ura(diary, [("宮本 武蔵", "散歩した"), ("沖田 総司", "良眠")])
+    W.transfer_day(DATE, "日勤者", "夜勤者", base, TEMPLATE)
+    wb = openpyxl.load_workbook(base / PERSONAL)
+    del wb["沖田 総司"]
+    wb.save(base / PERSONAL)
+
+    write_ura(diary, [("宮本 武蔵", "散歩した")])
+    W.transfer_day(DATE, "日勤者", "夜勤者", base, TEMPLATE)
+    warnings = [text for kind, _, text in messages if kind == "showwarning"]
+    assert len(warnings) == 1 and f"{PERSONAL} 沖田 総司" in warnings[0]
+    # 取り消せなかった行の台帳は残す
+    assert query(db, "SELECT file FROM transfer_ledger WHERE name = '沖田 総司'") == [(PERSONAL,)]
+
+
+# --- 集計（入所者は照合キーでまとめる） ---
+
+def test_stats_group_spelling_variants_by_name_key(workdir):
+    _, db, roster = workdir
+    W.save_entries_to_db([entry("宮本 武蔵", "散歩")], db, date=DATE)
+    W.save_entries_to_db([entry("宮本　武蔵", "入浴", shift="夜勤")], db,
+                         date=dt.date(2026, 5, 3))
+
+    assert W.monthly_stats(db, "2026-05")["resident"] == [("宮本 武蔵", 1, 1, 2)]
+    assert query(db, "SELECT name_key, last_date FROM stats_last_entry") == [
+        ("宮本武蔵", "2026-05-03")]
+    inactive = W.inactive_residents(db, 7, today=dt.date(2026, 5, 5))
+    assert [(name, last) for name, _, last in inactive] == [("沖田 総司", None)]
+
+    # 記事を消すと最新日も引き直す
+    conn = W.connect_db(db)
+    conn.execute("DELETE FROM diary_entries WHERE date = '2026-05-03'")
+    conn.commit()
+    assert conn.execute("SELECT last_date FROM stats_last_entry").fetchall() == [("2026-05-01",)]
+    # 氏名でまとめていた頃の集計表は作り直す
+    for trigger in ("trg_stats_insert", "trg_stats_delete", "trg_stats_update"):
+        conn.execute(f"DROP TRIGGER {trigger}")
+    conn.execute("DROP TABLE stats_monthly")
+    conn.execute("""CREATE TABLE stats_monthly (ym TEXT, resident_name TEXT, shift TEXT,
+                    author TEXT, entries INTEGER, PRIMARY KEY (ym, resident_name, shift, author))""")
+    conn.commit()
+    conn.close()
+    W.create_database_if_not_exists(str(db))
+    assert W.monthly_stats(db, "2026-05")["resident"] == [("宮本 武蔵", 1, 0, 1)]
+
+
+# --- 申し送り表（DB は読み取り専用で開く） ---
+
+def test_handover_report_reads_db_without_migrating(workdir):
+    base, db, _ = workdir
+    W.save_entries_to_db([entry("宮本 武蔵", "発熱 37.8℃")], db, date=dt.date(2026, 1, 1))
+    conn = W.connect_db(db)
+    conn.execute("DROP INDEX idx_residents_name")
+    conn.commit()
+    conn.close()
+
+    # 前年の DB は無いので飛ばす（作らない）
+    path = W.write_handover_report(base, hours=48, now=dt.datetime(2026, 1, 1, 9, 0))
+    assert not (base / "diary_2025.db").exists()
+    assert query(db, "SELECT name FROM sqlite_master WHERE name = 'idx_residents_name'") == []
+
+    wb = openpyxl.load_workbook(path)
+    values = [c.value for row in wb.active.iter_rows() for c in row]
+    wb.close()
+    assert "宮本 武蔵" in values and "発熱 37.8℃" in values
+
+
+# --- ファイルロック ---
+
+def test_file_lock_reentrant_in_thread_and_released_on_error(tmp_path):
+    target = tmp_path / PERSONAL
+    outer = W.FileLock(target, timeout=0.5)
+    with pytest.raises(RuntimeError):
+        with outer:
+            with W.FileLock(target, timeout=0.5):       # 同じスレッドは待たない
+                assert outer._depth == 2
+            assert outer.lock_path.exists()
+            raise RuntimeError("転記の途中で失敗")
+
+    assert not outer.lock_path.exists()
+    assert not outer.queue_dir.exists()
+    assert W._held_locks == {}
+
+
+def test_file_lock_other_thread_waits_for_release(tmp_path, monkeypatch):
+    monkeypatch.setattr(W, "LOCK_POLL", 0.02)
+    target = tmp_path / PERSONAL
+    results = []
+
+    def other(timeout):
+        try:
+            with W.FileLock(target, timeout=timeout):
+                results.append("取得")
+        except W.LockTimeout:
+            results.append("待ち切れず")
+
+    with W.FileLock(target):
+        t = threading.Thread(target=other, args=(0.2,))
+        t.start()
+        t.join()
+        waiting = threading.Thread(target=other, args=(5,))
+        waiting.start()
+        time.sleep(0.1)
+        assert results == ["待ち切れず"]            # 別スレッドは持ち分を共有しない
+    waiting.join()
+    assert results == ["待ち切れず", "取得"]
+    assert W._held_locks == {}
+
+
+def test_file_lock_breaks_lock_left_by_dead_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(W, "LOCK_POLL", 0.02)
+    target = tmp_path / PERSONAL
+    lock = W.FileLock(target, timeout=1)
+    lock.lock_path.write_text(f"dead\n{socket.gethostname()}\n99999999\n", encoding="utf-8")
+
+    with lock:
+        assert W._read_stamp(lock.lock_path)[0] == lock.token
+    assert not lock.lock_path.exists()
+
+
+# --- バックアップ（スナップショット・復元・整理） ---
+
+def test_backup_snapshot_restore_and_prune(workdir):
+    base, db, roster = workdir
+    W.save_entries_to_db([entry("宮本 武蔵", "散歩")], db, date=DATE)
+    first = W.backup_snapshot(base)
+    assert first["files"] == 2 and first["reused"] == 0 and first["skipped"] == []
+
+    # 変わっていないファイルは読まずに前回の分を使う
+    W.save_entries_to_db([entry("沖田 総司", "良眠")], db, date=DATE)
+    second = W.backup_snapshot(base)
+    assert (second["files"], second["reused"]) == (1, 1)
+    store = W.BackupStore(base / W.BACKUP_DIR)
+    assert store.snapshots() == [first["id"], second["id"]]
+
+    dest = base / W.RESTORE_DIR
+    restored = W.restore_snapshot(base, first["id"], dest)
+    assert sorted(restored) == sorted([db.name, roster.name])
+    assert query(dest / db.name, "SELECT resident_name FROM diary_entries") == [("宮本 武蔵",)]
+    assert sheet_rows(dest / roster.name, "Sheet", first=1) == sheet_rows(roster, "Sheet", first=1)
+    assert (dest / roster.name).stat().st_mtime_ns == roster.stat().st_mtime_ns
+
+    # 古いスナップショットと、どこからも使われない DB の塊を消す
+    pruned, removed = W.prune_backups(base, keep=1)
+    assert pruned == 1 and removed > 0
+    assert store.snapshots() == [second["id"]]
+    W.restore_snapshot(base, second["id"], dest, files=[db.name])
+    assert sorted(query(dest / db.name, "SELECT resident_name FROM diary_entries")) == [
+        ("宮本 武蔵",), ("沖田 総司",)]
+
+
+# --- 書き込みスレッド（ロックで失敗したらコミット以降の仕事をやり直す） ---
+
+def test_db_writer_replays_uncommitted_jobs_after_lock(tmp_path, monkeypatch):
+    monkeypatch.setattr(W.time, "sleep", lambda s: None)
+    db = tmp_path / "writer.db"
+    conn = W.connect_db(db)
+    conn.execute("CREATE TABLE log (step TEXT)")
+    conn.commit()
+    conn.close()
+    calls = []
+
+    def put(conn, step):
+        calls.append(step)
+        conn.execute("INSERT INTO log VALUES (?)", (step,))
+
+    def flaky(conn):
+        calls.append("flaky")
+        put(conn, "後")
+        if calls.count("flaky") == 1:
+            raise sqlite3.OperationalError("database is locked")
+
+    writer = W.DBWriter(db)
+    writer.submit(put, "確定済み")
+    writer.submit(lambda conn: conn.commit())
+    writer.submit(put, "前")
+    writer.submit(flaky)
+    writer.close()
+
+    # コミット済みの仕事はやり直さず、未コミットの「前」だけを積み直す
+    assert calls == ["確定済み", "前", "flaky", "後", "前", "flaky", "後"]
+    assert query(db, "SELECT step FROM log ORDER BY rowid") == [("確定済み",), ("前",), ("後",)]